@@ -0,0 +1,53 @@
+"""Compare `callfunc` with the printed-output parser it replaced.
+
+Usage: python benchmarks/bench_callfunc.py [--size 1000] [--repeat 3]
+"""
+
+import argparse
+import time
+
+from rtopy import callfunc_legacy
+from rtopy.rtopy import _callfunc_cache, callfunc
+
+R_CODE = """my_func <- function(n) {{
+    set.seed(1);
+    matrix(rnorm(n * n), n, n)
+}}"""
+
+
+def best_of(repeat, fn, *args, **kwargs):
+    """Fastest of `repeat` runs, in seconds, and the last result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def uncached(**kwargs):
+    _callfunc_cache.clear()
+    return callfunc(**kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    opts = parser.parse_args()
+
+    kwargs = dict(r_code=R_CODE, r_func="my_func", type_return="list", n=opts.size)
+    legacy, old = best_of(opts.repeat, callfunc_legacy, **kwargs)
+    structured, new = best_of(opts.repeat, uncached, **kwargs)
+
+    print(f"{opts.size}x{opts.size} matrix, best of {opts.repeat}")
+    print(f"  legacy text parser : {legacy:8.3f} s")
+    print(f"  structured         : {structured:8.3f} s  ({legacy / structured:.1f}x)")
+    kept = sum(len(row) for row in old) if old and isinstance(old[0], list) else 0
+    print(f"  values kept        : legacy {kept}, structured {opts.size ** 2}")
+    if len(new) != opts.size or len(new[0]) != opts.size:
+        raise SystemExit("structured result has the wrong shape")
+
+
+if __name__ == "__main__":
+    main()
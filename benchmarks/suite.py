@@ -0,0 +1,286 @@
+"""Benchmark suite for the bridge: latency, throughput and (de)serialization.
+
+Usage:
+    python benchmarks/suite.py run [--output FILE] [--quick] [--only PATTERN]
+    python benchmarks/suite.py compare BASELINE RESULTS [--threshold 0.25]
+
+`run` writes one JSON document with the environment and a record per
+benchmark (median, min and max seconds, runs, peak traced memory).
+Benchmarks that need R are skipped when Rscript is not on PATH.
+`compare` matches records by name and exits with status 1 when any
+median is slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import datetime
+import fnmatch
+import json
+import platform
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import rtopy
+from rtopy import RBridge, RBridgePool, callfunc
+from rtopy import codec
+from rtopy.rtopy import _callfunc_cache
+
+SIZES = (10**3, 10**4, 10**5, 10**6, 10**7)
+QUICK_SIZES = (10**3, 10**4, 10**5)
+# Sizes above this are skipped for the JSON-only paths, which are too slow
+JSON_LIMIT = 10**6
+HAS_R = shutil.which("Rscript") is not None
+
+SCALAR_CODE = "f <- function(x) x + 1"
+ECHO_CODE = "echo <- function(x) x"
+
+
+def measure(fn, min_time=0.2, max_runs=50, trace=True):
+    """Time fn() until `min_time` has elapsed (at least once) and return stats."""
+    times = []
+    start = time.perf_counter()
+    while not times or (
+        time.perf_counter() - start < min_time and len(times) < max_runs
+    ):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    peak = None
+    if trace:
+        # A separate traced run: tracing slows allocations down
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+        "runs": len(times),
+        "peak_bytes": peak,
+    }
+
+
+def make_array(n):
+    return np.random.default_rng(0).standard_normal(n)
+
+
+def make_frame(n):
+    """A frame of about n values over four typed columns."""
+    rows = max(1, n // 4)
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "x": rng.standard_normal(rows),
+            "k": rng.integers(0, 1000, rows, dtype="int32"),
+            "flag": rng.random(rows) > 0.5,
+            "g": pd.Categorical(rng.choice(["a", "b", "c"], rows)),
+        }
+    )
+
+
+def response_payload(value):
+    """The frame payload a worker would send back for `value`."""
+    buffers = []
+    if isinstance(value, pd.DataFrame):
+        spec = codec.encode_frame(value, buffers)
+    else:
+        spec = codec.encode_array(value, buffers)
+    raw = [bytearray(memoryview(b).cast("B")) for b in buffers]
+    return [json.dumps(spec).encode("utf-8")] + raw
+
+
+def serialization_benchmarks(sizes):
+    """Encode, decode and convert arrays and frames, without R."""
+    rb = RBridge.__new__(RBridge)  # conversion needs no R process
+    for kind, make in (("array", make_array), ("frame", make_frame)):
+        for n in sizes:
+            value = make(n)
+            params = {"kind": kind, "n": n}
+            yield f"encode/binary/{kind}/{n:.0e}", params, lambda: rb._encode_args(
+                {"x": value}
+            )
+            payload = response_payload(value)
+            yield f"decode/binary/{kind}/{n:.0e}", params, lambda: rb._convert_output(
+                rb._decode_payload(payload), "auto"
+            )
+            if n > JSON_LIMIT:
+                continue
+            # The JSON path every argument took before binary buffers
+            yield f"encode/json/{kind}/{n:.0e}", params, lambda: json.dumps(
+                {"x": rb._to_jsonable(value)}
+            )
+            text = json.dumps(rb._to_jsonable(value))
+            yield f"decode/json/{kind}/{n:.0e}", params, lambda: rb._convert_output(
+                json.loads(text), kind == "frame" and "pandas" or "numpy"
+            )
+
+
+def latency_benchmarks(persistent, pool):
+    """Round trip of a scalar call through each way of calling R."""
+
+    def uncached_callfunc():
+        _callfunc_cache.clear()
+        return callfunc(SCALAR_CODE, "f", "float", x=1)
+
+    one_shot = RBridge()
+    yield "latency/callfunc", {}, uncached_callfunc
+    yield "latency/call/one-shot", {}, lambda: one_shot.call(SCALAR_CODE, "f", x=1)
+    yield "latency/call/persistent", {}, lambda: persistent.call(
+        SCALAR_CODE, "f", x=1
+    )
+    yield "latency/call/pool", {}, lambda: pool.call(SCALAR_CODE, "f", x=1)
+
+
+def throughput_benchmarks(persistent, pool, calls=200):
+    """Batches of small calls; compare seconds per batch."""
+    params = {"calls": calls}
+
+    def sequential():
+        for i in range(calls):
+            persistent.call(SCALAR_CODE, "f", x=i)
+
+    def pooled():
+        for f in [pool.submit(SCALAR_CODE, "f", x=i) for i in range(calls)]:
+            f.result()
+
+    def mapped():
+        persistent.map(SCALAR_CODE, "f", [{"x": i} for i in range(calls)])
+
+    yield "throughput/persistent", params, sequential
+    yield "throughput/pool", params, pooled
+    yield "throughput/map", params, mapped
+
+
+def transport_benchmarks(persistent, shared, sizes):
+    """Array round trips through R by payload size and transport."""
+    one_shot = RBridge()
+    for n in sizes:
+        value = make_array(n)
+        params = {"n": n}
+        if n <= JSON_LIMIT:
+            yield f"roundtrip/one-shot/{n:.0e}", params, lambda: one_shot.call(
+                ECHO_CODE, "echo", x=value
+            )
+        yield f"roundtrip/persistent/{n:.0e}", params, lambda: persistent.call(
+            ECHO_CODE, "echo", x=value
+        )
+        yield f"roundtrip/shm/{n:.0e}", params, lambda: shared.call(
+            ECHO_CODE, "echo", x=value
+        )
+
+
+def environment():
+    info = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rtopy": rtopy.__version__,
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "r": None,
+    }
+    if HAS_R:
+        info["r"] = rtopy.find_r().version
+    return info
+
+
+def run(opts):
+    sizes = QUICK_SIZES if opts.quick else SIZES
+    groups = [serialization_benchmarks(sizes)]
+    closers = []
+    if HAS_R:
+        persistent = RBridge(persistent=True)
+        shared = RBridge(persistent=True, shm_threshold=0)
+        pool = RBridgePool(size=4)
+        closers = [persistent.close, shared.close, pool.close]
+        groups += [
+            latency_benchmarks(persistent, pool),
+            throughput_benchmarks(persistent, pool),
+            transport_benchmarks(persistent, shared, sizes),
+        ]
+    else:
+        print("Rscript not found: running the serialization benchmarks only")
+
+    results = []
+    try:
+        for group in groups:
+            for name, params, fn in group:
+                if opts.only and not fnmatch.fnmatch(name, opts.only):
+                    continue
+                fn()  # warm up: workers, registered code, caches
+                record = dict(name=name, params=params, **measure(fn))
+                results.append(record)
+                print(f"{name:40s} {record['median'] * 1e3:10.3f} ms")
+    finally:
+        for close in closers:
+            close()
+
+    doc = {"environment": environment(), "results": results}
+    with open(opts.output, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+    print(f"wrote {len(results)} results to {opts.output}")
+    return 0
+
+
+def compare(opts):
+    with open(opts.baseline, encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    with open(opts.results, encoding="utf-8") as f:
+        current = {r["name"]: r for r in json.load(f)["results"]}
+
+    regressions = 0
+    for name, new in current.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:40s} {'new':>10s}")
+            continue
+        ratio = new["median"] / old["median"] if old["median"] else float("inf")
+        # Sub-threshold absolute differences are noise, whatever the ratio
+        slower = (
+            ratio > 1 + opts.threshold
+            and new["median"] - old["median"] > opts.min_delta
+        )
+        regressions += slower
+        flag = "REGRESSION" if slower else ""
+        print(f"{name:40s} {ratio:9.2f}x {flag}")
+    for name in baseline.keys() - current.keys():
+        print(f"{name:40s} {'missing':>10s}")
+
+    print(f"{regressions} regression(s) over {opts.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="run the benchmarks and save them as JSON")
+    p.add_argument("--output", default="benchmarks/results.json")
+    p.add_argument("--quick", action="store_true", help="sizes up to 1e5 only")
+    p.add_argument("--only", help="glob on benchmark names, e.g. 'decode/*'")
+    p.set_defaults(func=run)
+
+    p = sub.add_parser("compare", help="flag regressions against a baseline")
+    p.add_argument("baseline")
+    p.add_argument("results")
+    p.add_argument("--threshold", type=float, default=0.25,
+                   help="allowed slowdown of the median (default: 0.25)")
+    p.add_argument("--min-delta", type=float, default=1e-4,
+                   help="ignore slowdowns below this many seconds")
+    p.set_defaults(func=compare)
+
+    opts = parser.parse_args(argv)
+    return opts.func(opts)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
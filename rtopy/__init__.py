@@ -3,16 +3,30 @@
 __author__ = """T. Moudiki"""
 __email__ = "thierry.moudiki@gmail.com"
 
-"""rtopy: Lightweight R-Python bridge."""
-from .rtopy import callfunc
+# rtopy: Lightweight R-Python bridge.
+from .rtopy import callfunc, callfunc_legacy
 from .bridge import RBridge, call_r
+from .pool import RBridgePool
+from .cache import RObjectCache, ResultCache
+from .handles import RObjectHandle
+from .profiling import RProfile
+from .discovery import find_r
+from .worker import register_profile
 from .exceptions import RExecutionError, RNotFoundError, RTypeError
 
 __version__ = "0.2.0"
 __all__ = [
     "RBridge",
+    "RBridgePool",
+    "ResultCache",
+    "RObjectCache",
+    "RObjectHandle",
+    "RProfile",
+    "find_r",
+    "register_profile",
     "call_r",
     "callfunc",
+    "callfunc_legacy",
     "RExecutionError",
     "RNotFoundError",
     "RTypeError",
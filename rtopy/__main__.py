@@ -0,0 +1,21 @@
+"""Entry point of the `rtopy` command and `python -m rtopy`."""
+
+import sys
+
+
+def main():
+    """Run the command line, which needs the optional click package."""
+    try:
+        from .cli import main as cli
+    except ImportError as e:
+        if e.name != "click":
+            raise
+        sys.exit(
+            "The rtopy command needs click. Install with: "
+            "pip install rtopy[cli]"
+        )
+    cli()
+
+
+if __name__ == "__main__":
+    main()
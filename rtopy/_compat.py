@@ -0,0 +1,60 @@
+"""Lazy access to the optional numpy, pandas and scipy dependencies.
+
+Importing pandas takes hundreds of milliseconds, so rtopy only checks
+whether the packages are installed and imports them on first use. A value
+can only be a NumPy or pandas object once its package has been imported,
+so the type checks below never trigger an import themselves.
+"""
+
+import importlib.util
+import sys
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+HAS_PANDAS = importlib.util.find_spec("pandas") is not None
+HAS_SCIPY = importlib.util.find_spec("scipy") is not None
+
+
+def numpy():
+    """Import and return numpy."""
+    import numpy
+
+    return numpy
+
+
+def pandas():
+    """Import and return pandas."""
+    import pandas
+
+    return pandas
+
+
+def scipy_sparse():
+    """Import and return scipy.sparse."""
+    import scipy.sparse
+
+    return scipy.sparse
+
+
+def is_ndarray(obj) -> bool:
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(obj, np.ndarray)
+
+
+def is_numpy_scalar(obj) -> bool:
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(obj, np.generic)
+
+
+def is_dataframe(obj) -> bool:
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(obj, pd.DataFrame)
+
+
+def is_series(obj) -> bool:
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(obj, pd.Series)
+
+
+def is_sparse(obj) -> bool:
+    sparse = sys.modules.get("scipy.sparse")
+    return sparse is not None and sparse.issparse(obj)
@@ -1,33 +1,78 @@
 """Core bridge functionality."""
 
-import subprocess
+import asyncio
+import collections
+import contextlib
+import hashlib
 import json
-import tempfile
-import os
-from typing import Any, Dict, List, Union, Optional
+import threading
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from .exceptions import RExecutionError, RNotFoundError, RTypeError
+from . import codec
+from .cache import RObjectCache, ResultCache, stable_hash
+from .discovery import find_r
+from .exceptions import RExecutionError, RTypeError
+from .handles import RObjectHandle
+from .profiling import RProfile
+from .stats import CallStats, CallTimer
+from .worker import AsyncRWorker, RWorker, _as_list, get_profile
 
-# Optional dependencies
-try:
-    import numpy as np
+# Optional dependencies, imported on first use
+from ._compat import (
+    HAS_NUMPY,
+    HAS_PANDAS,
+    HAS_SCIPY,
+    is_dataframe,
+    is_ndarray,
+    is_series,
+    is_sparse,
+    numpy,
+    pandas,
+    scipy_sparse,
+)
 
-    HAS_NUMPY = True
-except ImportError:
-    HAS_NUMPY = False
 
-try:
-    import pandas as pd
+# NumPy dtypes of R's atomic vector types, for values that came as JSON.
+# R integers are 32-bit, like the arrays decoded from binary buffers.
+_R_NUMPY_DTYPES = {"double": "float64", "integer": "int32", "logical": "bool"}
+# Python types of length-one R atomic vectors
+_R_SCALAR_TYPES = {"double": "float", "integer": "int", "logical": "bool"}
+# Classes of plain (unclassed) R vectors, matrices and arrays
+_R_PLAIN_CLASSES = {"numeric", "integer", "logical", "matrix", "array"}
 
-    HAS_PANDAS = True
-except ImportError:
-    HAS_PANDAS = False
+# Seconds between Rprof samples in profiled calls
+PROFILE_INTERVAL = 0.005
 
 
 class RBridge:
     """Lightweight bridge for calling R functions from Python."""
 
-    def __init__(self, timeout: int = 300, verbose: bool = False):
+    def __init__(
+        self,
+        timeout: int = 300,
+        verbose: bool = False,
+        persistent: bool = False,
+        shm_threshold: Optional[int] = 64 * 2**20,
+        compile: bool = False,
+        cache: Optional[ResultCache] = None,
+        preload: Optional[List[str]] = None,
+        setup: Optional[str] = None,
+        profile: Optional[str] = None,
+        object_cache: Optional[RObjectCache] = None,
+    ):
         """
         Initialize R bridge.
 
@@ -37,30 +82,226 @@ class RBridge:
             Maximum execution time in seconds (default: 300)
         verbose : bool
             Print R warnings and messages (default: False)
+        persistent : bool
+            Keep one long-lived R process and send every call to it,
+            instead of starting a new Rscript per call (default: False)
+        shm_threshold : int or None
+            Buffers of at least this many bytes are passed to the worker,
+            persistent or one-shot, through files in shared memory instead
+            of the socket. None sends everything through the socket
+            (default: 64 MiB)
+        compile : bool
+            Byte-compile the functions defined by each `r_code` with
+            `compiler::cmpfun` when a worker first evaluates it. This pays
+            off in persistent mode; a one-shot call compiles on every call
+            (default: False)
+        cache : ResultCache or None
+            Cache of results keyed by the code, function, return type and
+            argument contents; a hit skips R entirely (default: None)
+        preload : list of str or None
+            R packages to attach once when a worker starts, instead of on
+            every call (default: None)
+        setup : str or None
+            R code run once in the global environment when a worker
+            starts, after `preload` (default: None)
+        profile : str or None
+            Name of a warm-start profile from `register_profile`; its
+            packages and setup code come before `preload` and `setup`
+            (default: None)
+        object_cache : RObjectCache or None
+            On-disk cache of the objects returned with
+            `return_type="handle"`, keyed by the code, function and
+            arguments; a hit loads the saved object into the worker instead
+            of calling the function (default: None)
         """
         self.timeout = timeout
         self.verbose = verbose
+        self.persistent = persistent
+        self.shm_threshold = shm_threshold
+        self.compile = compile
+        self.cache = cache
+        self.object_cache = object_cache
+        self.preload: List[str] = []
+        setups = []
+        if profile is not None:
+            spec = get_profile(profile)
+            self.preload.extend(spec["preload"])
+            setups.append(spec["setup"])
+        self.preload.extend(preload or [])
+        setups.append(setup)
+        self.setup = "\n".join(s for s in setups if s) or None
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        # asyncio locks belong to one event loop, so keep one per loop
+        self._async_locks: "weakref.WeakKeyDictionary" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._async_locks_guard = threading.Lock()
+        self._stats = CallStats()
         self._check_r()
 
-    def _check_r(self):
-        """Verify R is available."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stop the persistent R worker, if one is running."""
+        with self._worker_lock:
+            if self._worker is not None:
+                self._worker.close()
+                self._worker = None
+
+    def _get_worker(self) -> RWorker:
+        """Return the persistent worker, (re)starting it if needed."""
+        with self._worker_lock:
+            if self._worker is None or not self._worker.alive:
+                self._worker = self._new_worker()
+            return self._worker
+
+    def _new_worker(self) -> RWorker:
+        return RWorker(
+            timeout=self.timeout,
+            verbose=self.verbose,
+            shm_threshold=self.shm_threshold,
+            preload=self.preload,
+            setup=self.setup,
+        )
+
+    @property
+    def startup_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Startup timings of the persistent worker, in seconds.
+
+        "startup" covers launching R, "packages" maps each preloaded
+        package to its load time and "setup" is the setup code. None until
+        the worker has started.
+        """
+        worker = self._worker
+        return dict(worker.startup_stats) if worker is not None else None
+
+    def resident_objects(self) -> Dict[str, Any]:
+        """
+        Memory footprint of the objects held for `RObjectHandle`s.
+
+        Returns the number of objects, their total `object.size()` in
+        bytes and a list of {"id", "class", "bytes"} per object, for the
+        persistent worker; empty when no worker is running.
+        """
+        worker = self._worker
+        objects = []
+        if worker is not None and worker.alive:
+            objects = worker.describe_objects()
+        for obj in objects:
+            obj["class"] = _as_list(obj["class"])
+            obj["bytes"] = int(obj["bytes"])
+        return {
+            "count": len(objects),
+            "bytes": sum(obj["bytes"] for obj in objects),
+            "objects": objects,
+        }
+
+    @property
+    def last_call_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Timing breakdown of the latest `call` or `acall`, None before one.
+
+        "phases" maps each phase to seconds: "cache" (result cache
+        lookup), "encode" (arguments), "spawn" and "packages" (starting a
+        worker and preloading), "send", then the R side "r_parse" (code
+        evaluation), "r_args", "r_call" and "r_encode" (result
+        serialization), "transfer" (waiting time R does not account for),
+        "decode" (JSON parsing and buffers), "convert" and "shutdown" (of a
+        one-shot worker). "spans" lists the same phases in order with their
+        offset from "started" (a Unix time); "bytes_out" and "bytes_in" are
+        the sizes of the request and response frames.
+        """
+        return self._stats.last
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Cumulative statistics of every `call` and `acall` on this bridge.
+
+        Returns the number of calls, cache hits and errors, and a histogram
+        for the total time, each phase (see `last_call_stats`) and the
+        bytes sent and received. A histogram has a count, total, mean, min,
+        max and "buckets", a list of (upper bound, count) pairs.
+        """
+        return self._stats.to_dict()
+
+    def reset_stats(self):
+        """Clear the statistics returned by `stats`."""
+        self._stats.reset()
+
+    def add_hook(self, hook: Callable[[Dict[str, Any]], None]):
+        """
+        Call `hook` with the stats of every finished call.
+
+        The hook receives the same dict as `last_call_stats`, including
+        failed calls (with an "error" message), from the thread that made
+        the call. Exceptions it raises are turned into warnings.
+
+        Examples
+        --------
+        >>> def export(call):
+        ...     for span in call["spans"]:
+        ...         start = call["started"] + span["start"]
+        ...         tracer.record(span["name"], start, span["duration"])
+        >>> rb.add_hook(export)
+        """
+        self._stats.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[Dict[str, Any]], None]):
+        """Stop calling a hook added with `add_hook`."""
+        self._stats.hooks.remove(hook)
+
+    @contextlib.contextmanager
+    def _session_worker(self, timer: Optional[CallTimer] = None):
+        """
+        Worker for a multi-request operation: the persistent worker, or a
+        transient one that is stopped when the operation ends.
+        """
+        if self.persistent:
+            yield self._get_worker()
+            return
+        start = timer.now() if timer is not None else None
+        worker = self._new_worker()
+        if timer is not None:
+            self._record_startup(timer, start, worker)
         try:
-            subprocess.run(
-                ["Rscript", "--version"],
-                capture_output=True,
-                check=True,
-                timeout=5,
-            )
-        except subprocess.TimeoutExpired:
-            raise RNotFoundError("R check timed out")
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            raise RNotFoundError(
-                "R not found. Please install R and add to PATH.\n"
-                "Download from: https://cran.r-project.org/"
-            )
+            yield worker
+        finally:
+            if timer is None:
+                worker.close()
+            else:
+                with timer.phase("shutdown"):
+                    worker.close()
+
+    @staticmethod
+    def _record_startup(timer: CallTimer, start: float, worker: RWorker):
+        """Record the time since `start` spent starting `worker`."""
+        startup = worker.startup_stats
+        loading = sum((startup.get("packages") or {}).values()) + startup.get(
+            "setup", 0.0
+        )
+        elapsed = timer.now() - start
+        timer.add("spawn", start, elapsed - loading)
+        if loading:
+            timer.add("packages", start + elapsed - loading, loading)
+
+    def _check_r(self):
+        """Verify R is available; R is only probed once per process."""
+        find_r()
 
     def call(
-        self, r_code: str, r_func: str, return_type: str = "auto", **kwargs
+        self,
+        r_code: str,
+        r_func: str,
+        return_type: str = "auto",
+        rprof: bool = False,
+        rprof_memory: bool = False,
+        **kwargs,
     ) -> Any:
         """
         Call R function with automatic type conversion.
@@ -73,13 +314,25 @@ class RBridge:
             Function name to call
         return_type : str
             Output type: "auto", "int", "float", "str", "bool",
-            "list", "dict", "numpy", "pandas", "raw"
+            "list", "dict", "numpy", "pandas", "sparse" (a SciPy CSC
+            matrix), "raw", or "handle" to keep the result in the
+            persistent worker and get an `RObjectHandle` to it
+        rprof : bool
+            Run the function under R's sampling profiler, `Rprof`, and
+            return an `RProfile` with the result. Profiled calls bypass
+            the result cache and evaluate `r_code` again, keeping its
+            source so that samples point to its lines (default: False)
+        rprof_memory : bool
+            Also record memory allocations; implies `rprof`
+            (default: False)
         **kwargs
-            Arguments passed to R function
+            Arguments passed to R function; every name except the ones
+            above
 
         Returns
         -------
-        Result converted to requested Python type
+        Result converted to requested Python type, or a (result, RProfile)
+        tuple when profiling
 
         Raises
         ------
@@ -107,114 +360,961 @@ class RBridge:
         ... '''
         >>> rb.call(code, "summarize", return_type="dict", x=[1,2,3,4,5])
         {'mean': 3.0, 'sd': 1.58..., 'n': 5}
+        >>>
+        >>> # Where a slow function spends its time
+        >>> fit, prof = rb.call(rf_code, "train_rf", rprof=True, n=5000)
+        >>> list(prof.functions())[:3]
+        ['randomForest.default', 'train_rf', 'matrix']
+        >>> prof.dump_folded("train_rf.folded")  # for flamegraph.pl
+        >>>
+        >>> # Train once, predict many times
+        >>> rb = RBridge(persistent=True)
+        >>> model = rb.call(rf_code, "train_rf", return_type="handle", n=5000)
+        >>> rb.call(rf_code, "predict_rf", model=model, newdata=batch)
+        """
+        if r_func not in r_code:
+            raise ValueError(f"Function '{r_func}' not found in r_code")
+
+        settings = self._profile_settings(rprof, rprof_memory)
+        timer = CallTimer("call", r_func)
+        try:
+            result = self._timed_call(
+                r_code, r_func, return_type, kwargs, timer, settings
+            )
+        except BaseException as e:
+            timer.finish(e)
+            self._stats.record(timer)
+            raise
+        timer.finish()
+        self._stats.record(timer)
+        return result
+
+    def _timed_call(
+        self,
+        r_code: str,
+        r_func: str,
+        return_type: str,
+        kwargs: Dict,
+        timer: CallTimer,
+        profile: Optional[Dict] = None,
+    ) -> Any:
+        key = None
+        if profile is None:
+            key = self._cache_key(r_code, r_func, return_type, kwargs)
+        if key is not None:
+            with timer.phase("cache"):
+                found, value = self.cache.get(key)
+            if found:
+                timer.cached = True
+                return value
+
+        resident = self._check_resident(return_type)
+        if self.persistent:
+            parsed, response, worker = self._execute_worker(
+                r_code, r_func, kwargs, None, timer, profile, resident
+            )
+        else:
+            # A fresh R process per call, driven like a persistent worker:
+            # the code and arguments are sent as bytes, not written into a
+            # script file for R to parse.
+            with self._session_worker(timer) as worker:
+                parsed, response, _ = self._execute_worker(
+                    r_code, r_func, kwargs, worker, timer, profile
+                )
+
+        with timer.phase("convert"):
+            result = self._result(parsed, response, worker, return_type)
+        if key is not None:
+            self.cache.set(key, result)
+        if profile is not None:
+            report = response.get("profile") or ""
+            return result, RProfile.parse(report, r_code)
+        return result
+
+    def _check_resident(self, return_type: str) -> bool:
+        """Whether the call keeps its result in the worker."""
+        if return_type != "handle":
+            return False
+        if not self.persistent:
+            raise ValueError(
+                "return_type='handle' needs RBridge(persistent=True): a "
+                "one-shot worker stops when the call returns"
+            )
+        return True
+
+    def _result(
+        self, parsed: Any, response: Dict, worker: RWorker, return_type: str
+    ) -> Any:
+        """Python value of a call's decoded output."""
+        if return_type == "handle":
+            return RObjectHandle(
+                worker,
+                parsed["id"],
+                _as_list(parsed["class"]),
+                parsed["bytes"],
+            )
+        return self._convert_output(
+            parsed, return_type, response.get("schema")
+        )
+
+    @staticmethod
+    def _profile_settings(rprof: bool, memory: bool) -> Optional[Dict]:
+        """Profiler settings sent to R, or None when not profiling."""
+        if not (rprof or memory):
+            return None
+        return {"interval": PROFILE_INTERVAL, "memory": bool(memory)}
+
+    async def acall(
+        self,
+        r_code: str,
+        r_func: str,
+        return_type: str = "auto",
+        rprof: bool = False,
+        rprof_memory: bool = False,
+        **kwargs,
+    ) -> Any:
+        """
+        Asynchronous version of `call`.
+
+        The event loop keeps running while R works. One-shot calls start
+        their R process with asyncio subprocesses and streams, so
+        concurrent calls cost no thread each; the persistent worker is
+        driven from a thread pool, one call at a time. Cancelling the
+        awaiting task kills the R process that was serving it; in
+        persistent mode the next call starts a fresh worker. Parameters,
+        return value and exceptions are
+        the same as `call`.
+
+        Examples
+        --------
+        >>> rb = RBridge()
+        >>> await rb.acall("add <- function(x, y) x + y", "add", x=5, y=3)
+        8
+        """
+        if r_func not in r_code:
+            raise ValueError(f"Function '{r_func}' not found in r_code")
+
+        settings = self._profile_settings(rprof, rprof_memory)
+        timer = CallTimer("acall", r_func)
+        try:
+            result = await self._atimed_call(
+                r_code, r_func, return_type, kwargs, timer, settings
+            )
+        except BaseException as e:
+            timer.finish(e)
+            self._stats.record(timer)
+            raise
+        timer.finish()
+        self._stats.record(timer)
+        return result
+
+    async def _atimed_call(
+        self,
+        r_code: str,
+        r_func: str,
+        return_type: str,
+        kwargs: Dict,
+        timer: CallTimer,
+        profile: Optional[Dict] = None,
+    ) -> Any:
+        key = None
+        if profile is None:
+            key = self._cache_key(r_code, r_func, return_type, kwargs)
+        if key is not None:
+            with timer.phase("cache"):
+                found, value = self.cache.get(key)
+            if found:
+                timer.cached = True
+                return value
+
+        resident = self._check_resident(return_type)
+        if self.persistent:
+            parsed, response, worker = await self._aexecute_worker(
+                r_code, r_func, kwargs, timer, profile, resident
+            )
+        else:
+            parsed, response, worker = await self._aexecute_transient(
+                r_code, r_func, kwargs, timer, profile
+            )
+
+        with timer.phase("convert"):
+            result = self._result(parsed, response, worker, return_type)
+        if key is not None:
+            self.cache.set(key, result)
+        if profile is not None:
+            report = response.get("profile") or ""
+            return result, RProfile.parse(report, r_code)
+        return result
+
+    async def agather(
+        self,
+        calls: Iterable[Tuple[str, str, Dict]],
+        concurrency: int = 4,
+        return_type: str = "auto",
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        """
+        Run many `acall`s with a bound on how many run at once.
+
+        Parameters
+        ----------
+        calls : iterable of (r_code, r_func, kwargs) tuples
+            Calls to run
+        concurrency : int
+            Maximum number of R calls in flight (default: 4). A persistent
+            bridge has a single worker, so its calls still run one by one.
+        return_type : str
+            Output type for every call, see `call`
+        return_exceptions : bool
+            Return exceptions in place of results instead of raising the
+            first one (default: False)
+
+        Returns
+        -------
+        List of results, in the order of `calls`
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(r_code, r_func, kwargs):
+            async with semaphore:
+                return await self.acall(
+                    r_code, r_func, return_type=return_type, **kwargs
+                )
+
+        return await asyncio.gather(
+            *(run(*c) for c in calls), return_exceptions=return_exceptions
+        )
+
+    def map(
+        self,
+        r_code: str,
+        r_func: str,
+        kwargs_list: Iterable[Dict],
+        return_type: str = "auto",
+        chunk_size: int = 1000,
+        return_exceptions: bool = True,
+        r_workers: int = 1,
+    ) -> List[Any]:
+        """
+        Call an R function once per argument set, in batched round trips.
+
+        Argument sets are sent `chunk_size` at a time, and R loops over each
+        chunk itself, so thousands of small calls cost a few requests. A
+        bridge that is not persistent starts one R worker for the whole
+        map and stops it at the end. The timeout applies to each chunk.
+
+        Parameters
+        ----------
+        r_code : str
+            R code defining the function (can include library() calls)
+        r_func : str
+            Function name to call
+        kwargs_list : iterable of dict
+            Keyword arguments for each call
+        return_type : str
+            Output type for every result, see `call`
+        chunk_size : int
+            Number of argument sets per request; bounds the memory used on
+            both sides (default: 1000)
+        return_exceptions : bool
+            Put an `RExecutionError` in place of each failed item instead of
+            raising the first one (default: True)
+        r_workers : int
+            Number of forked R processes evaluating each chunk with
+            `parallel::mclapply`; ignored on Windows (default: 1)
+
+        Returns
+        -------
+        List of results, in the order of `kwargs_list`
+
+        Examples
+        --------
+        >>> rb = RBridge(persistent=True)
+        >>> rb.map("sq <- function(x) x^2", "sq", [{"x": i} for i in range(4)])
+        [0, 1, 4, 9]
+        """
+        if r_func not in r_code:
+            raise ValueError(f"Function '{r_func}' not found in r_code")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        kwargs_list = list(kwargs_list)
+        results: List[Any] = [None] * len(kwargs_list)
+
+        # Serve what we can from the cache and only send the rest to R
+        keys = [
+            self._cache_key(r_code, r_func, return_type, kwargs)
+            for kwargs in kwargs_list
+        ]
+        pending = []
+        for i, key in enumerate(keys):
+            found = False
+            if key is not None:
+                found, results[i] = self.cache.get(key)
+            if not found:
+                pending.append(i)
+        if not pending:
+            return results
+
+        with self._session_worker() as worker:
+            for start in range(0, len(pending), chunk_size):
+                chunk = pending[start:start + chunk_size]
+                buffers: List = []
+                items = []
+                for i in chunk:
+                    r_args, encoded, _ = self._encode_args(
+                        kwargs_list[i], buffers
+                    )
+                    items.append({"args": r_args, "encoded": encoded})
+                header = {
+                    "op": "map",
+                    "func": r_func,
+                    "items": items,
+                    "workers": r_workers,
+                }
+                entries, _ = self._request(worker, r_code, header, buffers)
+                for i, entry in zip(chunk, entries):
+                    results[i] = self._map_result(entry, return_type)
+                    if isinstance(results[i], RExecutionError):
+                        if not return_exceptions:
+                            raise results[i]
+                    elif keys[i] is not None:
+                        self.cache.set(keys[i], results[i])
+        return results
+
+    def stream(
+        self,
+        r_code: str,
+        r_func: str,
+        chunk_rows: int = 100_000,
+        return_type: str = "auto",
+        **kwargs,
+    ) -> Iterator[Any]:
+        """
+        Call an R function and iterate over its result in row chunks.
+
+        R keeps the full result and sends `chunk_rows` rows at a time, as
+        the iteration asks for them, so Python only ever holds one chunk.
+        Data frames and matrices are split by rows and vectors and lists
+        by elements; a chunk of one element is still a vector, never a
+        scalar. Stopping early frees the result in R. A bridge that
+        is not persistent starts an R worker for the duration of the
+        iteration.
+
+        Parameters
+        ----------
+        r_code : str
+            R code defining the function (can include library() calls)
+        r_func : str
+            Function name to call
+        chunk_rows : int
+            Rows per chunk (default: 100000)
+        return_type : str
+            Output type for each chunk, see `call`
+        **kwargs
+            Arguments passed to R function
+
+        Yields
+        ------
+        Result chunks converted to the requested Python type
+
+        Examples
+        --------
+        >>> rb = RBridge(persistent=True)
+        >>> for chunk in rb.stream(code, "predict_all", chunk_rows=50_000):
+        ...     chunk.to_parquet(...)
+        """
+        if r_func not in r_code:
+            raise ValueError(f"Function '{r_func}' not found in r_code")
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be at least 1")
+
+        r_args, encoded, buffers = self._encode_args(kwargs)
+        stream_id = uuid.uuid4().hex
+        header = {
+            "op": "stream",
+            "func": r_func,
+            "args": r_args,
+            "encoded": encoded,
+            "stream": stream_id,
+            "chunk_rows": chunk_rows,
+        }
+        with self._session_worker() as worker, self._stream_guard(
+            worker, r_func, stream_id
+        ):
+            out, _ = self._request(worker, r_code, header, buffers)
+            while True:
+                yield self._convert_chunk(
+                    out["value"], return_type, out.get("schema")
+                )
+                if out["done"]:
+                    break
+                out, _ = self._stream_request(
+                    worker, "next", r_func, stream_id
+                )
+
+    def _convert_chunk(
+        self, value: Any, return_type: str, schema: Optional[Dict]
+    ) -> Any:
+        """Convert a stream chunk, keeping a one-element chunk a vector."""
+        if schema is not None and schema.get("length") == 1:
+            # R unboxes length-one vectors, but the chunk is still a slice
+            # of a longer vector and must not turn into a scalar
+            if value is None or isinstance(value, (bool, int, float, str)):
+                value = [value]
+            schema = dict(schema, length=None)
+        return self._convert_output(value, return_type, schema)
+
+    def _stream_request(
+        self, worker: RWorker, op: str, r_func: str, stream_id: str
+    ) -> Tuple[Any, Optional[Dict]]:
+        """Send a request about a stream the worker already holds."""
+        response, payload = worker.request(
+            {
+                "op": op,
+                "func": r_func,
+                "stream": stream_id,
+                "binary": HAS_NUMPY,
+                "frames": HAS_PANDAS,
+                "sparse": HAS_SCIPY,
+            }
+        )
+        return self._decode_payload(payload), response.get("schema")
+
+    @contextlib.contextmanager
+    def _stream_guard(self, worker: RWorker, r_func: str, stream_id: str):
+        """Drop a stream's state in R if the operation stops early."""
+        try:
+            yield
+        except BaseException:
+            # Includes GeneratorExit, raised when a caller stops iterating
+            if worker.alive:
+                try:
+                    self._stream_request(worker, "cancel", r_func, stream_id)
+                except RExecutionError:
+                    pass
+            raise
+
+    def apply_chunks(
+        self,
+        r_code: str,
+        r_func: str,
+        chunks: Iterable[Any],
+        arg: str = "x",
+        return_type: str = "auto",
+        prefetch: int = 1,
+        **kwargs,
+    ) -> Iterator[Any]:
+        """
+        Call an R function on each chunk of an iterable, on one warm worker.
+
+        Use it for data that does not fit in memory, e.g. an iterator over
+        CSV or Parquet partitions. While R processes a chunk, a background
+        thread reads and encodes the next ones, so I/O and serialization
+        overlap with the R computation.
+
+        Parameters
+        ----------
+        r_code : str
+            R code defining the function (can include library() calls)
+        r_func : str
+            Function name to call
+        chunks : iterable
+            DataFrames, arrays or any other argument values, one per call
+        arg : str
+            Name of the R argument receiving each chunk (default: "x")
+        return_type : str
+            Output type for each result, see `call`
+        prefetch : int
+            Number of chunks prepared ahead of the one R is working on
+            (default: 1)
+        **kwargs
+            Other arguments passed to every call
+
+        Yields
+        ------
+        The result for each chunk, in order
+
+        Examples
+        --------
+        >>> parts = (pd.read_parquet(p) for p in paths)
+        >>> for summary in rb.apply_chunks(code, "summarize", parts, arg="df"):
+        ...     print(summary)
+        """
+        if r_func not in r_code:
+            raise ValueError(f"Function '{r_func}' not found in r_code")
+        with self._session_worker() as worker:
+            for r_args, encoded, buffers in self._prefetch(
+                chunks, arg, kwargs, prefetch
+            ):
+                header = {
+                    "op": "call",
+                    "func": r_func,
+                    "args": r_args,
+                    "encoded": encoded,
+                }
+                parsed, response = self._request(
+                    worker, r_code, header, buffers
+                )
+                yield self._convert_output(
+                    parsed, return_type, response.get("schema")
+                )
+
+    def reduce_chunks(
+        self,
+        r_code: str,
+        r_func: str,
+        chunks: Iterable[Any],
+        reducer: Union[str, Callable[[Any, Any], Any]],
+        arg: str = "x",
+        return_type: str = "auto",
+        prefetch: int = 1,
+        **kwargs,
+    ) -> Any:
+        """
+        Call an R function on each chunk and combine the results.
+
+        Parameters
+        ----------
+        reducer : str or callable
+            Either a Python function `reducer(acc, result)` applied to the
+            converted results, or the name of an R function defined in
+            `r_code`, called as `reducer(acc, value)` inside R so that only
+            the final value is sent back. The first chunk's result is the
+            initial accumulator.
+
+        Other parameters are the same as `apply_chunks`.
+
+        Returns
+        -------
+        The reduced value, or None when `chunks` is empty
+
+        Examples
+        --------
+        >>> code = '''
+        ... totals <- function(df) c(n = nrow(df), amount = sum(df$amount))
+        ... combine <- function(acc, x) acc + x
+        ... '''
+        >>> rb.reduce_chunks(code, "totals", parts, "combine", arg="df")
         """
+        if callable(reducer):
+            acc, empty = None, True
+            for result in self.apply_chunks(
+                r_code, r_func, chunks, arg, return_type, prefetch, **kwargs
+            ):
+                acc = result if empty else reducer(acc, result)
+                empty = False
+            return acc
+
         if r_func not in r_code:
             raise ValueError(f"Function '{r_func}' not found in r_code")
+        if reducer not in r_code:
+            raise ValueError(f"Function '{reducer}' not found in r_code")
+        stream_id = uuid.uuid4().hex
+        with self._session_worker() as worker, self._stream_guard(
+            worker, reducer, stream_id
+        ):
+            for r_args, encoded, buffers in self._prefetch(
+                chunks, arg, kwargs, prefetch
+            ):
+                header = {
+                    "op": "fold",
+                    "func": r_func,
+                    "reducer": reducer,
+                    "stream": stream_id,
+                    "args": r_args,
+                    "encoded": encoded,
+                }
+                self._request(worker, r_code, header, buffers)
+            parsed, schema = self._stream_request(
+                worker, "collect", reducer, stream_id
+            )
+        return self._convert_output(parsed, return_type, schema)
+
+    def _prefetch(
+        self, chunks: Iterable[Any], arg: str, kwargs: Dict, prefetch: int
+    ) -> Iterator[Tuple[str, Dict, List]]:
+        """Pull and encode each chunk's arguments on a background thread."""
+        it = iter(chunks)
+
+        def prepare():
+            try:
+                chunk = next(it)
+            except StopIteration:
+                return None
+            return self._encode_args(dict(kwargs, **{arg: chunk}))
 
-        # Convert Python inputs to R-compatible format
-        r_args = self._serialize_args(kwargs)
+        # A single thread keeps the `next(it)` calls in order
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="rtopy-prefetch"
+        ) as executor:
+            pending = collections.deque(
+                executor.submit(prepare) for _ in range(max(prefetch, 0) + 1)
+            )
+            try:
+                while True:
+                    item = pending.popleft().result()
+                    if item is None:
+                        return
+                    pending.append(executor.submit(prepare))
+                    yield item
+            finally:
+                for future in pending:
+                    future.cancel()
 
-        # Build and execute R script
-        r_script = self._build_script(r_code, r_func, r_args)
-        output = self._execute_r(r_script)
+    def _map_result(self, entry: Dict, return_type: str) -> Any:
+        """Convert one item of a map response, or build its error."""
+        if not entry.get("ok"):
+            return RExecutionError(entry.get("message", "R error"))
+        return self._convert_output(
+            entry.get("value"), return_type, entry.get("schema")
+        )
 
-        # Parse and convert output
+    def _parse_json(self, output: str) -> Any:
+        """Parse R's JSON output."""
         try:
-            parsed = json.loads(output)
+            return json.loads(output)
         except json.JSONDecodeError as e:
-            raise RExecutionError(f"Invalid JSON from R: {output[:200]}") from e
+            raise RExecutionError(
+                f"Invalid JSON from R: {output[:200]}"
+            ) from e
 
-        return self._convert_output(parsed, return_type)
+    def _to_jsonable(self, v: Any) -> Any:
+        """Convert one argument to something `json.dumps` accepts."""
+        if is_ndarray(v):
+            return v.tolist()
+        elif is_dataframe(v):
+            return v.to_dict("list")
+        elif is_series(v):
+            return v.tolist()
+        elif is_sparse(v):
+            return v.toarray().tolist()
+        return v
 
-    def _serialize_args(self, kwargs: Dict) -> str:
-        """Convert Python args to R-compatible JSON."""
-        converted = {}
+    def _encode_args(
+        self, kwargs: Dict, buffers: Optional[List] = None
+    ) -> Tuple[str, Dict, List]:
+        """
+        Convert Python args for the worker protocol.
+
+        Numeric arrays, Series, DataFrames and SciPy sparse matrices are
+        sent as binary buffers; everything else goes through JSON. Pass
+        `buffers` to append to a buffer list shared by several calls.
+
+        Returns
+        -------
+        (args_json, encoded_specs, buffers)
+        """
+        converted, encoded = {}, {}
+        if buffers is None:
+            buffers = []
 
         for k, v in kwargs.items():
-            if HAS_NUMPY and isinstance(v, np.ndarray):
-                converted[k] = v.tolist()
-            elif HAS_PANDAS and isinstance(v, pd.DataFrame):
-                converted[k] = v.to_dict("list")
-            elif HAS_PANDAS and isinstance(v, pd.Series):
-                converted[k] = v.tolist()
+            spec = None
+            if isinstance(v, RObjectHandle):
+                spec = v._encode()
+            elif is_ndarray(v):
+                spec = codec.encode_array(v, buffers)
+            elif is_dataframe(v):
+                spec = codec.encode_frame(v, buffers)
+            elif is_series(v):
+                spec = codec.encode_series(v, buffers)
+            elif is_sparse(v):
+                spec = codec.encode_sparse(v, buffers)
+
+            if spec is None:
+                converted[k] = self._to_jsonable(v)
             else:
-                converted[k] = v
-
-        json_str = json.dumps(converted)
-        return json_str.replace("\\", "\\\\").replace("'", "\\'")
-
-    def _build_script(self, r_code: str, r_func: str, r_args: str) -> str:
-        """Build R script with error handling."""
-        return f"""
-suppressPackageStartupMessages({{
-    {r_code.strip()}
-    
-    args <- jsonlite::fromJSON('{r_args}')
-    
-    result <- tryCatch(
-        do.call({r_func}, args),
-        error = function(e) stop("R error in {r_func}: ", e$message)
-    )
-    
-    json_out <- jsonlite::toJSON(
-        result,
-        auto_unbox = TRUE,
-        force = TRUE,
-        digits = 15,
-        null = "null",
-        na = "null",
-        dataframe = "columns"
-    )
-    
-    cat(json_out, "\\n")
-}})
-"""
-
-    def _execute_r(self, script: str) -> str:
-        """Execute R script and return stdout."""
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".R", delete=False, encoding="utf-8"
-        ) as f:
-            f.write(script)
-            temp_file = f.name
+                # Keep a placeholder so R sees arguments in their given order
+                converted[k] = None
+                encoded[k] = spec
+
+        return json.dumps(converted), encoded, buffers
 
+    def _cache_key(
+        self, r_code: str, r_func: str, return_type: str, kwargs: Dict
+    ) -> Optional[str]:
+        """Result cache key, or None when caching does not apply."""
+        if self.cache is None or return_type == "handle":
+            return None
         try:
-            proc = subprocess.run(
-                ["Rscript", "--vanilla", temp_file],
-                capture_output=True,
-                text=True,
-                timeout=self.timeout,
-            )
+            return stable_hash(r_code, r_func, return_type, kwargs)
+        except (TypeError, ValueError):
+            # Arguments without a stable content hash are never cached
+            return None
+
+    @staticmethod
+    def _code_key(r_code: str) -> str:
+        """Registry key identifying a piece of R code."""
+        return hashlib.sha256(r_code.encode("utf-8")).hexdigest()
+
+    def _request(
+        self,
+        worker: RWorker,
+        r_code: str,
+        header: Dict,
+        buffers: List,
+        timer: Optional[CallTimer] = None,
+    ) -> Tuple[Any, Dict]:
+        """
+        Send a request running `r_code`.
 
-            if self.verbose and proc.stderr:
-                print(f"[R messages] {proc.stderr}")
+        Returns
+        -------
+        (decoded output, response header), where the header's "schema"
+        describes the output's R type
+        """
+        header = self._code_header(worker, r_code, header)
+        response, payload = worker.request(header, buffers, timer)
+        worker.registered.add(header["key"])
+        return self._decoded(payload, timer), response
 
-            if proc.returncode != 0:
-                error_msg = proc.stderr or proc.stdout
-                raise RExecutionError(f"R script failed:\n{error_msg}")
+    async def _arequest(
+        self,
+        worker: AsyncRWorker,
+        r_code: str,
+        header: Dict,
+        buffers: List,
+        timer: Optional[CallTimer] = None,
+    ) -> Tuple[Any, Dict]:
+        """Asyncio version of `_request`."""
+        header = self._code_header(worker, r_code, header)
+        response, payload = await worker.request(header, buffers, timer)
+        worker.registered.add(header["key"])
+        return self._decoded(payload, timer), response
 
-            if not proc.stdout.strip():
-                raise RExecutionError("R produced no output")
+    def _code_header(self, worker, r_code: str, header: Dict) -> Dict:
+        """Request header identifying `r_code`, and carrying it if needed."""
+        key = self._code_key(r_code)
+        header = dict(
+            header,
+            key=key,
+            binary=HAS_NUMPY,
+            frames=HAS_PANDAS,
+            sparse=HAS_SCIPY,
+        )
+        # The worker keeps every r_code it has evaluated, so after the
+        # first call only the key and the arguments are sent. Profiled
+        # calls evaluate it again with its source kept, for line numbers.
+        profiled = header.get("profile") is not None
+        if key not in worker.registered or profiled:
+            header["code"] = r_code
+            header["compile"] = self.compile
+            header["keep_source"] = profiled
+        return header
 
-            return proc.stdout.strip()
+    def _decoded(self, payload: List, timer: Optional[CallTimer]) -> Any:
+        if timer is None:
+            return self._decode_payload(payload)
+        with timer.phase("decode"):
+            return self._decode_payload(payload)
 
-        except subprocess.TimeoutExpired:
-            raise RExecutionError(
-                f"R execution timed out after {self.timeout}s"
+    def _decode_payload(self, payload: List) -> Any:
+        """Parse a worker response's JSON and rebuild its binary values."""
+        text = payload[0].decode("utf-8")
+        parsed = self._parse_json(text)
+        # Plain JSON values have no specs to rebuild. Specs can come
+        # without buffers, e.g. a data frame with no columns.
+        if len(payload) == 1 and codec.MARKER not in text:
+            return parsed
+        return codec.decode(parsed, payload[1:])
+
+    def _execute_worker(
+        self,
+        r_code: str,
+        r_func: str,
+        kwargs: Dict,
+        worker: Optional[RWorker] = None,
+        timer: Optional[CallTimer] = None,
+        profile: Optional[Dict] = None,
+        resident: bool = False,
+    ) -> Tuple[Any, Dict, RWorker]:
+        """
+        Run the call in a worker, the persistent one by default, and return
+        its parsed output, the response header and the worker. A `resident`
+        result stays in the worker and only its description comes back;
+        with an object cache it is loaded from, or saved to, disk.
+        """
+        if worker is None:
+            previous = self._worker
+            start = timer.now() if timer is not None else None
+            worker = self._get_worker()
+            if timer is not None and worker is not previous:
+                self._record_startup(timer, start, worker)
+
+        object_key = None
+        if resident and profile is None and self.object_cache is not None:
+            object_key = self.object_cache.key(r_code, r_func, kwargs)
+        if object_key is not None:
+            loaded = self._load_object(worker, r_func, object_key, timer)
+            if loaded is not None:
+                return loaded + (worker,)
+
+        header, buffers = self._call_request(
+            r_func, kwargs, timer, profile, resident
+        )
+        if object_key is not None:
+            header["save"] = {
+                "path": self.object_cache.path(object_key),
+                "compress": self.object_cache.compress,
+            }
+        parsed, response = self._request(
+            worker, r_code, header, buffers, timer
+        )
+        if object_key is not None:
+            self.object_cache.record(object_key, r_func, parsed)
+        return parsed, response, worker
+
+    def _call_request(
+        self,
+        r_func: str,
+        kwargs: Dict,
+        timer: Optional[CallTimer] = None,
+        profile: Optional[Dict] = None,
+        resident: bool = False,
+    ) -> Tuple[Dict, List]:
+        """Header and buffers of a request calling `r_func`."""
+        if timer is None:
+            r_args, encoded, buffers = self._encode_args(kwargs)
+        else:
+            with timer.phase("encode"):
+                r_args, encoded, buffers = self._encode_args(kwargs)
+        header = {
+            "op": "call",
+            "func": r_func,
+            "args": r_args,
+            "encoded": encoded,
+        }
+        if profile is not None:
+            header["profile"] = profile
+        if resident:
+            header["resident"] = uuid.uuid4().hex
+        return header, buffers
+
+    def _load_object(
+        self,
+        worker: RWorker,
+        r_func: str,
+        key: str,
+        timer: Optional[CallTimer] = None,
+    ) -> Optional[Tuple[Any, Dict]]:
+        """Load a cached object into the worker as a resident object."""
+        path = self.object_cache.lookup(key)
+        if path is None:
+            return None
+        header = {
+            "op": "load",
+            "func": r_func,
+            "rds": path,
+            "resident": uuid.uuid4().hex,
+        }
+        try:
+            response, payload = worker.request(header, (), timer)
+        except RExecutionError:
+            if not worker.alive:
+                raise
+            # An unreadable file is dropped and the function runs instead
+            self.object_cache.discard(key)
+            return None
+        if timer is not None:
+            timer.cached = True
+        return self._decode_payload(payload), response
+
+    async def _aexecute_worker(
+        self,
+        r_code: str,
+        r_func: str,
+        kwargs: Dict,
+        timer: Optional[CallTimer] = None,
+        profile: Optional[Dict] = None,
+        resident: bool = False,
+    ) -> Any:
+        """Run the call in the persistent worker without blocking the loop."""
+        loop = asyncio.get_running_loop()
+        with self._async_locks_guard:
+            lock = self._async_locks.get(loop)
+            if lock is None:
+                lock = self._async_locks[loop] = asyncio.Lock()
+        async with lock:
+            try:
+                return await loop.run_in_executor(
+                    None,
+                    self._execute_worker,
+                    r_code,
+                    r_func,
+                    kwargs,
+                    None,
+                    timer,
+                    profile,
+                    resident,
+                )
+            except asyncio.CancelledError:
+                # R cannot be interrupted mid-call over the socket; kill the
+                # worker instead so the abandoned call stops consuming CPU.
+                with self._worker_lock:
+                    if self._worker is not None:
+                        self._worker.kill()
+                raise
+
+    async def _aexecute_transient(
+        self,
+        r_code: str,
+        r_func: str,
+        kwargs: Dict,
+        timer: Optional[CallTimer] = None,
+        profile: Optional[Dict] = None,
+    ) -> Any:
+        """
+        Run the call in a fresh worker driven by the event loop itself, so
+        concurrent one-shot calls need no thread each.
+        """
+        start = timer.now() if timer is not None else None
+        worker = await AsyncRWorker.start(
+            timeout=self.timeout,
+            verbose=self.verbose,
+            shm_threshold=self.shm_threshold,
+            preload=self.preload,
+            setup=self.setup,
+        )
+        if timer is not None:
+            self._record_startup(timer, start, worker)
+        try:
+            header, buffers = self._call_request(
+                r_func, kwargs, timer, profile
+            )
+            parsed, response = await self._arequest(
+                worker, r_code, header, buffers, timer
             )
+            return parsed, response, worker
+        except asyncio.CancelledError:
+            # Never leave R running behind the caller's back
+            worker.kill()
+            raise
         finally:
-            try:
-                os.unlink(temp_file)
-            except Exception:
-                pass
+            if timer is None:
+                await worker.close()
+            else:
+                with timer.phase("shutdown"):
+                    await worker.close()
 
-    def _convert_output(self, parsed: Any, return_type: str) -> Any:
-        """Convert parsed JSON to requested Python type."""
-        if return_type == "raw":
-            return parsed
+    def _convert_output(
+        self, parsed: Any, return_type: str, schema: Optional[Dict] = None
+    ) -> Any:
+        """
+        Convert parsed JSON to requested Python type.
 
+        `schema` is the R type descriptor sent by the worker (class, typeof,
+        dim, dimnames, levels, names); when present it decides the type and
+        dtype instead of the values themselves.
+        """
         if return_type == "auto":
-            return_type = self._infer_type(parsed)
+            return_type = self._infer_type(parsed, schema)
+
+        if return_type not in ("numpy", "pandas", "sparse"):
+            # Arrays decoded from binary buffers go back to plain lists
+            parsed = codec.to_builtin(parsed)
+
+        if return_type == "raw":
+            return parsed
 
         converters = {
             "int": self._to_int,
@@ -225,6 +1325,7 @@ suppressPackageStartupMessages({{
             "dict": self._to_dict,
             "numpy": self._to_numpy,
             "pandas": self._to_pandas,
+            "sparse": self._to_sparse,
         }
 
         if return_type not in converters:
@@ -234,17 +1335,29 @@ suppressPackageStartupMessages({{
             )
 
         try:
+            if return_type in ("numpy", "pandas", "sparse"):
+                return converters[return_type](parsed, schema)
             return converters[return_type](parsed)
         except Exception as e:
             raise RTypeError(
                 f"Failed to convert to {return_type}: {str(e)}"
             ) from e
 
-    def _infer_type(self, parsed: Any) -> str:
+    def _infer_type(self, parsed: Any, schema: Optional[Dict] = None) -> str:
         """Automatically infer best return type."""
+        if is_sparse(parsed):
+            return "sparse"
+        if schema is not None and parsed is not None:
+            inferred = self._schema_type(schema)
+            if inferred is not None:
+                return inferred
+        if is_ndarray(parsed):
+            return "numpy"
+        if is_dataframe(parsed):
+            return "pandas"
         if isinstance(parsed, dict):
             # Check if it looks like a dataframe (dict of lists)
-            if all(isinstance(v, list) for v in parsed.values()):
+            if all(self._is_column(v) for v in parsed.values()):
                 return "pandas" if HAS_PANDAS else "dict"
             return "dict"
         elif isinstance(parsed, list):
@@ -262,6 +1375,32 @@ suppressPackageStartupMessages({{
             return "str"
         return "raw"
 
+    def _schema_type(self, schema: Dict) -> Optional[str]:
+        """Return type matching an R type descriptor, None if unsure."""
+        classes = set(schema.get("class") or ())
+        typeof = schema.get("typeof")
+        scalar = schema.get("length") == 1 and schema.get("dim") is None
+
+        if "data.frame" in classes:
+            return "pandas" if HAS_PANDAS else "dict"
+        if typeof in _R_NUMPY_DTYPES and classes <= _R_PLAIN_CLASSES:
+            if scalar:
+                return _R_SCALAR_TYPES[typeof]
+            return "numpy" if HAS_NUMPY else "list"
+        if typeof == "character" or "factor" in classes:
+            return "str" if scalar else "list"
+        if typeof == "list":
+            return "dict" if schema.get("names") is not None else "list"
+        # Dates, times and other classed vectors arrive as JSON strings or
+        # numbers whose meaning the schema alone does not settle.
+        return None
+
+    def _is_column(self, val: Any) -> bool:
+        """Whether a value can be a data frame column."""
+        if is_ndarray(val):
+            return val.ndim == 1
+        return isinstance(val, list)
+
     def _to_int(self, val: Any) -> int:
         if isinstance(val, (int, float)):
             return int(val)
@@ -304,13 +1443,23 @@ suppressPackageStartupMessages({{
             return {str(i): v for i, v in enumerate(val)}
         return {"result": val}
 
-    def _to_numpy(self, val: Any):
+    def _to_numpy(self, val: Any, schema: Optional[Dict] = None):
         """Convert to NumPy array."""
         if not HAS_NUMPY:
             raise RTypeError(
                 "NumPy not installed. Install with: pip install numpy"
             )
+        np = numpy()
 
+        if isinstance(val, np.ndarray):
+            return val
+        if is_sparse(val):
+            return val.toarray()
+        typeof = schema.get("typeof") if schema is not None else None
+        if isinstance(val, list) and typeof in _R_NUMPY_DTYPES:
+            return self._typed_array(val, typeof)
+        if is_dataframe(val):
+            return val.to_numpy()
         if isinstance(val, list):
             # Handle matrix (list of lists)
             if val and isinstance(val[0], list):
@@ -319,21 +1468,63 @@ suppressPackageStartupMessages({{
         if isinstance(val, dict):
             # Try to convert dict of lists to 2D array
             lists = list(val.values())
-            if all(isinstance(v, list) for v in lists):
+            if all(self._is_column(v) for v in lists):
                 return np.array(lists).T
             return np.array(list(val.values()))
         return np.array([val])
 
-    def _to_pandas(self, val: Any):
+    def _to_sparse(self, val: Any, schema: Optional[Dict] = None):
+        """Convert to a SciPy CSC matrix."""
+        if not HAS_SCIPY:
+            raise RTypeError(
+                "SciPy not installed. Install with: pip install scipy"
+            )
+        if is_sparse(val):
+            return val.tocsc()
+        arr = self._to_numpy(val, schema)
+        if arr.ndim != 2:
+            arr = arr[None, :]
+        return scipy_sparse().csc_matrix(arr)
+
+    def _typed_array(self, values: List, typeof: str):
+        """Build an array with the dtype of an R vector type."""
+        np = numpy()
+        if typeof == "logical":
+            arr = np.array(values)
+        else:
+            try:
+                arr = np.array(values, dtype=_R_NUMPY_DTYPES[typeof])
+            except TypeError:
+                # NA arrives as None: fall back to float with NaN
+                arr = np.array(values, dtype=object)
+        if arr.dtype == object:
+            arr = arr.astype(np.float64)
+        return arr
+
+    def _to_pandas(self, val: Any, schema: Optional[Dict] = None):
         """Convert to pandas DataFrame or Series."""
         if not HAS_PANDAS:
             raise RTypeError(
                 "pandas not installed. Install with: pip install pandas"
             )
+        pd = pandas()
 
+        if isinstance(val, pd.DataFrame):
+            return val
+        if is_sparse(val):
+            dimnames = (schema or {}).get("dimnames") or [None, None]
+            return pd.DataFrame.sparse.from_spmatrix(
+                val, index=dimnames[0], columns=dimnames[1]
+            )
+        if schema is not None:
+            out = self._schema_pandas(val, schema)
+            if out is not None:
+                return out
+        if is_ndarray(val):
+            return pd.DataFrame(val) if val.ndim == 2 else pd.Series(val)
         if isinstance(val, dict):
             # Dict of lists -> DataFrame
-            if all(isinstance(v, list) for v in val.values()):
+            if all(self._is_column(v) for v in val.values()):
                 return pd.DataFrame(val)
             # Dict of scalars -> Series
             return pd.Series(val)
@@ -344,6 +1535,49 @@ suppressPackageStartupMessages({{
             return pd.Series(val)
         raise RTypeError(f"Cannot convert {type(val).__name__} to pandas")
 
+    def _schema_pandas(self, val: Any, schema: Dict):
+        """pandas object for a JSON value described by `schema`, or None."""
+        pd = pandas()
+        classes = set(schema.get("class") or ())
+        typeof = schema.get("typeof")
+
+        if "data.frame" in classes and isinstance(val, dict):
+            columns = {}
+            specs = schema.get("columns") or ()
+            for (name, col), spec in zip(val.items(), specs):
+                columns[name] = self._schema_column(col, spec)
+            return pd.DataFrame(columns) if columns else pd.DataFrame(val)
+
+        dim = schema.get("dim")
+        dimnames = schema.get("dimnames") or [None, None]
+        if dim is not None and len(dim) == 2 and typeof in _R_NUMPY_DTYPES:
+            arr = val if is_ndarray(val) else self._typed_array(val, typeof)
+            return pd.DataFrame(arr, index=dimnames[0], columns=dimnames[1])
+
+        if dim is None and (is_ndarray(val) or isinstance(val, list)):
+            names = schema.get("names")
+            values = self._schema_column(val, schema)
+            if names is not None and len(names) != len(values):
+                names = None
+            return pd.Series(values, index=names)
+        return None
+
+    def _schema_column(self, values: Any, spec: Dict):
+        """One vector as an array or Categorical matching its R type."""
+        pd = pandas()
+        classes = set(spec.get("class") or ())
+        typeof = spec.get("typeof")
+        if "factor" in classes and spec.get("levels") is not None:
+            return pd.Categorical(
+                values,
+                categories=spec["levels"],
+                ordered="ordered" in classes,
+            )
+        if isinstance(values, list) and typeof in _R_NUMPY_DTYPES:
+            if classes <= _R_PLAIN_CLASSES:
+                return self._typed_array(values, typeof)
+        return values
+
 
 def call_r(r_code: str, r_func: str, **kwargs) -> Any:
     """
@@ -367,5 +1601,17 @@ def call_r(r_code: str, r_func: str, **kwargs) -> Any:
     >>> result = call_r("square <- function(x) x^2", "square", x=5)
     >>> print(result)  # 25.0
     """
-    rb = RBridge()
-    return rb.call(r_code, r_func, **kwargs)
+    return _get_default_bridge().call(r_code, r_func, **kwargs)
+
+
+_default_bridge: Optional[RBridge] = None
+_default_bridge_lock = threading.Lock()
+
+
+def _get_default_bridge() -> RBridge:
+    """The bridge shared by every `call_r`, created on first use."""
+    global _default_bridge
+    with _default_bridge_lock:
+        if _default_bridge is None:
+            _default_bridge = RBridge()
+        return _default_bridge
@@ -0,0 +1,480 @@
+"""Content-addressed caches for R call results and resident R objects."""
+
+import collections
+import hashlib
+import json
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from ._compat import (
+    is_dataframe,
+    is_ndarray,
+    is_numpy_scalar,
+    is_series,
+    is_sparse,
+    numpy,
+    pandas,
+)
+
+
+def _feed(h, obj: Any):
+    """Feed a type-tagged, order-stable encoding of obj into hash h."""
+    if obj is None or isinstance(obj, bool):
+        h.update(b"c" + repr(obj).encode())
+    elif isinstance(obj, int):
+        h.update(b"i" + str(obj).encode() + b";")
+    elif isinstance(obj, float):
+        h.update(b"f" + struct.pack("<d", obj))
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        h.update(b"s" + struct.pack("<Q", len(data)) + data)
+    elif isinstance(obj, bytes):
+        h.update(b"b" + struct.pack("<Q", len(obj)) + obj)
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"l" + struct.pack("<Q", len(obj)))
+        for v in obj:
+            _feed(h, v)
+    elif isinstance(obj, dict):
+        h.update(b"d" + struct.pack("<Q", len(obj)))
+        for k in sorted(obj, key=str):
+            _feed(h, str(k))
+            _feed(h, obj[k])
+    elif is_ndarray(obj):
+        if obj.dtype.hasobject:
+            h.update(b"o")
+            _feed(h, [list(obj.shape), obj.ravel().tolist()])
+        else:
+            h.update(b"a" + obj.dtype.str.encode())
+            _feed(h, list(obj.shape))
+            values = numpy().ascontiguousarray(obj)
+            if values.dtype.kind in "mM":
+                # The buffer protocol does not export datetime64 and
+                # timedelta64; their int64 ticks hash the same values
+                values = values.view("i8")
+            h.update(memoryview(values).cast("B"))
+    elif is_sparse(obj):
+        csc = obj.tocsc()
+        if not csc.has_canonical_format:
+            csc = csc.copy()
+            csc.sum_duplicates()
+        h.update(b"Z")
+        _feed(h, [list(csc.shape), csc.data, csc.indices, csc.indptr])
+    elif is_numpy_scalar(obj):
+        _feed(h, obj.item())
+    elif is_dataframe(obj):
+        h.update(b"F")
+        _feed(h, [str(c) for c in obj.columns])
+        _feed_index(h, obj.index)
+        for i in range(obj.shape[1]):
+            _feed_column(h, obj.iloc[:, i])
+    elif is_series(obj):
+        h.update(b"S")
+        _feed(h, str(obj.name))
+        _feed_index(h, obj.index)
+        _feed_column(h, obj)
+    else:
+        raise TypeError(f"Cannot hash arguments of type {type(obj).__name__}")
+
+
+def _feed_column(h, col):
+    h.update(str(col.dtype).encode() + b";")
+    values = col.to_numpy()
+    if values.dtype.kind in "biufcmM" and not col.hasnans:
+        # Plain numeric columns are hashed straight from their buffer
+        _feed(h, values)
+    else:
+        _feed(h, pandas().util.hash_pandas_object(col, index=False).to_numpy())
+
+
+def _feed_index(h, index):
+    pd = pandas()
+    if isinstance(index, pd.RangeIndex):
+        _feed(h, ["range", index.start, index.stop, index.step])
+    else:
+        _feed(h, pd.util.hash_pandas_object(index).to_numpy())
+
+
+def stable_hash(*parts: Any) -> str:
+    """
+    Hash builtins, NumPy arrays and pandas objects by content.
+
+    The digest is the same across processes and Python sessions.
+
+    Raises
+    ------
+    TypeError or ValueError
+        If a value has no stable content encoding
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        _feed(h, part)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Two-tier LRU cache of pickled results: memory first, then disk."""
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 2**20,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 2**30,
+    ):
+        """
+        Create a result cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            Size limit of the in-memory tier, in pickled bytes
+            (default: 64 MiB)
+        directory : str or None
+            Directory for the on-disk tier; None keeps results in memory
+            only (default: None)
+        max_disk_bytes : int
+            Size limit of the on-disk tier (default: 1 GiB)
+
+        Examples
+        --------
+        >>> cache = ResultCache(directory=".rtopy-cache")
+        >>> rb = RBridge(persistent=True, cache=cache)
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory: "collections.OrderedDict[str, bytes]" = (
+            collections.OrderedDict()
+        )
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Return `(True, value)` for a cached key, else `(False, None)`."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            else:
+                data = self._read_disk(key)
+                if data is not None:
+                    self._remember(key, data)
+            if data is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+        return True, pickle.loads(data)
+
+    def set(self, key: str, value: Any):
+        """Store a value; values that cannot be pickled are not cached."""
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        with self._lock:
+            self._remember(key, data)
+            self._write_disk(key, data)
+
+    def clear(self):
+        """Drop every cached result, including those on disk."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for path, _, _ in self._disk_entries():
+                _unlink(path)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters and the size of each tier."""
+        with self._lock:
+            disk = self._disk_entries()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(disk),
+                "disk_bytes": sum(size for _, size, _ in disk),
+            }
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pkl")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # The modification time orders disk entries for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def _write_disk(self, key: str, data: bytes):
+        if self.directory is None or len(data) > self.max_disk_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            _unlink(tmp)
+            return
+
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= self.max_disk_bytes:
+                break
+            _unlink(path)
+            total -= size
+
+    def _disk_entries(self):
+        """(path, size, mtime) of every result file on disk."""
+        if self.directory is None:
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime_ns))
+        return entries
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class RObjectCache:
+    """
+    On-disk LRU cache of R objects, stored as RDS files.
+
+    Used by `RBridge(object_cache=...)` for calls with
+    `return_type="handle"`: the object a call returns is saved under a
+    content hash of the code, function and arguments, and an identical
+    call later loads the file into the worker instead of running again.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 4 * 2**30,
+        compress: Union[bool, str] = True,
+    ):
+        """
+        Create or open an R object cache.
+
+        Parameters
+        ----------
+        directory : str
+            Directory holding the RDS files. A relative path is resolved
+            here, as R's working directory may differ from Python's.
+        max_bytes : int
+            Size limit of the directory; the least recently used objects
+            are removed beyond it (default: 4 GiB)
+        compress : bool or str
+            `compress` argument of R's `saveRDS`: True (gzip), False,
+            "gzip", "bzip2" or "xz" (default: True)
+
+        Examples
+        --------
+        >>> models = RObjectCache(".rtopy-models", max_bytes=2**30)
+        >>> rb = RBridge(persistent=True, object_cache=models)
+        >>> fit = rb.call(code, "fit_arima", return_type="handle", y=series)
+        """
+        if compress not in (True, False, "gzip", "bzip2", "xz"):
+            raise ValueError(f"Unknown compression: {compress!r}")
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, r_code: str, r_func: str, kwargs: Dict) -> Optional[str]:
+        """Cache key of a call, or None if its arguments cannot be hashed."""
+        try:
+            return stable_hash("rds", r_code, r_func, kwargs)
+        except (TypeError, ValueError):
+            return None
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".rds")
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of the cached object, or None on a miss."""
+        path = self.path(key)
+        try:
+            # The modification time orders entries for eviction
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def record(self, key: str, r_func: str, description: Dict):
+        """
+        Describe an object R has just saved, then enforce the size limit.
+
+        Does nothing if R could not write the file.
+        """
+        if not os.path.exists(self.path(key)):
+            return
+        info = {
+            "func": r_func,
+            "class": description.get("class"),
+            "object_bytes": description.get("bytes"),
+            "created": time.time(),
+        }
+        _write_atomic(self._info_path(key), json.dumps(info).encode("utf-8"))
+        self.prune()
+
+    def discard(self, key: str):
+        """Remove one entry, e.g. a file R failed to read."""
+        _unlink(self.path(key))
+        _unlink(self._info_path(key))
+
+    def entries(self) -> List[Dict]:
+        """
+        Every cached object, most recently used first.
+
+        Each entry has its "key", "path", file "size", "last_used" time
+        and, when known, the "func" that produced it, the object's R
+        "class", its in-memory "object_bytes" and "created" time.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".rds"):
+                continue
+            key = name[: -len(".rds")]
+            try:
+                st = os.stat(self.path(key))
+            except OSError:
+                continue
+            entry = {
+                "key": key,
+                "path": self.path(key),
+                "size": st.st_size,
+                "last_used": st.st_mtime,
+            }
+            try:
+                with open(self._info_path(key), encoding="utf-8") as f:
+                    entry.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+            entries.append(entry)
+        return sorted(entries, key=lambda e: -e["last_used"])
+
+    def prune(
+        self,
+        max_bytes: Optional[int] = None,
+        older_than: Optional[float] = None,
+    ) -> List[str]:
+        """
+        Remove least recently used objects until the cache fits.
+
+        Parameters
+        ----------
+        max_bytes : int or None
+            Size limit to enforce (default: the cache's `max_bytes`)
+        older_than : float or None
+            Also remove objects unused for this many seconds
+
+        Returns
+        -------
+        Keys of the removed objects
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        now = time.time()
+        removed = []
+        with self._lock:
+            entries = self.entries()
+            total = sum(e["size"] for e in entries)
+            for entry in reversed(entries):
+                age = now - entry["last_used"]
+                stale = older_than is not None and age > older_than
+                if total <= max_bytes and not stale:
+                    continue
+                self.discard(entry["key"])
+                total -= entry["size"]
+                removed.append(entry["key"])
+            # Files left behind by an R process killed while saving
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith(".tmp"):
+                    try:
+                        if now - os.stat(path).st_mtime > _STALE_TMP:
+                            _unlink(path)
+                    except OSError:
+                        pass
+        return removed
+
+    def clear(self):
+        """Remove every cached object."""
+        with self._lock:
+            for entry in self.entries():
+                self.discard(entry["key"])
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters, number of objects and bytes on disk."""
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(e["size"] for e in entries),
+        }
+
+    def _info_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+
+# Seconds after which a temporary file cannot belong to a save in progress
+_STALE_TMP = 24 * 3600
+
+
+def _write_atomic(path: str, data: bytes):
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        _unlink(tmp)
@@ -1,17 +1,656 @@
 """Console script for rtopy."""
 
+import collections
+import concurrent.futures
+import datetime
+import glob
+import json
+import os
+import math
+import re
+import statistics
 import sys
+import time
+
 import click
 
+from ._compat import (
+    HAS_NUMPY,
+    HAS_PANDAS,
+    is_dataframe,
+    is_ndarray,
+    is_series,
+    numpy,
+    pandas,
+)
+from .cache import RObjectCache
+
+_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def _parse_size(text: str) -> int:
+    """Bytes in a size like "500M" or "2G" (powers of 1024)."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", text, re.I)
+    if match is None:
+        raise click.BadParameter(f"not a size: {text!r}")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def _format_size(n: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TiB"
+
+
+def _format_time(t: float) -> str:
+    return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M")
+
+
+@click.group()
+def main():
+    """Command line tools for rtopy."""
+
+
+@main.group()
+def cache():
+    """Inspect and prune an on-disk R object cache."""
+
+
+@cache.command("list")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+def cache_list(directory):
+    """List the cached objects in DIRECTORY, most recently used first."""
+    entries = RObjectCache(directory).entries()
+    for e in entries:
+        r_class = "/".join(e.get("class") or []) or "?"
+        click.echo(
+            f"{e['key'][:12]}  {_format_size(e['size']):>10}  "
+            f"{_format_time(e['last_used'])}  {e.get('func', '?')}  {r_class}"
+        )
+    total = sum(e["size"] for e in entries)
+    click.echo(f"{len(entries)} object(s), {_format_size(total)}")
+
+
+@cache.command("prune")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--max-size", required=False, help="Size to shrink the cache to, e.g. 2G."
+)
+@click.option(
+    "--older-than",
+    type=float,
+    default=None,
+    help="Also remove objects unused for this many days.",
+)
+def cache_prune(directory, max_size, older_than):
+    """Remove least recently used objects from DIRECTORY."""
+    if max_size is None and older_than is None:
+        raise click.UsageError("give --max-size, --older-than or both")
+    objects = RObjectCache(directory)
+    max_bytes = float("inf") if max_size is None else _parse_size(max_size)
+    removed = objects.prune(
+        max_bytes=max_bytes,
+        older_than=older_than * 86400 if older_than is not None else None,
+    )
+    click.echo(f"removed {len(removed)} object(s)")
+
+
+@cache.command("clear")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.confirmation_option(prompt="Remove every cached object?")
+def cache_clear(directory):
+    """Remove every cached object from DIRECTORY."""
+    objects = RObjectCache(directory)
+    n = len(objects.entries())
+    objects.clear()
+    click.echo(f"removed {n} object(s)")
+
+
+# Readers by file extension, and the ones that can stream row chunks
+_READERS = {
+    ".csv": ("read_csv", {}),
+    ".tsv": ("read_csv", {"sep": "\t"}),
+    ".txt": ("read_csv", {"sep": None, "engine": "python"}),
+    ".parquet": ("read_parquet", {}),
+    ".feather": ("read_feather", {}),
+    ".json": ("read_json", {}),
+}
+_CHUNKED = {"read_csv"}
+
+
+def _parse_param(text: str):
+    """A NAME=VALUE pair, VALUE being JSON when it parses as such."""
+    name, sep, value = text.partition("=")
+    if not sep or not name:
+        raise click.BadParameter(f"expected NAME=VALUE, got {text!r}")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def _expand_inputs(patterns) -> list:
+    """Files matching the given paths or glob patterns, in order, once each."""
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        if not matches or not all(os.path.isfile(p) for p in matches):
+            raise click.BadParameter(f"no input file matches {pattern!r}")
+        paths.extend(p for p in matches if p not in paths)
+    return paths
+
+
+def _read_chunks(path: str, chunk_size):
+    """Data frames of up to `chunk_size` rows read from `path`.
+
+    The whole file is read as one frame when `chunk_size` is None.
+    """
+    pd = pandas()
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix not in _READERS:
+        raise click.ClickException(f"unsupported input format: {path}")
+    reader, options = _READERS[suffix]
+    if chunk_size and reader in _CHUNKED:
+        # Only one chunk of the file is held in memory at a time
+        read = getattr(pd, reader)
+        with read(path, chunksize=chunk_size, **options) as chunks:
+            yield from chunks
+        return
+    frame = getattr(pd, reader)(path, **options)
+    if not chunk_size:
+        yield frame
+        return
+    for start in range(0, max(len(frame), 1), chunk_size):
+        yield frame.iloc[start:start + chunk_size]
+
+
+def _as_frame(value):
+    """An R result as a DataFrame to write out."""
+    pd = pandas()
+    if is_dataframe(value):
+        return value
+    if is_series(value):
+        return value.to_frame()
+    if is_ndarray(value):
+        return pd.DataFrame(value if value.ndim == 2 else value.reshape(-1, 1))
+    if isinstance(value, dict):
+        return pd.DataFrame(value)
+    if isinstance(value, list):
+        return pd.DataFrame({"value": value})
+    return pd.DataFrame({"value": [value]})
+
+
+class _Output:
+    """Results for one input file, written in chunk order as they complete."""
+
+    def __init__(self, source: str, path: str):
+        self.source = source
+        self.path = path
+        self.pending = collections.deque()
+        self.chunks = 0
+        self.rows = 0
+        self.error = None
+        self.read = False
+        self.reported = False
+        self.started = time.perf_counter()
+
+    @property
+    def finished(self) -> bool:
+        return self.read and not self.pending
+
+    def flush(self):
+        """Append the results of leading chunks that are done."""
+        while self.pending and self.pending[0][0].done():
+            future, rows = self.pending.popleft()
+            if self.error is not None:
+                continue
+            try:
+                frame = _as_frame(future.result())
+                frame.to_csv(
+                    self.path,
+                    mode="a" if self.chunks else "w",
+                    header=not self.chunks,
+                    index=False,
+                )
+            except Exception as e:
+                self.fail(e)
+                continue
+            self.chunks += 1
+            self.rows += rows
+
+    def fail(self, error: Exception):
+        """Record the first error and drop partial output."""
+        if self.error is None:
+            self.error = error
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
 
-@click.command()
-def main(args=None):
-    """Console script for rtopy."""
+@main.command("run")
+@click.argument("script", type=click.Path(exists=True, dir_okay=False))
+@click.argument("files", nargs=-1, type=click.Path())
+@click.option("--func", "-f", required=True, help="R function to call.")
+@click.option(
+    "--input",
+    "-i",
+    "inputs",
+    multiple=True,
+    help="Input file or glob pattern; may be repeated.",
+)
+@click.option(
+    "--output",
+    "-o",
+    required=True,
+    type=click.Path(file_okay=False),
+    help="Directory for the results, one CSV per input file.",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="R processes.",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Rows per call; whole files by default.",
+)
+@click.option(
+    "--arg",
+    "arg_name",
+    default="data",
+    show_default=True,
+    help="Name of the R argument receiving each data frame.",
+)
+@click.option(
+    "--param",
+    "-p",
+    "params",
+    multiple=True,
+    help="Extra argument NAME=VALUE for every call (VALUE parsed as JSON).",
+)
+@click.option(
+    "--timeout",
+    default=300,
+    show_default=True,
+    help="Seconds allowed per call.",
+)
+def run(
+    script,
+    files,
+    func,
+    inputs,
+    output,
+    workers,
+    chunk_size,
+    arg_name,
+    params,
+    timeout,
+):
+    """
+    Apply an R function to every row chunk of the input files.
+
+    SCRIPT defines the function. Inputs are CSV, TSV, Parquet, Feather or
+    JSON files given with --input or, e.g. when the shell expands a glob,
+    as FILES. Each file, or each --chunk-size rows of it, is passed as a
+    data frame to a pool of warm R workers, and the results are appended
+    to OUTPUT/<name>.csv in order as they complete.
+    """
+    from .pool import RBridgePool
+
+    if not HAS_PANDAS:
+        raise click.ClickException(
+            "rtopy run needs pandas: pip install pandas"
+        )
+    paths = _expand_inputs(list(inputs) + list(files))
+    if not paths:
+        raise click.UsageError("no input files given")
+    names = [os.path.splitext(os.path.basename(p))[0] + ".csv" for p in paths]
+    clashes = sorted(n for n, c in collections.Counter(names).items() if c > 1)
+    if clashes:
+        raise click.UsageError(f"inputs would overwrite each other: {clashes}")
+    extra = dict(_parse_param(p) for p in params)
+    with open(script, encoding="utf-8") as f:
+        r_code = f.read()
+
+    os.makedirs(output, exist_ok=True)
+    outputs = [
+        _Output(p, os.path.join(output, n)) for p, n in zip(paths, names)
+    ]
+    # Chunks submitted but not yet written: enough to keep every worker
+    # busy, few enough that input is not read far ahead of R and results
+    # do not pile up behind a slow chunk
+    max_pending = 2 * workers
+
+    def pending():
+        return [f for out in outputs for f, _ in out.pending]
+
+    def settle(block: bool):
+        running = [f for f in pending() if not f.done()]
+        if block and running:
+            concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+        for out in outputs:
+            out.flush()
+            if out.finished and not out.reported:
+                out.reported = True
+                report(out)
+
+    def report(out):
+        if out.error is not None:
+            click.echo(f"{out.source}: failed: {out.error}", err=True)
+            return
+        seconds = time.perf_counter() - out.started
+        click.echo(
+            f"{out.source} -> {out.path}: {out.rows:,} rows, "
+            f"{out.chunks} chunk(s), {seconds:.1f}s",
+            err=True,
+        )
+
+    start = time.perf_counter()
+    with RBridgePool(size=workers, timeout=timeout) as pool:
+        for out in outputs:
+            out.started = time.perf_counter()
+            try:
+                for chunk in _read_chunks(out.source, chunk_size):
+                    while len(pending()) >= max_pending:
+                        settle(block=True)
+                    if out.error is not None:
+                        break
+                    kwargs = dict(extra, **{arg_name: chunk})
+                    future = pool.submit(
+                        r_code, func, return_type="pandas", **kwargs
+                    )
+                    out.pending.append((future, len(chunk)))
+            except click.ClickException:
+                raise
+            except Exception as e:
+                out.fail(e)
+            out.read = True
+            settle(block=False)
+        while pending():
+            settle(block=True)
+
+    elapsed = time.perf_counter() - start
+    failed = [out for out in outputs if out.error is not None]
+    rows = sum(out.rows for out in outputs)
+    chunks = sum(out.chunks for out in outputs)
+    size = sum(os.path.getsize(out.source) for out in outputs)
     click.echo(
-        "Replace this message by putting your code into " "rtopy.cli.main"
+        f"{len(outputs) - len(failed)}/{len(outputs)} file(s), "
+        f"{chunks} chunk(s), "
+        f"{rows:,} rows in {elapsed:.1f}s with {workers} worker(s): "
+        f"{rows / elapsed:,.0f} rows/s, {_format_size(size / elapsed)}/s",
+        err=True,
     )
-    click.echo("See click documentation at https://click.palletsprojects.com/")
-    return 0
+    if failed:
+        sys.exit(1)
+
+
+def _parse_workers(text: str) -> list:
+    """Worker counts from a list like "1,2,4,8"."""
+    try:
+        counts = [int(n) for n in text.split(",") if n.strip()]
+    except ValueError:
+        counts = []
+    if not counts or min(counts) < 1:
+        raise click.BadParameter(f"expected counts like 1,2,4, got {text!r}")
+    return counts
+
+
+def _load_args(path, arrays: bool) -> list:
+    """Keyword arguments for each call: a JSON object, or a list of them."""
+    if path is None:
+        return [{}]
+    with open(path, encoding="utf-8") as f:
+        loaded = json.load(f)
+    calls = loaded if isinstance(loaded, list) else [loaded]
+    if not calls or not all(isinstance(c, dict) for c in calls):
+        raise click.BadParameter(
+            "must hold an object of arguments or a list of them",
+            param_hint="--args",
+        )
+    if arrays:
+        calls = [{k: _as_array(v) for k, v in c.items()} for c in calls]
+    return calls
+
+
+def _as_array(value):
+    """Numeric lists as NumPy arrays, so they take the binary transport."""
+    if not isinstance(value, list):
+        return value
+    arr = numpy().array(value)
+    return arr if arr.dtype.kind in "biuf" else value
+
+
+def _percentile(values: list, q: float) -> float:
+    """The q-th percentile of values, interpolating between ranks."""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _summarize(records: list, elapsed: float) -> dict:
+    """Latency percentiles, throughput and mean phases of recorded calls."""
+    ok = [r for r in records if r["error"] is None]
+    summary = {
+        "calls": len(records),
+        "errors": len(records) - len(ok),
+        "seconds": elapsed,
+        "calls_per_sec": len(ok) / elapsed if elapsed else 0.0,
+    }
+    if not ok:
+        return summary
+    totals = [r["total"] for r in ok]
+    summary["latency"] = {
+        "mean": statistics.mean(totals),
+        "p50": _percentile(totals, 50),
+        "p95": _percentile(totals, 95),
+        "p99": _percentile(totals, 99),
+        "max": max(totals),
+    }
+    phases = {}
+    for r in ok:
+        for name, seconds in r["phases"].items():
+            phases[name] = phases.get(name, 0.0) + seconds
+    summary["phases"] = {
+        name: total / len(ok) for name, total in phases.items()
+    }
+    summary["bytes_out"] = statistics.mean(r["bytes_out"] for r in ok)
+    summary["bytes_in"] = statistics.mean(r["bytes_in"] for r in ok)
+    # Everything that is not the R function itself: transport, encoding
+    # and decoding on both sides, and queueing
+    compute = summary["phases"].get("r_call", 0.0)
+    summary["overhead"] = max(0.0, summary["latency"]["mean"] - compute)
+    return summary
+
+
+def _bench_cold(r_code, func, calls, runs, return_type) -> dict:
+    """First calls on freshly started workers."""
+    from .bridge import RBridge
+
+    records = []
+    for i in range(runs):
+        with RBridge(persistent=True) as rb:
+            rb.add_hook(records.append)
+            try:
+                kwargs = calls[i % len(calls)]
+                rb.call(r_code, func, return_type=return_type, **kwargs)
+            except Exception as e:
+                raise click.ClickException(f"{func} failed: {e}")
+    return _summarize(records, sum(r["total"] for r in records))
+
+
+def _bench_pool(r_code, func, calls, workers, repeat, return_type) -> dict:
+    """Warm calls through a pool of `workers` R processes."""
+    from .pool import RBridgePool
+
+    records = []
+    with RBridgePool(size=workers) as pool:
+
+        def submit(i):
+            kwargs = calls[i % len(calls)]
+            return pool.submit(r_code, func, return_type=return_type, **kwargs)
+
+        # Two rounds, so every worker has evaluated the code before timing
+        for future in [submit(i) for i in range(2 * workers)]:
+            try:
+                future.result()
+            except Exception as e:
+                raise click.ClickException(f"{func} failed: {e}")
+        pool.add_hook(records.append)
+        start = time.perf_counter()
+        futures = [submit(i) for i in range(repeat)]
+        concurrent.futures.wait(futures)
+        elapsed = time.perf_counter() - start
+        pool.remove_hook(records.append)
+    summary = _summarize(records, elapsed)
+    summary["workers"] = workers
+    return summary
+
+
+def _print_report(cold: dict, runs: list):
+    ms = 1e3
+    if "latency" in cold:
+        phases = cold["phases"]
+        spawn = phases.get("spawn", 0.0) + phases.get("packages", 0.0)
+        click.echo(
+            f"cold call: {cold['latency']['p50'] * ms:.1f} ms median over "
+            f"{cold['calls']} run(s), {spawn * ms:.1f} ms of it starting R"
+        )
+    click.echo()
+    click.echo(
+        f"{'workers':>7} {'calls/s':>10} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'errors':>7}"
+    )
+    for run in runs:
+        latency = run.get("latency", {})
+        click.echo(
+            f"{run['workers']:>7} {run['calls_per_sec']:>10.1f} "
+            + " ".join(
+                f"{latency[q] * ms:>9.2f}" if latency else f"{'-':>9}"
+                for q in ("p50", "p95", "p99")
+            )
+            + f" {run['errors']:>7}"
+        )
+
+    runs = [run for run in runs if "latency" in run]
+    if not runs:
+        return
+    # Phases in the order calls go through them
+    names = list(dict.fromkeys(n for run in runs for n in run["phases"]))
+    click.echo()
+    click.echo(
+        f"{'mean per call':<16}"
+        + "".join(f"{'w=%d' % r['workers']:>10}" for r in runs)
+    )
+    for name in names:
+        click.echo(
+            f"  {name + ' ms':<14}"
+            + "".join(
+                f"{r['phases'].get(name, 0.0) * ms:>10.3f}" for r in runs
+            )
+        )
+    rows = [
+        ("total ms", lambda r: f"{r['latency']['mean'] * ms:.3f}"),
+        ("overhead", lambda r: f"{r['overhead'] / r['latency']['mean']:.0%}"),
+        ("bytes sent", lambda r: _format_size(r["bytes_out"])),
+        ("bytes recv", lambda r: _format_size(r["bytes_in"])),
+    ]
+    for label, cell in rows:
+        click.echo(f"  {label:<14}" + "".join(f"{cell(r):>10}" for r in runs))
+
+
+@main.command("bench")
+@click.argument("script", type=click.Path(exists=True, dir_okay=False))
+@click.option("--func", "-f", required=True, help="R function to call.")
+@click.option(
+    "--args",
+    "args_path",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="JSON object of arguments, or a list of them used in turn.",
+)
+@click.option(
+    "--arrays",
+    is_flag=True,
+    help="Send numeric lists in --args as NumPy arrays (binary transport).",
+)
+@click.option(
+    "--repeat",
+    "-n",
+    default=200,
+    show_default=True,
+    help="Timed calls per run.",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default="1",
+    show_default=True,
+    help="Comma-separated worker counts to run with, e.g. 1,2,4,8.",
+)
+@click.option(
+    "--cold-runs",
+    default=3,
+    show_default=True,
+    help="Freshly started workers to time the first call on.",
+)
+@click.option(
+    "--return-type",
+    default="auto",
+    show_default=True,
+    help="return_type of the calls.",
+)
+@click.option(
+    "--json",
+    "json_path",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Also write the full results to this file.",
+)
+def bench(
+    script, func, args_path, arrays, repeat, workers, cold_runs, return_type,
+    json_path,
+):
+    """
+    Measure the latency and throughput of an R function behind the bridge.
+
+    Times the first call on a fresh worker, then --repeat warm calls through
+    pools of each --workers size, and reports p50/p95/p99 latency,
+    calls per second, the mean time per phase of a call (encoding, R
+    evaluation, transfer, decoding...), the share of it that is overhead
+    rather than the R function, and the bytes sent and received. The
+    numbers come from the same per-call statistics as `RBridge.stats`.
+    """
+    if arrays and not HAS_NUMPY:
+        raise click.ClickException("--arrays needs numpy: pip install numpy")
+    counts = _parse_workers(workers)
+    calls = _load_args(args_path, arrays)
+    with open(script, encoding="utf-8") as f:
+        r_code = f.read()
+
+    cold = {}
+    if cold_runs:
+        cold = _bench_cold(r_code, func, calls, cold_runs, return_type)
+    runs = [
+        _bench_pool(r_code, func, calls, n, repeat, return_type)
+        for n in counts
+    ]
+    _print_report(cold, runs)
+    if json_path is not None:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"func": func, "cold": cold, "runs": runs}, f, indent=2)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,426 @@
+"""Binary encoding of arrays and data frames exchanged with R workers.
+
+Arrays travel as raw little-endian buffers next to the JSON payload. The
+JSON only carries a small spec per array::
+
+    {"__rtopy__": "array", "dtype": "f8", "shape": [100, 2], "buffer": 0}
+
+Buffers hold the values in column-major (Fortran) order, which is R's
+native layout, so R rebuilds vectors and matrices with `readBin` and `dim<-`.
+Wire dtypes are "f8" (double), "i4" (integer) and "lgl" (logical, stored
+as int32). In R integer and logical vectors, NA is the smallest int32.
+
+Data frames are sent column by column::
+
+    {"__rtopy__": "frame", "nrow": 3, "names": ["x", "g"], "index": null,
+     "columns": [{"dtype": "f8", "shape": [3], "buffer": 0},
+                 {"dtype": "factor", "buffer": 1, "levels": ["a", "b"],
+                  "ordered": false}]}
+
+Besides the array dtypes, a column can be a "factor" (1-based int32
+codes, NA as above), "str" (NUL-terminated UTF-8 strings plus a uint8
+validity mask), "date" (days since epoch) or "posixct" (seconds since
+epoch with a time zone). Categoricals map to factors and back, and
+integer and boolean columns keep NA without being widened to float.
+
+SciPy sparse matrices are sent in compressed sparse column form, R's
+`dgCMatrix` layout, so memory use scales with the number of non-zeros::
+
+    {"__rtopy__": "sparse", "dtype": "f8", "shape": [1000, 50],
+     "indices": 0, "indptr": 1, "data": 2}
+
+"indices" (0-based row of each value) and "indptr" (start of each column
+in the other two) are int32 buffers; "data" is "f8", or "lgl" for boolean
+matrices, which become `lgCMatrix`. R builds them with
+`Matrix::sparseMatrix`, and sparse results come back the same way.
+
+Arrays already backed by a file (`np.memmap`) are not copied at all: the
+worker hands R the file path and offset, and R reads the file directly.
+"""
+
+import mmap
+from typing import Any, Dict, List, Optional, Sequence
+
+from ._compat import (
+    is_dataframe,
+    is_ndarray,
+    is_sparse,
+    numpy,
+    pandas,
+    scipy_sparse,
+)
+from .worker import SharedBuffer, _as_list
+
+MARKER = "__rtopy__"
+
+# R's NA_integer_ (and NA for logicals) is INT_MIN.
+R_NA_INTEGER = -(2**31)
+_INT32_MAX = 2**31 - 1
+
+
+def _add(buffers: List, values) -> int:
+    """Append an array's bytes to the buffer list and return its position."""
+    if _is_file_backed(values):
+        buffers.append(
+            SharedBuffer(values.filename, values.nbytes, values.offset)
+        )
+    else:
+        buffers.append(memoryview(values.ravel(order="F")).cast("B"))
+    return len(buffers) - 1
+
+
+def _is_file_backed(values) -> bool:
+    """Whether R can read an array's bytes straight from its memmap file."""
+    # Only the memmap that owns the mapping has a reliable offset; views
+    # and copy-on-write maps may not match what is on disk.
+    np = numpy()
+    return (
+        isinstance(values, np.memmap)
+        and isinstance(values.base, mmap.mmap)
+        and values.filename is not None
+        and values.mode != "c"
+        and values.flags.f_contiguous
+    )
+
+
+def _fits_int32(values) -> bool:
+    return values.size == 0 or (
+        values.min() > R_NA_INTEGER and values.max() <= _INT32_MAX
+    )
+
+
+def encode_array(arr, buffers: List) -> Optional[Dict]:
+    """
+    Encode a NumPy array for R.
+
+    Parameters
+    ----------
+    arr : np.ndarray
+        Array to encode
+    buffers : list
+        Request buffers; the array's bytes are appended to it
+
+    Returns
+    -------
+    The array spec, or None when the dtype has no binary representation
+    (strings, objects, complex numbers, 0-d arrays) and the array must go
+    through JSON instead.
+    """
+    if arr.ndim == 0:
+        return None
+
+    kind = arr.dtype.kind
+    if kind == "b":
+        dtype, values = "lgl", arr.astype("<i4", order="F")
+    elif kind in "iu":
+        if _fits_int32(arr):
+            dtype, values = "i4", arr.astype("<i4", order="F", copy=False)
+        else:
+            dtype, values = "f8", arr.astype("<f8", order="F")
+    elif kind == "f":
+        dtype, values = "f8", arr.astype("<f8", order="F", copy=False)
+    else:
+        return None
+
+    return {
+        MARKER: "array",
+        "dtype": dtype,
+        "shape": list(arr.shape),
+        "buffer": _add(buffers, values),
+    }
+
+
+def encode_sparse(mat, buffers: List) -> Dict:
+    """
+    Encode a 2-d SciPy sparse matrix or array for R.
+
+    Only the non-zeros are copied: CSC input with int32 indices is sent
+    as it is, other formats are converted to CSC first.
+
+    Raises
+    ------
+    ValueError
+        If the matrix is not 2-d, or has more non-zeros or columns than an
+        R sparse matrix can index
+    """
+    np = numpy()
+    if mat.ndim != 2:
+        raise ValueError("Only 2-d sparse matrices can be sent to R")
+    csc = mat.tocsc()
+    if csc.nnz > _INT32_MAX or max(csc.shape) > _INT32_MAX:
+        raise ValueError("Sparse matrix is too large for R's dgCMatrix")
+
+    if csc.dtype.kind == "b":
+        dtype, data = "lgl", csc.data.astype("<i4")
+    elif csc.dtype.kind in "iuf":
+        dtype, data = "f8", csc.data.astype("<f8", copy=False)
+    else:
+        raise ValueError(
+            f"Cannot send sparse matrices of dtype {csc.dtype} to R"
+        )
+
+    return {
+        MARKER: "sparse",
+        "dtype": dtype,
+        "shape": list(csc.shape),
+        "indices": _add(buffers, csc.indices.astype("<i4", copy=False)),
+        "indptr": _add(buffers, csc.indptr.astype("<i4", copy=False)),
+        "data": _add(buffers, np.ascontiguousarray(data)),
+    }
+
+
+def _encode_integers(col, buffers: List, dtype: str) -> Dict:
+    """Encode an integer or boolean Series, writing NA as R's sentinel."""
+    na = col.isna().to_numpy()
+    values = col.to_numpy(dtype="int64", na_value=0)
+    if dtype == "i4" and not _fits_int32(values[~na]):
+        return _encode_doubles(col, buffers)
+    values = values.astype("<i4")
+    values[na] = R_NA_INTEGER
+    return {
+        "dtype": dtype,
+        "shape": [len(values)],
+        "buffer": _add(buffers, values),
+    }
+
+
+def _encode_doubles(col, buffers: List) -> Dict:
+    np = numpy()
+    values = col.to_numpy(dtype="<f8", na_value=np.nan)
+    return {
+        "dtype": "f8",
+        "shape": [len(values)],
+        "buffer": _add(buffers, values),
+    }
+
+
+def _encode_strings(col, buffers: List) -> Dict:
+    np = numpy()
+    na = col.isna().to_numpy()
+    strings = col.astype(object).where(~na, "").astype(str).tolist()
+    data = "\0".join(strings).encode("utf-8") + b"\0" if strings else b""
+    if data.count(b"\0") != len(strings):
+        raise ValueError(
+            "Strings containing NUL characters cannot be sent to R"
+        )
+    buffers.append(data)
+    return {
+        "dtype": "str",
+        "buffer": len(buffers) - 1,
+        "mask": _add(buffers, (~na).astype(np.uint8)),
+    }
+
+
+def encode_column(col, buffers: List) -> Dict:
+    """Encode a pandas Series as a typed column spec."""
+    np = numpy()
+    pd = pandas()
+    dtype = col.dtype
+    types = pd.api.types
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        codes = col.cat.codes.to_numpy().astype("<i4")
+        codes = np.where(codes < 0, R_NA_INTEGER, codes + 1).astype("<i4")
+        return {
+            "dtype": "factor",
+            "buffer": _add(buffers, codes),
+            "levels": [str(c) for c in col.cat.categories],
+            "ordered": bool(col.cat.ordered),
+        }
+    if types.is_datetime64_any_dtype(dtype):
+        tz = getattr(dtype, "tz", None)
+        naive = col.dt.tz_convert(None) if tz is not None else col
+        ns = naive.to_numpy(dtype="datetime64[ns]").view("<i8")
+        seconds = ns / 1e9
+        seconds[naive.isna().to_numpy()] = np.nan
+        return {
+            "dtype": "posixct",
+            "buffer": _add(buffers, seconds),
+            "tz": str(tz) if tz is not None else "",
+        }
+    if types.is_bool_dtype(dtype):
+        return _encode_integers(col, buffers, "lgl")
+    if types.is_integer_dtype(dtype):
+        return _encode_integers(col, buffers, "i4")
+    if types.is_float_dtype(dtype):
+        return _encode_doubles(col, buffers)
+
+    inferred = types.infer_dtype(col, skipna=True)
+    if inferred == "boolean":
+        return _encode_integers(col, buffers, "lgl")
+    if inferred == "integer":
+        return _encode_integers(col, buffers, "i4")
+    if inferred in ("floating", "mixed-integer-float", "decimal"):
+        return _encode_doubles(col.astype("float64"), buffers)
+    return _encode_strings(col, buffers)
+
+
+def encode_frame(df, buffers: List) -> Dict:
+    """Encode a pandas DataFrame as a typed, columnar frame spec."""
+    pd = pandas()
+    index = None
+    default_index = isinstance(df.index, pd.RangeIndex) and (
+        df.index.start == 0 and df.index.step == 1
+    )
+    # R row names must be unique; anything else is dropped like before
+    if not default_index and df.index.is_unique:
+        index = encode_column(pd.Series(df.index.astype(str)), buffers)
+
+    return {
+        MARKER: "frame",
+        "nrow": len(df),
+        "names": [str(c) for c in df.columns],
+        "columns": [
+            encode_column(df.iloc[:, i], buffers) for i in range(df.shape[1])
+        ],
+        "index": index,
+    }
+
+
+def encode_series(s, buffers: List) -> Dict:
+    """Encode a pandas Series as a standalone R vector."""
+    spec = encode_column(s, buffers)
+    spec[MARKER] = "column"
+    spec["n"] = len(s)
+    return spec
+
+
+def decode_array(spec: Dict, buffers: Sequence):
+    """Rebuild a NumPy array from its spec without copying the buffer."""
+    np = numpy()
+    shape = tuple(int(n) for n in _as_list(spec["shape"]))
+    buf = buffers[int(spec["buffer"])]
+
+    if spec["dtype"] == "f8":
+        arr = np.frombuffer(buf, dtype="<f8")
+    else:
+        arr = np.frombuffer(buf, dtype="<i4")
+        na = arr == R_NA_INTEGER
+        if na.any():
+            arr = arr.astype(np.float64)
+            arr[na] = np.nan
+        elif spec["dtype"] == "lgl":
+            arr = arr.astype(bool)
+
+    return arr.reshape(shape, order="F")
+
+
+def decode_sparse(spec: Dict, buffers: Sequence):
+    """Rebuild a SciPy CSC matrix from its spec without copying the buffers."""
+    np = numpy()
+    buf = buffers[int(spec["data"])]
+    if spec["dtype"] == "f8":
+        data = np.frombuffer(buf, dtype="<f8")
+    else:
+        data = np.frombuffer(buf, dtype="<i4").astype(bool)
+    return scipy_sparse().csc_matrix(
+        (
+            data,
+            np.frombuffer(buffers[int(spec["indices"])], dtype="<i4"),
+            np.frombuffer(buffers[int(spec["indptr"])], dtype="<i4"),
+        ),
+        shape=tuple(int(n) for n in _as_list(spec["shape"])),
+    )
+
+
+def decode_column(spec: Dict, buffers: Sequence):
+    """Rebuild one data frame column, keeping its R type."""
+    np = numpy()
+    pd = pandas()
+    kind = spec["dtype"]
+    buf = buffers[int(spec["buffer"])]
+
+    if kind == "f8":
+        return np.frombuffer(buf, dtype="<f8")
+    if kind in ("i4", "lgl"):
+        values = np.frombuffer(buf, dtype="<i4")
+        na = values == R_NA_INTEGER
+        if kind == "lgl":
+            values = values.astype(bool)
+            return pd.arrays.BooleanArray(values, na) if na.any() else values
+        return pd.arrays.IntegerArray(values, na) if na.any() else values
+    if kind == "factor":
+        codes = np.frombuffer(buf, dtype="<i4")
+        codes = np.where(codes == R_NA_INTEGER, -1, codes - 1)
+        return pd.Categorical.from_codes(
+            codes,
+            categories=[str(x) for x in _as_list(spec.get("levels"))],
+            ordered=bool(spec.get("ordered")),
+        )
+    if kind == "str":
+        values = np.array(
+            [s.decode("utf-8") for s in bytes(buf).split(b"\0")[:-1]],
+            dtype=object,
+        )
+        mask = np.frombuffer(buffers[int(spec["mask"])], dtype=np.uint8)
+        values[mask == 0] = None
+        return values
+    if kind == "date":
+        return pd.to_datetime(np.frombuffer(buf, dtype="<f8"), unit="D")
+    if kind == "posixct":
+        seconds = np.frombuffer(buf, dtype="<f8")
+        stamps = pd.to_datetime(seconds, unit="s", utc=True)
+        tz = spec.get("tz") or ""
+        return stamps.tz_convert(tz) if tz else stamps.tz_localize(None)
+    raise ValueError(f"Unknown column dtype '{kind}'")
+
+
+def decode_frame(spec: Dict, buffers: Sequence):
+    """Rebuild a pandas DataFrame from its frame spec."""
+    pd = pandas()
+    columns = [decode_column(c, buffers) for c in _as_list(spec["columns"])]
+    index = None
+    if spec.get("index") is not None:
+        index = pd.Index(decode_column(spec["index"], buffers))
+    elif not columns:
+        # A frame without columns still has its rows
+        index = pd.RangeIndex(int(spec.get("nrow") or 0))
+
+    df = pd.DataFrame(dict(enumerate(columns)), index=index, copy=False)
+    df.columns = [str(name) for name in _as_list(spec["names"])]
+    return df
+
+
+def decode(obj: Any, buffers: Sequence) -> Any:
+    """Replace every array or frame spec in a parsed JSON tree."""
+    if isinstance(obj, dict):
+        kind = obj.get(MARKER)
+        if kind == "array":
+            return decode_array(obj, buffers)
+        if kind == "frame":
+            return decode_frame(obj, buffers)
+        if kind == "sparse":
+            return decode_sparse(obj, buffers)
+        return {k: decode(v, buffers) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [decode(v, buffers) for v in obj]
+    return obj
+
+
+def to_builtin(obj: Any) -> Any:
+    """
+    Turn decoded arrays and frames back into what JSON would have given.
+
+    Arrays become nested lists, frames become dicts of column lists, and
+    missing values become None, as jsonlite writes NA as null. Sparse
+    matrices are made dense.
+    """
+    if is_sparse(obj):
+        obj = obj.toarray()
+    if is_dataframe(obj):
+        return {
+            name: col.astype(object).where(col.notna(), None).tolist()
+            for name, col in obj.items()
+        }
+    if is_ndarray(obj):
+        if obj.dtype.kind == "f":
+            na = numpy().isnan(obj)
+            if na.any():
+                obj = obj.astype(object)
+                obj[na] = None
+        return obj.tolist()
+    if isinstance(obj, dict):
+        return {k: to_builtin(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [to_builtin(v) for v in obj]
+    return obj
@@ -0,0 +1,205 @@
+"""Process-wide discovery of the R installation.
+
+Probing R means starting an R process, which costs far more than the
+calls rtopy makes to it, so the result is kept for the life of the
+process. It can also be persisted to a JSON file, keyed by PATH and the
+Rscript binary, so that short-lived processes skip the probe as well.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+from typing import Dict, Optional
+
+from .exceptions import RNotFoundError
+
+# Set to a file path to persist discovery results between processes.
+CACHE_ENV = "RTOPY_R_CACHE"
+
+_PROBE = r"""
+cat("version=", R.version$major, ".", R.version$minor, "\n", sep = "")
+cat("os=", .Platform$OS.type, "\n", sep = "")
+cat("jsonlite=", requireNamespace("jsonlite", quietly = TRUE), "\n", sep = "")
+caps <- capabilities()
+cat(paste0("capability.", names(caps), "=", caps), sep = "\n")
+"""
+
+_lock = threading.Lock()
+_installation: Optional["RInstallation"] = None
+
+
+class RInstallation:
+    """What rtopy knows about the R it runs."""
+
+    def __init__(
+        self,
+        rscript: str,
+        version: str,
+        os_type: str,
+        jsonlite: bool,
+        capabilities: Dict[str, bool],
+    ):
+        self.rscript = rscript
+        self.version = version
+        self.os_type = os_type
+        self.jsonlite = jsonlite
+        self.capabilities = capabilities
+
+    def __repr__(self):
+        return (
+            f"RInstallation(rscript={self.rscript!r}, "
+            f"version={self.version!r}, jsonlite={self.jsonlite})"
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "rscript": self.rscript,
+            "version": self.version,
+            "os_type": self.os_type,
+            "jsonlite": self.jsonlite,
+            "capabilities": self.capabilities,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RInstallation":
+        return cls(
+            data["rscript"],
+            data["version"],
+            data["os_type"],
+            data["jsonlite"],
+            data["capabilities"],
+        )
+
+
+def find_r(
+    refresh: bool = False, cache_path: Optional[str] = None
+) -> RInstallation:
+    """
+    Return the R installation, probing it at most once per process.
+
+    Parameters
+    ----------
+    refresh : bool
+        Probe R again even if a result is cached (default: False)
+    cache_path : str or None
+        JSON file persisting the result between processes; defaults to
+        the RTOPY_R_CACHE environment variable, if set. The file is
+        ignored when PATH or the Rscript binary has changed.
+
+    Raises
+    ------
+    RNotFoundError
+        If Rscript is not on PATH or cannot be run
+
+    Examples
+    --------
+    >>> find_r().version
+    '4.3.2'
+    """
+    global _installation
+    with _lock:
+        if _installation is not None and not refresh:
+            return _installation
+
+        if cache_path is None:
+            cache_path = os.environ.get(CACHE_ENV)
+        rscript = shutil.which("Rscript")
+        if rscript is None:
+            _installation = None
+            raise RNotFoundError(
+                "R not found. Please install R and add to PATH.\n"
+                "Download from: https://cran.r-project.org/"
+            )
+        key = _fingerprint(rscript)
+
+        installation = None
+        if cache_path and not refresh:
+            installation = _load(cache_path, key)
+        if installation is None:
+            installation = _probe(rscript)
+            if cache_path:
+                _save(cache_path, key, installation)
+        _installation = installation
+        return installation
+
+
+def refresh(cache_path: Optional[str] = None) -> RInstallation:
+    """Probe R again, e.g. after installing packages or changing PATH."""
+    return find_r(refresh=True, cache_path=cache_path)
+
+
+def _fingerprint(rscript: str) -> Dict:
+    """What a persisted result depends on."""
+    st = os.stat(rscript)
+    return {
+        "path": os.environ.get("PATH", ""),
+        "rscript": os.path.realpath(rscript),
+        "mtime": st.st_mtime_ns,
+        "size": st.st_size,
+    }
+
+
+def _probe(rscript: str) -> RInstallation:
+    try:
+        proc = subprocess.run(
+            [rscript, "--vanilla", "-e", _PROBE],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except subprocess.TimeoutExpired:
+        raise RNotFoundError("R check timed out")
+    except OSError:
+        raise RNotFoundError(
+            "R not found. Please install R and add to PATH.\n"
+            "Download from: https://cran.r-project.org/"
+        )
+    if proc.returncode != 0:
+        raise RNotFoundError(f"Rscript failed to start:\n{proc.stderr}")
+    return _parse(rscript, proc.stdout)
+
+
+def _parse(rscript: str, output: str) -> RInstallation:
+    fields = {}
+    for line in output.splitlines():
+        name, sep, value = line.partition("=")
+        if sep:
+            fields[name.strip()] = value.strip()
+    return RInstallation(
+        rscript=rscript,
+        version=fields.get("version", ""),
+        os_type=fields.get("os", ""),
+        jsonlite=fields.get("jsonlite") == "TRUE",
+        capabilities={
+            name[len("capability."):]: value == "TRUE"
+            for name, value in fields.items()
+            if name.startswith("capability.")
+        },
+    )
+
+
+def _load(cache_path: str, key: Dict) -> Optional[RInstallation]:
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("key") != key:
+            return None
+        return RInstallation.from_dict(data["installation"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save(cache_path: str, key: Dict, installation: RInstallation):
+    data = {"key": key, "installation": installation.to_dict()}
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, cache_path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
@@ -0,0 +1,94 @@
+"""Handles to R objects kept resident in a persistent worker."""
+
+import weakref
+from typing import Dict, List
+
+from .exceptions import RExecutionError
+
+
+class RObjectHandle:
+    """
+    Reference to an R object that stays in the worker that created it.
+
+    Returned by `RBridge.call(..., return_type="handle")`. Pass it as an
+    argument to later calls on the same bridge and R receives the object
+    itself, without it crossing the socket. The object is released by
+    `release()`, on leaving a `with` block, or when the handle is garbage
+    collected; stopping the worker releases every object it holds.
+
+    Examples
+    --------
+    >>> model = rb.call(code, "train_svm", return_type="handle", df=train)
+    >>> model.r_class
+    ['svm.formula', 'svm']
+    >>> rb.call(code, "predict_svm", model=model, df=test)
+    >>> model.release()
+    """
+
+    def __init__(
+        self, worker, object_id: str, r_class: List[str], nbytes: float
+    ):
+        self._worker = worker
+        self.id = object_id
+        self.r_class = list(r_class)
+        # object.size() of the value when it was created
+        self.nbytes = int(nbytes)
+        self._finalizer = weakref.finalize(self, worker.discard, object_id)
+
+    def __repr__(self):
+        state = "" if self.alive else ", released"
+        return (
+            f"RObjectHandle({self.id!r}, class={self.r_class!r}, "
+            f"nbytes={self.nbytes}{state})"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __reduce__(self):
+        raise TypeError(
+            "RObjectHandle refers to a live R process; it cannot be pickled"
+        )
+
+    @property
+    def alive(self) -> bool:
+        """Whether the object is still held by a running worker."""
+        return self._finalizer.alive and self._worker.alive
+
+    def release(self):
+        """Free the R object now; later calls using the handle fail."""
+        if not self._finalizer.alive:
+            return
+        self._finalizer.detach()
+        if self._worker.alive:
+            self._worker.request({"op": "release", "release": [self.id]})
+
+    def footprint(self) -> int:
+        """Current `object.size()` of the R object, in bytes."""
+        return int(self._describe()["bytes"])
+
+    def _describe(self) -> Dict:
+        self._check()
+        described = self._worker.describe_objects([self.id])
+        if not described:
+            raise RExecutionError(f"R object {self.id} is no longer resident")
+        return described[0]
+
+    def _check(self):
+        if not self._finalizer.alive:
+            raise ValueError(f"R object handle {self.id} has been released")
+        if not self._worker.alive:
+            raise RExecutionError(
+                f"R object handle {self.id} is invalid: its worker has stopped"
+            )
+
+    def _encode(self) -> Dict:
+        """
+        Argument spec telling R to use the resident object. A worker that
+        does not hold the object fails the call with an R error.
+        """
+        self._check()
+        return {"__rtopy__": "handle", "id": self.id}
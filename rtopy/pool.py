@@ -0,0 +1,155 @@
+"""Pool of warm R workers for concurrent calls."""
+
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .bridge import RBridge
+from .handles import RObjectHandle
+
+
+class RBridgePool:
+    """Dispatch R calls to a fixed set of persistent R workers."""
+
+    def __init__(
+        self,
+        size: int = 2,
+        timeout: int = 300,
+        verbose: bool = False,
+        **bridge_kwargs,
+    ):
+        """
+        Start a pool of persistent R workers.
+
+        Parameters
+        ----------
+        size : int
+            Number of R processes to keep running (default: 2)
+        timeout : int
+            Maximum execution time in seconds per call (default: 300)
+        verbose : bool
+            Print R warnings and messages (default: False)
+        **bridge_kwargs
+            Other `RBridge` options shared by every worker, e.g.
+            `shm_threshold`
+
+        Examples
+        --------
+        >>> with RBridgePool(size=4) as pool:
+        ...     futures = [pool.submit(code, "f", x=x) for x in range(100)]
+        ...     results = [f.result() for f in futures]
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.size = size
+        self._bridges: List[RBridge] = [
+            RBridge(
+                timeout=timeout,
+                verbose=verbose,
+                persistent=True,
+                **bridge_kwargs,
+            )
+            for _ in range(size)
+        ]
+        self._idle: "queue.Queue[RBridge]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="rtopy"
+        )
+        self._closed = False
+
+        # Warm every worker up front, in parallel, so the first calls do not
+        # pay the R startup cost.
+        try:
+            list(self._executor.map(RBridge._get_worker, self._bridges))
+        except Exception:
+            self.close()
+            raise
+        for bridge in self._bridges:
+            self._idle.put(bridge)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def call(
+        self, r_code: str, r_func: str, return_type: str = "auto", **kwargs
+    ) -> Any:
+        """
+        Call an R function on the next idle worker.
+
+        Blocks until a worker is free. Parameters and return value are the
+        same as `RBridge.call`. A call given an `RObjectHandle` runs on the
+        worker holding its object, even if that worker is busy.
+        """
+        if self._closed:
+            raise RuntimeError("RBridgePool is closed")
+        return self._call(r_code, r_func, return_type, kwargs)
+
+    def _call(self, r_code: str, r_func: str, return_type: str, kwargs: dict):
+        owner = self._owner(kwargs)
+        if owner is not None:
+            # The worker serializes its requests, so sharing it is safe
+            return owner.call(
+                r_code, r_func, return_type=return_type, **kwargs
+            )
+        bridge = self._idle.get()
+        try:
+            return bridge.call(
+                r_code, r_func, return_type=return_type, **kwargs
+            )
+        finally:
+            self._idle.put(bridge)
+
+    def _owner(self, kwargs: dict) -> Optional[RBridge]:
+        """The bridge whose worker holds the handles in `kwargs`, if any."""
+        owners = {
+            id(bridge): bridge
+            for v in kwargs.values()
+            if isinstance(v, RObjectHandle)
+            for bridge in self._bridges
+            if bridge._worker is v._worker
+        }
+        if len(owners) > 1:
+            raise ValueError(
+                "R object handles from different workers in one call"
+            )
+        return next(iter(owners.values()), None)
+
+    def submit(
+        self, r_code: str, r_func: str, return_type: str = "auto", **kwargs
+    ) -> Future:
+        """
+        Schedule an R call and return a `concurrent.futures.Future`.
+
+        Calls are queued while all workers are busy.
+        """
+        if self._closed:
+            raise RuntimeError("RBridgePool is closed")
+        return self._executor.submit(
+            self._call, r_code, r_func, return_type, kwargs
+        )
+
+    def add_hook(self, hook: Callable[[Dict[str, Any]], None]):
+        """
+        Call `hook` with the stats of every finished call on any worker.
+
+        See `RBridge.add_hook`; the hook runs in the pool's threads.
+        """
+        for bridge in self._bridges:
+            bridge.add_hook(hook)
+
+    def remove_hook(self, hook: Callable[[Dict[str, Any]], None]):
+        """Stop calling a hook added with `add_hook`."""
+        for bridge in self._bridges:
+            bridge.remove_hook(hook)
+
+    def close(self):
+        """Wait for queued calls, then stop every worker."""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        for bridge in self._bridges:
+            bridge.close()
@@ -0,0 +1,222 @@
+"""Parsed `Rprof` output of a profiled R call."""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Stack frames above the user's function, cut from every sample
+_ROOT = ".rtopy_profile_root"
+# The R code of the call is parsed from text, which Rprof names "<text>"
+_SOURCE_FILE = "<text>"
+
+_INTERVAL = re.compile(r"sample\.interval=(\d+)")
+_MEMORY = re.compile(r"^:(\d+):(\d+):(\d+):(\d+):")
+_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\d+)#(\d+)')
+
+# Approximate bytes per R memory unit reported by Rprof: vector cells in
+# the small and large vector heaps are 8 bytes, and nodes 56 bytes on
+# 64-bit builds. summaryRprof() uses the same weights.
+_CELL_BYTES = (8, 8, 56)
+
+
+class RProfile:
+    """
+    Sampled profile of one R function call.
+
+    Each sample is the call stack at one tick of the profiler, outermost
+    frame first, starting at the called function. A frame is a function
+    name and the line of `r_code` it was executing, when known.
+    """
+
+    def __init__(
+        self,
+        samples: List[Tuple[Tuple[Tuple[str, Optional[int]], ...], int]],
+        interval: float,
+        memory: bool,
+        source: Optional[List[str]] = None,
+    ):
+        """
+        Parameters
+        ----------
+        samples : list of (stack, bytes) tuples
+            Stacks of (function, line) frames, outermost first, and the
+            bytes allocated since the previous sample
+        interval : float
+            Seconds between samples
+        memory : bool
+            Whether allocations were recorded
+        source : list of str or None
+            Lines of the profiled `r_code`
+        """
+        self.samples = samples
+        self.interval = interval
+        self.memory = memory
+        self.source = source or []
+
+    def __repr__(self):
+        return (
+            f"RProfile(samples={len(self.samples)}, "
+            f"total_time={self.total_time:.3f}, memory={self.memory})"
+        )
+
+    @property
+    def total_time(self) -> float:
+        """Sampled time in seconds."""
+        return len(self.samples) * self.interval
+
+    def functions(self) -> Dict[str, Dict[str, float]]:
+        """
+        Time and allocations per function, most self time first.
+
+        "self_time" counts samples where the function was running itself,
+        "total_time" samples where it was anywhere on the stack (counted
+        once per sample, so recursion is not double counted). With memory
+        profiling, "self_bytes" and "total_bytes" attribute allocations
+        the same way.
+        """
+        return self._summarize(lambda frame: frame[0])
+
+    def lines(self) -> Dict[Tuple[str, int], Dict]:
+        """
+        Time and allocations per line of `r_code`, most self time first.
+
+        Keys are (function, line number) pairs; values are as in
+        `functions`, plus the "source" text of the line.
+        """
+        out = self._summarize(
+            lambda frame: frame if frame[1] is not None else None
+        )
+        for (_, line), row in out.items():
+            in_source = 0 < line <= len(self.source)
+            row["source"] = self.source[line - 1].strip() if in_source else ""
+        return out
+
+    def _summarize(self, key) -> Dict:
+        rows: Dict = {}
+
+        def row(k):
+            if k not in rows:
+                rows[k] = {
+                    "self_time": 0.0,
+                    "total_time": 0.0,
+                    "self_bytes": 0,
+                    "total_bytes": 0,
+                }
+            return rows[k]
+
+        for stack, nbytes in self.samples:
+            keys = [key(frame) for frame in stack]
+            known = (k for k in reversed(keys) if k is not None)
+            innermost = next(known, None)
+            if innermost is not None:
+                row(innermost)["self_time"] += self.interval
+                row(innermost)["self_bytes"] += nbytes
+            for k in set(keys) - {None}:
+                row(k)["total_time"] += self.interval
+                row(k)["total_bytes"] += nbytes
+
+        return dict(
+            sorted(rows.items(), key=lambda item: -item[1]["self_time"])
+        )
+
+    def folded(self, lines: bool = True, weight: str = "samples") -> str:
+        """
+        The stacks in the folded format read by flamegraph.pl, speedscope
+        and inferno: one "outer;inner count" line per distinct stack.
+
+        Parameters
+        ----------
+        lines : bool
+            Label frames as "function:line" when the line is known
+            (default: True)
+        weight : str
+            "samples", or "bytes" for an allocation flamegraph (requires
+            memory profiling)
+        """
+        if weight not in ("samples", "bytes"):
+            raise ValueError("weight must be 'samples' or 'bytes'")
+        counts: Dict[str, int] = {}
+        for stack, nbytes in self.samples:
+            labels = [
+                f"{name}:{line}" if lines and line is not None else name
+                for name, line in stack
+            ]
+            folded = ";".join(label.replace(";", ":") for label in labels)
+            counts[folded] = counts.get(folded, 0) + (
+                1 if weight == "samples" else nbytes
+            )
+        return "".join(
+            f"{stack} {count}\n" for stack, count in counts.items() if count
+        )
+
+    def dump_folded(
+        self, path: str, lines: bool = True, weight: str = "samples"
+    ):
+        """Write `folded()` to a file.
+
+        The file can be rendered with e.g. `flamegraph.pl path > out.svg`.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded(lines=lines, weight=weight))
+
+    @classmethod
+    def parse(cls, text: str, source: Optional[str] = None) -> "RProfile":
+        """
+        Parse the contents of an `Rprof` output file.
+
+        Only frames below the function rtopy called are kept; `source` is
+        the R code the call's line numbers refer to.
+        """
+        rows = text.splitlines()
+        if not rows:
+            return cls([], 0.0, False, _lines(source))
+        first = rows[0]
+        match = _INTERVAL.search(first)
+        interval = int(match.group(1)) / 1e6 if match else 0.02
+        memory = "memory profiling" in first
+
+        files: Dict[str, str] = {}
+        samples = []
+        previous = None
+        for row in rows[1:]:
+            if row.startswith("#File "):
+                number, _, name = row[len("#File "):].partition(": ")
+                files[number] = name
+                continue
+            nbytes = 0
+            match = _MEMORY.match(row)
+            if match:
+                cells = [int(v) for v in match.groups()[:3]]
+                used = sum(n * size for n, size in zip(cells, _CELL_BYTES))
+                if previous is not None:
+                    nbytes = max(0, used - previous)
+                previous = used
+                row = row[match.end():]
+            stack = _stack(row, files)
+            if stack:
+                samples.append((stack, nbytes))
+        return cls(samples, interval, memory, _lines(source))
+
+
+def _stack(row: str, files: Dict[str, str]) -> Tuple:
+    """Frames of one sample, outermost first, below the rtopy root."""
+    frames = []
+    location = None
+    # Rprof writes the innermost frame first; a "file#line" token gives the
+    # line being run in the function named right after it.
+    for name, number, line in _TOKEN.findall(row):
+        if not name:
+            if files.get(number) == _SOURCE_FILE:
+                location = int(line)
+            continue
+        if name == _ROOT:
+            if frames and frames[-1][0] == "do.call":
+                frames.pop()
+            return tuple(reversed(frames))
+        frames.append((name, location))
+        location = None
+    # Samples taken outside the call, e.g. while Rprof was starting
+    return ()
+
+
+def _lines(source: Optional[str]) -> List[str]:
+    return source.splitlines() if source else []
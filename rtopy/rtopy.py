@@ -1,36 +1,24 @@
 """Lightweight R-Python bridge with extended type support."""
 
-import subprocess
-import json
-import tempfile
-import os
-from typing import Any, Dict, List, Union, Optional
-from .bridge import RBridge
-
-
-# Convenience function
-def call_r(r_code: str, r_func: str, **kwargs) -> Any:
-    """
-    Quick wrapper for one-off R function calls.
-
-    Examples
-    --------
-    >>> result = call_r("f <- function(x) x^2", "f", x=5)
-    >>> print(result)  # 25.0
-    """
-    rb = RBridge()
-    return rb.call(r_code, r_func, **kwargs)
+# Re-exported for code that imports them from rtopy.rtopy
+from .bridge import RBridge, call_r  # noqa: F401
 
 
 """Main module."""
 
 import re
 import subprocess
-from functools import lru_cache
+from ._compat import is_dataframe, is_ndarray, is_numpy_scalar
+from .bridge import _get_default_bridge
+from .cache import ResultCache, stable_hash
+from .discovery import find_r
+from .exceptions import RTypeError
 from .utils import *
 
+# Results of `callfunc`, which used to be memoized with functools.lru_cache
+_callfunc_cache = ResultCache(max_bytes=16 * 2**20)
+
 
-@lru_cache  # size is 128 'results'
 def callfunc(
     r_code="my_func <- function() {{set.seed(1); rnorm(1)}}",
     r_func="my_func",
@@ -77,6 +65,99 @@ def callfunc(
 
     See also [https://github.com/Techtonique/rtopy/blob/main/rtopy/demo/thierrymoudiki_20240304_rtopyintro.ipynb](https://github.com/Techtonique/rtopy/blob/main/rtopy/demo/thierrymoudiki_20240304_rtopyintro.ipynb)
 
+    The result is transferred as JSON and binary arrays (see `RBridge`)
+    rather than parsed from R's printed output. When R has no jsonlite
+    package, `callfunc` falls back to `callfunc_legacy`. Results are cached
+    by the content of `r_code`, `r_func`, `type_return` and `kwargs`.
+
+    """
+
+    assert r_func in r_code, f"Function {r_func} not found in your `r_code`"
+    if type_return not in _RETURN_TYPES:
+        raise RTypeError(f"Unknown return type: {type_return}")
+
+    try:
+        key = stable_hash("callfunc", r_code, r_func, type_return, kwargs)
+    except (TypeError, ValueError):
+        key = None
+    if key is not None:
+        found, value = _callfunc_cache.get(key)
+        if found:
+            return value
+
+    if find_r().jsonlite:
+        raw = _get_default_bridge().call(
+            r_code, r_func, return_type="raw", **kwargs
+        )
+        result = _RETURN_TYPES[type_return](_plain(raw))
+    else:
+        result = callfunc_legacy(r_code, r_func, type_return, **kwargs)
+
+    if key is not None:
+        _callfunc_cache.set(key, result)
+    return result
+
+
+def _plain(value):
+    """Decoded R value as Python lists, dicts and scalars."""
+    if is_ndarray(value):
+        return value.tolist()
+    if is_numpy_scalar(value):
+        return value.item()
+    if is_dataframe(value):
+        return {str(k): _plain(v) for k, v in value.to_dict("list").items()}
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _unbox(value):
+    """Length-one vectors as scalars, as R prints them."""
+    if (
+        isinstance(value, list)
+        and len(value) == 1
+        and not isinstance(value[0], list)
+    ):
+        return value[0]
+    return value
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _as_dict(value):
+    if isinstance(value, list):
+        # Unnamed R lists print as [[1]], [[2]], ...
+        value = {str(i + 1): v for i, v in enumerate(value)}
+    elif not isinstance(value, dict):
+        raise RTypeError(f"Cannot convert {type(value).__name__} to dict")
+    return {k: _unbox(v) for k, v in value.items()}
+
+
+_RETURN_TYPES = {
+    "int": lambda value: int(_unbox(value)),
+    "float": lambda value: float(_unbox(value)),
+    "list": _as_list,
+    "dict": _as_dict,
+}
+
+
+def callfunc_legacy(
+    r_code="my_func <- function() {{set.seed(1); rnorm(1)}}",
+    r_func="my_func",
+    type_return="float",
+    **kwargs,
+):
+    """
+
+    `callfunc` implemented by parsing the output R prints.
+
+    Slower than `callfunc` on large results and limited to numeric values;
+    kept for R installations without the jsonlite package.
+
     """
 
     assert r_func in r_code, f"Function {r_func} not found in your `r_code`"
@@ -0,0 +1,190 @@
+"""Per-call timing breakdowns and cumulative call statistics."""
+
+import bisect
+import contextlib
+import threading
+import time
+import warnings
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Upper bounds of the histogram buckets, the last one being open-ended
+TIME_BUCKETS = (
+    1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"),
+)
+BYTE_BUCKETS = tuple(float(2**k) for k in range(10, 32, 2)) + (float("inf"),)
+
+# Phases recorded by the R worker, in the order it runs them
+R_PHASES = ("r_parse", "r_args", "r_call", "r_encode")
+
+
+class CallTimer:
+    """
+    Collects the phases of one bridge call.
+
+    Phases are recorded as spans: a name, an offset in seconds from the
+    start of the call and a duration. A phase that occurs more than once
+    is summed in `to_dict()["phases"]`.
+    """
+
+    def __init__(self, kind: str, r_func: str):
+        self.kind = kind
+        self.r_func = r_func
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.cached = False
+        self.error: Optional[str] = None
+        self.total: Optional[float] = None
+
+    def now(self) -> float:
+        """Seconds since the call started."""
+        return time.perf_counter() - self._origin
+
+    def add(self, name: str, start: float, seconds: float):
+        """Record a span starting `start` seconds into the call."""
+        self.spans.append(
+            {"name": name, "start": start, "duration": max(0.0, seconds)}
+        )
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time the body of a `with` block as phase `name`."""
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add(name, start, self.now() - start)
+
+    def add_remote(
+        self, start: float, seconds: float, timing: Dict, name: str
+    ):
+        """
+        Split the `seconds` spent waiting for R into the phases R reported.
+
+        Whatever R does not account for (socket transfer, framing, the
+        worker loop) is recorded as phase `name`.
+        """
+        offset = start
+        for phase in R_PHASES:
+            value = timing.get(phase)
+            if value is None:
+                continue
+            value = min(float(value), start + seconds - offset)
+            self.add(phase, offset, value)
+            offset += value
+        self.add(name, offset, start + seconds - offset)
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.total = self.now()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> Dict:
+        phases: Dict[str, float] = {}
+        for span in self.spans:
+            name = span["name"]
+            phases[name] = phases.get(name, 0.0) + span["duration"]
+        return {
+            "kind": self.kind,
+            "func": self.r_func,
+            "started": self.started,
+            "total": self.total if self.total is not None else self.now(),
+            "phases": phases,
+            "spans": [dict(span) for span in self.spans],
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "cached": self.cached,
+            "error": self.error,
+        }
+
+
+class Histogram:
+    """Count, sum, extremes and bucket counts of a series of values."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "buckets": list(zip(self.bounds, self.counts)),
+        }
+
+
+class CallStats:
+    """Cumulative statistics of finished calls, and the hooks they feed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hooks: List[Callable[[Dict], None]] = []
+        self.last: Optional[Dict] = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.cached = 0
+            self.errors = 0
+            self.total = Histogram(TIME_BUCKETS)
+            self.phases: Dict[str, Histogram] = {}
+            self.bytes_out = Histogram(BYTE_BUCKETS)
+            self.bytes_in = Histogram(BYTE_BUCKETS)
+
+    def record(self, timer: CallTimer):
+        """Fold a finished call into the totals, then run the hooks."""
+        call = timer.to_dict()
+        with self._lock:
+            self.last = call
+            self.calls += 1
+            self.cached += call["cached"]
+            self.errors += call["error"] is not None
+            self.total.add(call["total"])
+            for name, seconds in call["phases"].items():
+                if name not in self.phases:
+                    self.phases[name] = Histogram(TIME_BUCKETS)
+                self.phases[name].add(seconds)
+            if not call["cached"]:
+                self.bytes_out.add(call["bytes_out"])
+                self.bytes_in.add(call["bytes_in"])
+            hooks = list(self.hooks)
+        for hook in hooks:
+            try:
+                hook(call)
+            except Exception as e:
+                # A failing metrics exporter must not fail the R call
+                warnings.warn(
+                    f"rtopy stats hook {hook!r} failed: {e}", RuntimeWarning
+                )
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "cached": self.cached,
+                "errors": self.errors,
+                "total": self.total.to_dict(),
+                "phases": {
+                    name: hist.to_dict() for name, hist in self.phases.items()
+                },
+                "bytes_out": self.bytes_out.to_dict(),
+                "bytes_in": self.bytes_in.to_dict(),
+            }
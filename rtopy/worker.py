@@ -0,0 +1,1508 @@
+"""Persistent R worker processes."""
+
+import asyncio
+import collections
+import glob
+import hmac
+import json
+import mmap
+import os
+import secrets
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .discovery import find_r
+from .exceptions import RExecutionError, RNotFoundError
+
+# Frames exchanged with the worker look like
+#
+#     <uint32 little-endian header length> <JSON header> <buffer 0> ...
+#
+# where the header lists the byte length of every trailing buffer under the
+# "buffers" key. Requests and responses share the same framing. Buffers too
+# large to be worth pushing through the socket are written to a file in
+# shared memory instead; the header lists them under "shared" and their
+# slot in the frame is left empty.
+_HEADER = struct.Struct("<I")
+
+# Bootstrap handed to Rscript on the command line: it reads the driver below
+# from stdin, so the driver never touches the disk.
+_BOOTSTRAP = "source(file('stdin'))"
+
+# Any local process can connect to the loopback port, so the driver first
+# sends a random token it only received over its private stdin pipe, and
+# connections that do not start with it are dropped.
+_TOKEN_BYTES = 16
+# Seconds a connection gets to present the token
+_AUTH_TIMEOUT = 5.0
+# Read buffer of the asyncio streams of `AsyncRWorker`
+_STREAM_LIMIT = 2**20
+
+_DRIVER = r"""
+options(warn = 1)
+
+.rtopy <- new.env()
+.rtopy$con <- socketConnection(
+    host = "127.0.0.1", port = @PORT@, server = FALSE,
+    blocking = TRUE, open = "r+b", timeout = 1e7
+)
+writeBin(charToRaw("@TOKEN@"), .rtopy$con)
+flush(.rtopy$con)
+.rtopy$chunk <- 2^30
+# Environments holding registered r_code, keyed by its hash
+.rtopy$registry <- new.env()
+# Results being streamed back chunk by chunk and accumulators of folds,
+# keyed by stream id
+.rtopy$streams <- new.env()
+# Objects kept in the worker for Python handles, keyed by handle id
+.rtopy$objects <- new.env()
+
+.rtopy_read <- function(n) {
+    if (n == 0) return(raw(0))
+    parts <- list()
+    got <- 0
+    while (got < n) {
+        chunk <- readBin(.rtopy$con, "raw", min(n - got, .rtopy$chunk))
+        if (length(chunk) == 0L) stop("rtopy: connection closed")
+        parts[[length(parts) + 1L]] <- chunk
+        got <- got + length(chunk)
+    }
+    if (length(parts) == 1L) parts[[1L]] else do.call(c, parts)
+}
+
+# writeBin() refuses more than 2^31 - 1 bytes per call, so split long vectors.
+.rtopy_write_values <- function(con, x, size = NA_integer_) {
+    n <- length(x)
+    step <- if (is.character(x)) n else
+        floor(.rtopy$chunk / max(size, 1L, na.rm = TRUE))
+    if (n <= step) {
+        return(writeBin(x, con, size = size, endian = "little"))
+    }
+    for (start in seq(1, n, by = step)) {
+        writeBin(x[start:min(n, start + step - 1)], con, size = size,
+                 endian = "little")
+    }
+}
+
+.rtopy_recv <- function() {
+    head <- readBin(.rtopy$con, "raw", 4L)
+    if (length(head) == 0L) return(NULL)
+    if (length(head) < 4L) head <- c(head, .rtopy_read(4L - length(head)))
+    n <- readBin(head, "integer", size = 4L, endian = "little")
+    header <- jsonlite::fromJSON(
+        rawToChar(.rtopy_read(n)), simplifyVector = FALSE
+    )
+    buffers <- lapply(header$buffers, function(len) .rtopy_read(len))
+    # Large buffers arrive as files in shared memory instead of on the socket
+    for (s in header$shared) buffers[[s$index + 1L]] <- s
+    list(header = header, buffers = buffers)
+}
+
+.rtopy_nbytes <- function(buf) {
+    if (is.raw(buf)) length(buf) else buf$size
+}
+
+# readBin() from either an inline raw buffer or a shared file.
+.rtopy_bin <- function(buf, what, n, size = NA_integer_) {
+    if (is.raw(buf)) {
+        return(readBin(buf, what, n, size = size, endian = "little"))
+    }
+    con <- file(buf$path, "rb")
+    on.exit(close(con))
+    if (!is.null(buf$offset) && buf$offset > 0) seek(con, buf$offset)
+    readBin(con, what, n, size = size, endian = "little")
+}
+
+.rtopy_send <- function(header, buffers = list()) {
+    header$buffers <- I(vapply(buffers, length, numeric(1)))
+    txt <- charToRaw(enc2utf8(as.character(jsonlite::toJSON(
+        header, auto_unbox = TRUE, null = "null", digits = NA
+    ))))
+    writeBin(length(txt), .rtopy$con, size = 4L, endian = "little")
+    writeBin(txt, .rtopy$con)
+    for (b in buffers) .rtopy_write_values(.rtopy$con, b)
+    flush(.rtopy$con)
+}
+
+.rtopy_to_json <- function(x) {
+    charToRaw(enc2utf8(as.character(jsonlite::toJSON(
+        x,
+        auto_unbox = TRUE,
+        force = TRUE,
+        digits = 15,
+        null = "null",
+        na = "null",
+        dataframe = "columns"
+    ))))
+}
+
+.rtopy_decode_array <- function(spec, buffers) {
+    buf <- buffers[[spec$buffer + 1L]]
+    n <- .rtopy_nbytes(buf)
+    x <- switch(
+        spec$dtype,
+        f8 = .rtopy_bin(buf, "double", n %/% 8L, 8L),
+        i4 = .rtopy_bin(buf, "integer", n %/% 4L, 4L),
+        lgl = as.logical(.rtopy_bin(buf, "integer", n %/% 4L, 4L)),
+        stop("rtopy: unknown array dtype ", spec$dtype)
+    )
+    shape <- as.numeric(unlist(spec$shape))
+    if (length(shape) > 1L) dim(x) <- shape
+    x
+}
+
+.rtopy_decode_sparse <- function(spec, buffers) {
+    if (!requireNamespace("Matrix", quietly = TRUE)) {
+        stop("rtopy: sparse matrices need the R package Matrix")
+    }
+    ints <- function(index) {
+        buf <- buffers[[index + 1L]]
+        .rtopy_bin(buf, "integer", .rtopy_nbytes(buf) %/% 4L, 4L)
+    }
+    buf <- buffers[[spec$data + 1L]]
+    x <- if (spec$dtype == "f8") {
+        .rtopy_bin(buf, "double", .rtopy_nbytes(buf) %/% 8L, 8L)
+    } else {
+        as.logical(ints(spec$data))
+    }
+    Matrix::sparseMatrix(
+        i = ints(spec$indices), p = ints(spec$indptr), x = x,
+        dims = as.integer(unlist(spec$shape)), index1 = FALSE
+    )
+}
+
+.rtopy_decode_column <- function(spec, buffers, n) {
+    if (spec$dtype %in% c("f8", "i4", "lgl")) {
+        return(.rtopy_decode_array(spec, buffers))
+    }
+    buf <- buffers[[spec$buffer + 1L]]
+    switch(
+        spec$dtype,
+        factor = structure(
+            .rtopy_bin(buf, "integer", n, 4L),
+            levels = as.character(unlist(spec$levels)),
+            class = if (isTRUE(spec$ordered)) c("ordered", "factor")
+                    else "factor"
+        ),
+        str = {
+            x <- .rtopy_bin(buf, "character", n)
+            Encoding(x) <- "UTF-8"
+            mask <- buffers[[spec$mask + 1L]]
+            x[.rtopy_bin(mask, "raw", .rtopy_nbytes(mask)) == as.raw(0)] <-
+                NA_character_
+            x
+        },
+        posixct = structure(
+            .rtopy_bin(buf, "double", n, 8L),
+            class = c("POSIXct", "POSIXt"),
+            tzone = spec$tz
+        ),
+        stop("rtopy: unknown column dtype ", spec$dtype)
+    )
+}
+
+.rtopy_decode_frame <- function(spec, buffers) {
+    n <- spec$nrow
+    cols <- lapply(spec$columns, .rtopy_decode_column,
+                   buffers = buffers, n = n)
+    names(cols) <- as.character(unlist(spec$names))
+    row_names <- if (is.null(spec$index)) {
+        .set_row_names(as.integer(n))
+    } else {
+        .rtopy_decode_column(spec$index, buffers, n)
+    }
+    structure(cols, class = "data.frame", row.names = row_names)
+}
+
+.rtopy_decode <- function(spec, buffers) {
+    switch(
+        spec$`__rtopy__`,
+        array = .rtopy_decode_array(spec, buffers),
+        frame = .rtopy_decode_frame(spec, buffers),
+        sparse = .rtopy_decode_sparse(spec, buffers),
+        column = .rtopy_decode_column(spec, buffers, spec$n),
+        handle = .rtopy_object(spec$id),
+        stop("rtopy: unknown argument encoding")
+    )
+}
+
+.rtopy_object <- function(id) {
+    if (!exists(id, envir = .rtopy$objects, inherits = FALSE)) {
+        stop("rtopy: R object ", id, " is not resident in this worker ",
+             "(it was released or belongs to another worker)")
+    }
+    get(id, envir = .rtopy$objects, inherits = FALSE)
+}
+
+.rtopy_describe <- function(id) {
+    x <- get(id, envir = .rtopy$objects, inherits = FALSE)
+    list(id = id, class = I(class(x)), bytes = as.numeric(object.size(x)))
+}
+
+# Keep a call's result in the worker and return its description instead.
+.rtopy_keep <- function(id, value) {
+    assign(id, value, envir = .rtopy$objects)
+    .rtopy_describe(id)
+}
+
+# Describe the resident objects, or only those listed in the request.
+.rtopy_objects <- function(req, buffers) {
+    ids <- if (is.null(req$ids)) ls(.rtopy$objects) else unlist(req$ids)
+    ids <- ids[vapply(ids, exists, logical(1), envir = .rtopy$objects,
+                      inherits = FALSE)]
+    unname(lapply(ids, .rtopy_describe))
+}
+
+# Save an object for the R object cache. The file appears under its final
+# name only once complete; failing to save must not fail the call.
+.rtopy_save <- function(value, save) {
+    tmp <- paste0(save$path, ".", Sys.getpid(), ".tmp")
+    tryCatch(
+        {
+            saveRDS(value, tmp, compress = save$compress)
+            file.rename(tmp, save$path)
+        },
+        error = function(e) {
+            unlink(tmp)
+            warning("rtopy: could not cache object: ", conditionMessage(e))
+        }
+    )
+}
+
+.rtopy_release <- function(ids) {
+    ids <- unlist(ids)
+    ids <- ids[vapply(ids, exists, logical(1), envir = .rtopy$objects,
+                      inherits = FALSE)]
+    if (length(ids)) rm(list = ids, envir = .rtopy$objects)
+}
+
+.rtopy_is_array <- function(x) {
+    (is.double(x) || is.integer(x) || is.logical(x)) && !is.object(x) &&
+        (length(x) != 1L || !is.null(dim(x)))
+}
+
+# Add the binary form of x (a raw, character, double or integer vector
+# written with `size` bytes per element) to the response. Past the shared
+# memory threshold it is written straight to a file that Python maps.
+.rtopy_add <- function(state, x, size = NA_integer_) {
+    nbytes <- if (is.character(x)) {
+        sum(nchar(x, type = "bytes")) + length(x)
+    } else {
+        length(x) * (if (is.na(size)) 1 else size)
+    }
+    index <- length(state$buffers)
+    if (!is.null(state$shm) && nbytes >= state$shm$threshold) {
+        path <- tempfile(state$shm$prefix, tmpdir = state$shm$dir,
+                         fileext = ".bin")
+        state$shared[[length(state$shared) + 1L]] <- list(
+            index = index, path = path, size = nbytes
+        )
+        con <- file(path, "wb")
+        .rtopy_write_values(con, x, size)
+        close(con)
+        state$buffers[[index + 1L]] <- raw(0)
+    } else if (is.raw(x)) {
+        state$buffers[[index + 1L]] <- x
+    } else {
+        state$buffers[[index + 1L]] <- writeBin(x, raw(), size = size,
+                                                endian = "little")
+    }
+    index
+}
+
+.rtopy_doubles <- function(state, x) .rtopy_add(state, as.double(x), 8L)
+
+.rtopy_integers <- function(state, x) .rtopy_add(state, as.integer(x), 4L)
+
+.rtopy_encode_column <- function(x, state) {
+    if (is.factor(x)) {
+        return(list(
+            dtype = "factor",
+            buffer = .rtopy_integers(state, unclass(x)),
+            levels = I(levels(x)),
+            ordered = is.ordered(x)
+        ))
+    }
+    if (inherits(x, "Date")) {
+        return(list(dtype = "date",
+                    buffer = .rtopy_doubles(state, unclass(x))))
+    }
+    if (inherits(x, "POSIXct")) {
+        tz <- attr(x, "tzone")
+        return(list(
+            dtype = "posixct",
+            buffer = .rtopy_doubles(state, unclass(x)),
+            tz = if (length(tz)) tz[[1L]] else ""
+        ))
+    }
+    if (is.object(x) || !is.atomic(x) || is.complex(x) || is.raw(x)) {
+        x <- as.character(x)
+    }
+    if (is.character(x)) {
+        valid <- !is.na(x)
+        x[!valid] <- ""
+        return(list(
+            dtype = "str",
+            buffer = .rtopy_add(state, enc2utf8(x)),
+            mask = .rtopy_add(state, as.raw(valid))
+        ))
+    }
+    if (is.double(x)) {
+        return(list(dtype = "f8", shape = I(length(x)),
+                    buffer = .rtopy_doubles(state, x)))
+    }
+    list(dtype = if (is.logical(x)) "lgl" else "i4", shape = I(length(x)),
+         buffer = .rtopy_integers(state, x))
+}
+
+.rtopy_encode_frame <- function(x, state) {
+    list(
+        `__rtopy__` = "frame",
+        nrow = nrow(x),
+        names = I(names(x)),
+        columns = unname(lapply(x, .rtopy_encode_column, state = state)),
+        index = if (.row_names_info(x) > 0L) {
+            .rtopy_encode_column(rownames(x), state)
+        }
+    )
+}
+
+# Numeric, logical and pattern matrices from the Matrix package; the
+# package is never loaded just to check.
+.rtopy_is_sparse <- function(x) {
+    isS4(x) && isNamespaceLoaded("Matrix") &&
+        methods::is(x, "sparseMatrix") && !methods::is(x, "zMatrix")
+}
+
+.rtopy_encode_sparse <- function(x, state) {
+    # Symmetric, triangular, row and triplet forms all become plain CSC
+    x <- methods::as(methods::as(x, "CsparseMatrix"), "generalMatrix")
+    values <- if (methods::is(x, "nsparseMatrix")) {
+        rep(TRUE, length(x@i))
+    } else {
+        x@x
+    }
+    list(
+        `__rtopy__` = "sparse",
+        dtype = if (is.logical(values)) "lgl" else "f8",
+        shape = I(dim(x)),
+        indices = .rtopy_integers(state, x@i),
+        indptr = .rtopy_integers(state, x@p),
+        data = if (is.logical(values)) .rtopy_integers(state, values)
+               else .rtopy_doubles(state, values)
+    )
+}
+
+# Swap numeric vectors, matrices, arrays, sparse matrices and data frames
+# in a result for binary buffers, leaving a small spec in their place for
+# the JSON payload.
+.rtopy_encode <- function(x, state) {
+    if (is.data.frame(x)) {
+        if (isTRUE(state$frames)) return(.rtopy_encode_frame(x, state))
+        return(x)
+    }
+    if (isTRUE(state$sparse) && .rtopy_is_sparse(x)) {
+        return(.rtopy_encode_sparse(x, state))
+    }
+    if (.rtopy_is_array(x)) {
+        shape <- dim(x)
+        if (is.null(shape)) shape <- length(x)
+        if (is.double(x)) {
+            dtype <- "f8"
+            buffer <- .rtopy_doubles(state, x)
+        } else {
+            dtype <- if (is.logical(x)) "lgl" else "i4"
+            buffer <- .rtopy_integers(state, x)
+        }
+        return(list(
+            `__rtopy__` = "array",
+            dtype = dtype,
+            shape = I(as.numeric(shape)),
+            buffer = buffer
+        ))
+    }
+    if (is.list(x) && !is.object(x)) {
+        return(lapply(x, .rtopy_encode, state = state))
+    }
+    x
+}
+
+.rtopy_compile <- function(env) {
+    for (name in ls(env, all.names = TRUE)) {
+        f <- get(name, envir = env)
+        if (is.function(f) && !is.primitive(f)) {
+            assign(name, compiler::cmpfun(f), envir = env)
+        }
+    }
+}
+
+.rtopy_elapsed <- function() proc.time()[["elapsed"]]
+
+# Evaluate expr, adding its run time to the request's timing for phase.
+.rtopy_timed <- function(phase, expr) {
+    start <- .rtopy_elapsed()
+    on.exit(.rtopy$timing[[phase]] <- sum(
+        .rtopy$timing[[phase]], .rtopy_elapsed() - start
+    ))
+    expr
+}
+
+# Evaluate the request's code, or look it up when only its key was sent.
+.rtopy_env <- function(req) {
+    .rtopy_timed("r_parse", .rtopy_env_lookup(req))
+}
+
+.rtopy_env_lookup <- function(req) {
+    if (is.null(req$code)) {
+        env <- .rtopy$registry[[req$key]]
+        if (is.null(env))
+            stop("rtopy: code is not registered with this worker")
+        return(env)
+    }
+    env <- new.env(parent = globalenv())
+    suppressPackageStartupMessages(
+        eval(parse(text = req$code, keep.source = isTRUE(req$keep_source)),
+             envir = env)
+    )
+    if (isTRUE(req$compile)) .rtopy_compile(env)
+    if (!is.null(req$key)) assign(req$key, env, envir = .rtopy$registry)
+    env
+}
+
+.rtopy_args <- function(item, buffers) {
+    .rtopy_timed("r_args", .rtopy_decode_args(item, buffers))
+}
+
+.rtopy_decode_args <- function(item, buffers) {
+    args <- jsonlite::fromJSON(item$args)
+    for (name in names(item$encoded)) {
+        args[[name]] <- .rtopy_decode(item$encoded[[name]], buffers)
+    }
+    args
+}
+
+.rtopy_call <- function(req, buffers) {
+    env <- .rtopy_env(req)
+    fn <- get(req$func, envir = env, mode = "function")
+    if (!is.null(req$profile)) {
+        return(.rtopy_profile(req, env, .rtopy_args(req, buffers)))
+    }
+    do.call(fn, .rtopy_args(req, buffers))
+}
+
+# Marks where the user's function starts in profiled call stacks; the
+# function is called by name so that Rprof records its name.
+.rtopy_profile_root <- function(name, args, env) {
+    do.call(name, args, envir = env)
+}
+
+# Run the call under Rprof and keep the raw samples for the response.
+.rtopy_profile <- function(req, env, args) {
+    path <- tempfile("rtopy-prof-", fileext = ".out")
+    on.exit({
+        Rprof(NULL)
+        unlink(path)
+    })
+    Rprof(path, interval = req$profile$interval, line.profiling = TRUE,
+          memory.profiling = isTRUE(req$profile$memory))
+    value <- .rtopy_profile_root(req$func, args, env)
+    Rprof(NULL)
+    .rtopy$profile <- paste(readLines(path), collapse = "\n")
+    value
+}
+
+.rtopy_rows <- function(x) {
+    if (is.data.frame(x) || is.matrix(x)) nrow(x) else length(x)
+}
+
+.rtopy_slice <- function(x, from, to) {
+    rows <- if (to >= from) seq.int(from, to) else integer(0)
+    if (is.data.frame(x)) {
+        chunk <- x[rows, , drop = FALSE]
+        if (.row_names_info(x) <= 0L) row.names(chunk) <- NULL
+        return(chunk)
+    }
+    if (is.matrix(x)) return(x[rows, , drop = FALSE])
+    x[rows]
+}
+
+# Evaluate the call and keep its result, then send the first chunk.
+.rtopy_stream <- function(req, buffers) {
+    value <- .rtopy_call(req, buffers)
+    stream <- new.env()
+    stream$value <- value
+    stream$pos <- 0L
+    stream$n <- .rtopy_rows(value)
+    stream$rows <- as.integer(req$chunk_rows)
+    assign(req$stream, stream, envir = .rtopy$streams)
+    .rtopy_next(req, buffers)
+}
+
+.rtopy_next <- function(req, buffers) {
+    stream <- .rtopy$streams[[req$stream]]
+    if (is.null(stream)) stop("rtopy: unknown stream")
+    end <- min(stream$n, stream$pos + stream$rows)
+    chunk <- .rtopy_slice(stream$value, stream$pos + 1L, end)
+    stream$pos <- end
+    done <- end >= stream$n
+    if (done) rm(list = req$stream, envir = .rtopy$streams)
+    list(done = done, value = chunk, schema = .rtopy_schema(chunk))
+}
+
+# Apply the function to one chunk and fold its result into the stream's
+# accumulator with the reducer.
+.rtopy_fold <- function(req, buffers) {
+    env <- .rtopy_env(req)
+    fn <- get(req$func, envir = env, mode = "function")
+    value <- do.call(fn, .rtopy_args(req, buffers))
+    acc <- .rtopy$streams[[req$stream]]
+    if (!is.null(acc)) {
+        reducer <- get(req$reducer, envir = env, mode = "function")
+        value <- reducer(acc$value, value)
+    }
+    assign(req$stream, list(value = value), envir = .rtopy$streams)
+    NULL
+}
+
+.rtopy_collect <- function(req, buffers) {
+    acc <- .rtopy$streams[[req$stream]]
+    .rtopy_cancel(req, buffers)
+    if (is.null(acc)) NULL else acc$value
+}
+
+.rtopy_cancel <- function(req, buffers) {
+    if (exists(req$stream, envir = .rtopy$streams, inherits = FALSE)) {
+        rm(list = req$stream, envir = .rtopy$streams)
+    }
+    NULL
+}
+
+.rtopy_error_message <- function(req, message) {
+    if (is.null(req$func)) return(paste("R error:", message))
+    paste0("R error in ", req$func, ": ", message)
+}
+
+
+# Attach packages and run setup code once, timing each step.
+.rtopy_init <- function(req, buffers) {
+    packages <- list()
+    for (pkg in unlist(req$preload)) {
+        start <- .rtopy_elapsed()
+        suppressPackageStartupMessages(library(pkg, character.only = TRUE))
+        packages[[pkg]] <- .rtopy_elapsed() - start
+    }
+    setup <- 0
+    if (!is.null(req$setup)) {
+        start <- .rtopy_elapsed()
+        suppressPackageStartupMessages(
+            eval(parse(text = req$setup, keep.source = FALSE),
+                 envir = globalenv())
+        )
+        setup <- .rtopy_elapsed() - start
+    }
+    list(packages = packages, setup = setup)
+}
+
+# Call the function once per item; failures are reported per item.
+.rtopy_map <- function(req, buffers) {
+    env <- .rtopy_env(req)
+    fn <- get(req$func, envir = env, mode = "function")
+    run <- function(item) tryCatch(
+        {
+            value <- do.call(fn, .rtopy_args(item, buffers))
+            list(ok = TRUE, value = value, schema = .rtopy_schema(value))
+        },
+        error = function(e) {
+            list(ok = FALSE,
+                 message = .rtopy_error_message(req, conditionMessage(e)))
+        }
+    )
+    workers <- if (is.null(req$workers)) 1L else as.integer(req$workers)
+    if (workers <= 1L || .Platform$OS.type != "unix") {
+        return(lapply(req$items, run))
+    }
+    results <- parallel::mclapply(req$items, run, mc.cores = workers)
+    lapply(results, function(r) {
+        # A forked worker that died leaves a try-error behind
+        if (inherits(r, "try-error") || is.null(r)) {
+            list(ok = FALSE, message = .rtopy_error_message(
+                req, paste("forked R worker failed:", as.character(r))
+            ))
+        } else {
+            r
+        }
+    })
+}
+
+.rtopy_state <- function(req) {
+    state <- new.env()
+    state$buffers <- list()
+    state$shared <- list()
+    state$frames <- isTRUE(req$frames)
+    state$sparse <- isTRUE(req$sparse)
+    state$shm <- req$shm
+    state
+}
+
+# Compact description of a value's R type, sent next to it so Python can
+# pick the matching dtype, shape and container without scanning values.
+.rtopy_schema <- function(x, columns = TRUE) {
+    schema <- list(class = I(class(x)), typeof = typeof(x), length = length(x))
+    if (!is.null(dim(x))) schema$dim <- I(dim(x))
+    if (!is.null(dimnames(x)) && !is.data.frame(x)) {
+        schema$dimnames <- lapply(dimnames(x),
+                                  function(v) if (!is.null(v)) I(v))
+    }
+    if (is.factor(x)) schema$levels <- I(levels(x))
+    if (!is.null(names(x))) schema$names <- I(names(x))
+    if (is.data.frame(x) && columns) {
+        schema$columns <- unname(lapply(x, .rtopy_schema, columns = FALSE))
+    }
+    schema
+}
+
+.rtopy_result <- function(value, req) {
+    schema <- .rtopy_schema(value)
+    if (!isTRUE(req$binary)) {
+        return(list(header = list(status = "ok", schema = schema),
+                    buffers = list(.rtopy_to_json(value))))
+    }
+    state <- .rtopy_state(req)
+    done <- FALSE
+    on.exit(if (!done) {
+        unlink(vapply(state$shared, function(s) s$path, character(1)))
+    })
+    value <- .rtopy_encode(value, state)
+    res <- list(
+        header = list(status = "ok", shared = state$shared, schema = schema),
+        buffers = c(list(.rtopy_to_json(value)), state$buffers)
+    )
+    done <- TRUE
+    res
+}
+
+.rtopy_handle <- function(msg) {
+    req <- msg$header
+    op <- switch(req$op, init = .rtopy_init, call = .rtopy_call,
+                 map = .rtopy_map, stream = .rtopy_stream,
+                 `next` = .rtopy_next, fold = .rtopy_fold,
+                 collect = .rtopy_collect,
+                 cancel = .rtopy_cancel, objects = .rtopy_objects,
+                 release = function(req, buffers) NULL,
+                 load = function(req, buffers) readRDS(req$rds),
+                 function(req, buffers) stop("unknown request ", req$op))
+    # Handles dropped on the Python side since the previous request
+    .rtopy_release(req$release)
+    # Seconds spent in each phase of this request, sent back with the
+    # response; "r_call" is the op minus parsing and argument decoding.
+    .rtopy$timing <- list()
+    .rtopy$profile <- NULL
+    res <- tryCatch(
+        {
+            start <- .rtopy_elapsed()
+            value <- op(req, msg$buffers)
+            if (!is.null(req$save)) .rtopy_save(value, req$save)
+            if (!is.null(req$resident))
+                value <- .rtopy_keep(req$resident, value)
+            .rtopy$timing$r_call <- max(0, .rtopy_elapsed() - start -
+                sum(unlist(.rtopy$timing)))
+            .rtopy_timed("r_encode", .rtopy_result(value, req))
+        },
+        error = function(e) list(
+            header = list(
+                status = "error",
+                message = .rtopy_error_message(req, conditionMessage(e))
+            ),
+            buffers = list()
+        )
+    )
+    if (length(.rtopy$timing)) res$header$timing <- .rtopy$timing
+    if (!is.null(.rtopy$profile)) res$header$profile <- .rtopy$profile
+    res
+}
+
+repeat {
+    msg <- .rtopy_recv()
+    if (is.null(msg) || identical(msg$header$op, "quit")) break
+    res <- .rtopy_handle(msg)
+    .rtopy_send(res$header, res$buffers)
+}
+close(.rtopy$con)
+"""
+
+
+class SharedBuffer:
+    """A buffer handed to R as a file path rather than sent on the socket."""
+
+    def __init__(
+        self, path: str, nbytes: int, offset: int = 0, owned: bool = False
+    ):
+        self.path = path
+        self.nbytes = nbytes
+        self.offset = offset
+        # Owned files were written by rtopy and are removed after the call;
+        # others belong to the caller (e.g. an np.memmap) and are left alone.
+        self.owned = owned
+
+
+def shared_memory_dir() -> str:
+    """Directory for shared buffers: /dev/shm when available, else tmp."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def _map_file(path: str, nbytes: int):
+    """Map a file written by R and remove it; the mapping stays valid."""
+    if nbytes == 0:
+        os.unlink(path)
+        return bytearray()
+    with open(path, "rb") as f:
+        # Copy-on-write, so arrays built on it are writable without
+        # touching the file
+        mapped = mmap.mmap(f.fileno(), nbytes, access=mmap.ACCESS_COPY)
+    try:
+        os.unlink(path)
+    except OSError:
+        # Windows cannot remove a mapped file: fall back to a copy
+        data = bytearray(mapped)
+        mapped.close()
+        os.unlink(path)
+        return data
+    return mapped
+
+
+# Named warm-start profiles: packages to attach and setup code to run when
+# a worker starts.
+_PROFILES: Dict[str, Dict] = {}
+
+
+def register_profile(
+    name: str, preload: Sequence[str] = (), setup: Optional[str] = None
+):
+    """
+    Register a named warm-start profile for R workers.
+
+    Parameters
+    ----------
+    name : str
+        Profile name, passed as `RBridge(profile=name)`
+    preload : sequence of str
+        R packages to attach when a worker starts
+    setup : str or None
+        R code run once in the global environment after the packages load
+
+    Examples
+    --------
+    >>> register_profile("ts", preload=["forecast"], setup="set.seed(1)")
+    >>> rb = RBridge(persistent=True, profile="ts")
+    """
+    _PROFILES[name] = {"preload": list(preload), "setup": setup}
+
+
+def get_profile(name: str) -> Dict:
+    """Return a registered profile, raising ValueError for unknown names."""
+    try:
+        return _PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown R worker profile '{name}'") from None
+
+
+def _as_list(value: Any) -> List:
+    """Accept a scalar where a list is expected, as R unboxes length-1."""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _share_buffers(
+    buffers: Sequence, threshold: Optional[int], shm_dir: str, prefix: str
+) -> List:
+    """Move buffers past `threshold` bytes into shared-memory files."""
+    if threshold is None:
+        return list(buffers)
+    out = []
+    for b in buffers:
+        if not isinstance(b, SharedBuffer):
+            nbytes = memoryview(b).nbytes
+            if nbytes >= threshold:
+                fd, path = tempfile.mkstemp(
+                    prefix=prefix, suffix=".bin", dir=shm_dir
+                )
+                with os.fdopen(fd, "wb") as f:
+                    f.write(b)
+                b = SharedBuffer(path, nbytes, owned=True)
+        out.append(b)
+    return out
+
+
+def _unlink_owned(buffers: Sequence):
+    """Remove the shared files made for one request's buffers."""
+    for b in buffers:
+        if isinstance(b, SharedBuffer) and b.owned:
+            try:
+                os.unlink(b.path)
+            except OSError:
+                pass
+
+
+def _frame(
+    header: Dict, buffers: Sequence, shm: Optional[Dict]
+) -> Tuple[List, int]:
+    """
+    The pieces of one request frame, and the bytes it carries with the
+    shared files it points to.
+    """
+    sizes, shared = [], []
+    for i, b in enumerate(buffers):
+        if isinstance(b, SharedBuffer):
+            sizes.append(0)
+            shared.append(
+                {
+                    "index": i,
+                    "path": b.path,
+                    "size": b.nbytes,
+                    "offset": b.offset,
+                }
+            )
+        else:
+            sizes.append(memoryview(b).nbytes)
+
+    header = dict(header, buffers=sizes, shared=shared)
+    if shm is not None:
+        header["shm"] = shm
+    data = json.dumps(header).encode("utf-8")
+    chunks = [_HEADER.pack(len(data)) + data]
+    chunks.extend(b for b in buffers if not isinstance(b, SharedBuffer))
+    nbytes = (
+        _HEADER.size + len(data) + sum(sizes) + sum(s["size"] for s in shared)
+    )
+    return chunks, nbytes
+
+
+def _attach_shared(header: Dict, buffers: List) -> int:
+    """
+    Map the response buffers R wrote to shared files into `buffers`;
+    returns the size of all buffers.
+    """
+    nbytes = sum(len(b) for b in buffers)
+    for s in _as_list(header.get("shared")):
+        # R numbers the value's buffers, which follow the JSON in the
+        # response, as array specs do
+        buffers[int(s["index"]) + 1] = _map_file(s["path"], int(s["size"]))
+        nbytes += int(s["size"])
+    return nbytes
+
+
+def _startup_timings(payload: List) -> Dict[str, Any]:
+    """Package and setup times reported by an "init" request."""
+    timings = json.loads(payload[0].decode("utf-8"))
+    return {
+        "packages": {
+            name: float(t)
+            for name, t in (timings.get("packages") or {}).items()
+        },
+        "setup": float(timings.get("setup") or 0.0),
+    }
+
+
+def _remove_shared(shm_pattern: Optional[str]):
+    """Remove files a worker left in shared memory."""
+    if shm_pattern is not None:
+        for path in glob.glob(shm_pattern):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def _authenticate(conn: socket.socket, token: bytes) -> bool:
+    """Whether a new connection starts with the driver's token."""
+    conn.settimeout(_AUTH_TIMEOUT)
+    received = b""
+    try:
+        while len(received) < len(token):
+            chunk = conn.recv(len(token) - len(received))
+            if not chunk:
+                return False
+            received += chunk
+    except OSError:
+        return False
+    conn.settimeout(None)
+    return hmac.compare_digest(received, token)
+
+
+def _rscript_missing(rscript: str) -> RNotFoundError:
+    """Error for a discovered Rscript that could not be started."""
+    # Probe again, which raises discovery's error if R left PATH
+    find_r(refresh=True)
+    return RNotFoundError(f"Rscript could not be started: {rscript}")
+
+
+def _drain(stream, tail: collections.deque, verbose: bool):
+    """Keep R's stderr flowing so the worker never blocks on it."""
+    for line in iter(stream.readline, b""):
+        text = line.decode("utf-8", errors="replace").rstrip()
+        tail.append(text)
+        if verbose:
+            print(f"[R messages] {text}")
+
+
+def _shutdown(
+    proc: subprocess.Popen,
+    sock: Optional[socket.socket],
+    shm_pattern: Optional[str] = None,
+):
+    """Stop a worker process, release its socket and shared files."""
+    if sock is not None:
+        try:
+            sock.close()
+        except OSError:
+            pass
+    if proc.poll() is None:
+        proc.kill()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+    _remove_shared(shm_pattern)
+
+
+class RWorker:
+    """Long-lived R interpreter driven over a framed socket protocol."""
+
+    def __init__(
+        self,
+        timeout: int = 300,
+        verbose: bool = False,
+        shm_threshold: Optional[int] = None,
+        preload: Sequence[str] = (),
+        setup: Optional[str] = None,
+    ):
+        """
+        Start an R worker process.
+
+        Parameters
+        ----------
+        timeout : int
+            Maximum time in seconds for startup and for each request
+            (default: 300)
+        verbose : bool
+            Print R warnings and messages (default: False)
+        shm_threshold : int or None
+            Buffers of at least this many bytes go through files in shared
+            memory in both directions (default: None, never)
+        preload : sequence of str
+            R packages to attach once the worker is up (default: none)
+        setup : str or None
+            R code run once in the global environment after preloading
+            (default: None)
+        """
+        self.timeout = timeout
+        self.verbose = verbose
+        self.shm_threshold = shm_threshold
+        self.shm_dir = shared_memory_dir()
+        # Every file this worker's calls create starts with this prefix, so
+        # leftovers can be found if R is killed halfway through a call.
+        self._shm_prefix = f"rtopy-{os.getpid()}-{uuid.uuid4().hex[:8]}-"
+        self._lock = threading.Lock()
+        # Keys of the r_code already evaluated in this process
+        self.registered = set()
+        # Ids of resident objects whose handles were garbage collected; they
+        # are released along with the next request.
+        self._released = collections.deque()
+        self._stderr = collections.deque(maxlen=50)
+        self._sock = None
+        self._proc = None
+        # Seconds spent starting R, attaching each package and running setup
+        self.startup_stats: Dict[str, Any] = {}
+        started = time.perf_counter()
+        self._start()
+        self._finalizer = weakref.finalize(
+            self, _shutdown, self._proc, self._sock, self._shm_pattern()
+        )
+        self.startup_stats["startup"] = time.perf_counter() - started
+        if preload or setup:
+            try:
+                self._init(list(preload), setup)
+            except Exception:
+                self.kill()
+                raise
+
+    def _init(self, preload: List[str], setup: Optional[str]):
+        header = {"op": "init", "preload": preload}
+        if setup is not None:
+            header["setup"] = setup
+        _, payload = self.request(header)
+        self.startup_stats.update(_startup_timings(payload))
+
+    def _start(self):
+        """Spawn Rscript and wait for the driver to connect back."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            server.bind(("127.0.0.1", 0))
+            server.listen(8)
+            server.settimeout(0.1)
+            port = server.getsockname()[1]
+
+            rscript = find_r().rscript
+            try:
+                self._proc = subprocess.Popen(
+                    [rscript, "--vanilla", "-e", _BOOTSTRAP],
+                    stdin=subprocess.PIPE,
+                    stdout=None if self.verbose else subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                )
+            except FileNotFoundError:
+                raise _rscript_missing(rscript)
+
+            # The drain thread must not reference self, or the worker could
+            # never be garbage collected while R is running.
+            threading.Thread(
+                target=_drain,
+                args=(self._proc.stderr, self._stderr, self.verbose),
+                daemon=True,
+            ).start()
+            token = secrets.token_hex(_TOKEN_BYTES)
+            driver = _DRIVER.replace("@PORT@", str(port))
+            self._proc.stdin.write(
+                driver.replace("@TOKEN@", token).encode("utf-8")
+            )
+            self._proc.stdin.close()
+
+            deadline = time.monotonic() + self.timeout
+            while self._sock is None:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    if self._proc.poll() is not None:
+                        raise RExecutionError(
+                            "R worker failed to start:\n"
+                            f"{self._stderr_tail()}"
+                        )
+                    if time.monotonic() >= deadline:
+                        _shutdown(self._proc, None)
+                        raise RExecutionError(
+                            f"R worker did not start within {self.timeout}s"
+                        )
+                    continue
+                if _authenticate(conn, token.encode("ascii")):
+                    self._sock = conn
+                else:
+                    conn.close()
+        finally:
+            server.close()
+
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _stderr_tail(self) -> str:
+        return "\n".join(self._stderr) or "(no output)"
+
+    @property
+    def alive(self) -> bool:
+        """Whether the R process is still running."""
+        return self._proc is not None and self._proc.poll() is None
+
+    def request(
+        self, header: Dict, buffers: Sequence = (), timer=None
+    ) -> Tuple[Dict, List[bytearray]]:
+        """
+        Send one request frame and wait for the response frame.
+
+        Pass a `rtopy.stats.CallTimer` as `timer` to record the "send"
+        phase, the phases R reports, the "transfer" time R does not account
+        for, and the bytes sent and received.
+
+        Raises
+        ------
+        RExecutionError
+            If R reports an error, times out or exits
+        """
+        with self._lock:
+            if not self.alive:
+                raise RExecutionError(
+                    f"R worker is not running:\n{self._stderr_tail()}"
+                )
+            buffers = self._share(buffers)
+            released = []
+            while self._released:
+                released.append(self._released.popleft())
+            if released:
+                header = dict(
+                    header, release=list(header.get("release", ())) + released
+                )
+            try:
+                self._sock.settimeout(self.timeout)
+                if timer is None:
+                    self._send(header, buffers)
+                    response, payload, _ = self._recv()
+                else:
+                    start = timer.now()
+                    timer.bytes_out += self._send(header, buffers)
+                    sent = timer.now()
+                    timer.add("send", start, sent - start)
+                    response, payload, received = self._recv()
+                    timer.bytes_in += received
+                    timing = response.get("timing")
+                    timer.add_remote(
+                        sent,
+                        timer.now() - sent,
+                        timing if isinstance(timing, dict) else {},
+                        "transfer",
+                    )
+            except socket.timeout:
+                self.kill()
+                raise RExecutionError(
+                    f"R execution timed out after {self.timeout}s"
+                )
+            except (OSError, EOFError):
+                self.kill()
+                raise RExecutionError(
+                    f"R worker exited unexpectedly:\n{self._stderr_tail()}"
+                )
+            finally:
+                _unlink_owned(buffers)
+
+        if response.get("status") == "error":
+            raise RExecutionError(response.get("message", "R error"))
+        return response, payload
+
+    def describe_objects(self, ids: Optional[List[str]] = None) -> List[Dict]:
+        """Id, class and `object.size()` of resident objects (default all)."""
+        header: Dict[str, Any] = {"op": "objects"}
+        if ids is not None:
+            header["ids"] = list(ids)
+        _, payload = self.request(header)
+        return _as_list(json.loads(payload[0].decode("utf-8")))
+
+    def discard(self, object_id: str):
+        """
+        Release a resident object with the next request.
+
+        Safe to call from garbage collection: it neither blocks nor talks
+        to R.
+        """
+        self._released.append(object_id)
+
+    def _shm_pattern(self) -> str:
+        return os.path.join(self.shm_dir, self._shm_prefix + "*")
+
+    def _share(self, buffers: Sequence) -> List:
+        """Move buffers past the threshold into shared-memory files."""
+        return _share_buffers(
+            buffers, self.shm_threshold, self.shm_dir, self._shm_prefix
+        )
+
+    def _send(self, header: Dict, buffers: Sequence) -> int:
+        """Write one frame; returns the bytes it carries, files included."""
+        chunks, nbytes = _frame(header, buffers, self._shm_settings())
+        for chunk in chunks:
+            self._sock.sendall(chunk)
+        return nbytes
+
+    def _shm_settings(self) -> Optional[Dict]:
+        if self.shm_threshold is None:
+            return None
+        return {
+            "dir": self.shm_dir,
+            "threshold": self.shm_threshold,
+            "prefix": self._shm_prefix,
+        }
+
+    def _recv(self) -> Tuple[Dict, List, int]:
+        """Read one frame; returns its header, buffers and size in bytes."""
+        (n,) = _HEADER.unpack(self._recv_exact(_HEADER.size))
+        header = json.loads(self._recv_exact(n).decode("utf-8"))
+        buffers = [
+            self._recv_exact(int(k)) for k in _as_list(header.get("buffers"))
+        ]
+        nbytes = _HEADER.size + n + _attach_shared(header, buffers)
+        return header, buffers, nbytes
+
+    def _recv_exact(self, n: int) -> bytearray:
+        buf = bytearray(n)
+        view = memoryview(buf)
+        pos = 0
+        while pos < n:
+            k = self._sock.recv_into(view[pos:])
+            if k == 0:
+                raise EOFError("R worker closed the connection")
+            pos += k
+        return buf
+
+    def close(self):
+        """Ask the worker to quit, killing it if it does not comply."""
+        if self._proc is None:
+            return
+        if self._proc.poll() is None and self._sock is not None:
+            try:
+                self._sock.settimeout(1)
+                self._send({"op": "quit"}, ())
+                self._proc.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        _shutdown(self._proc, self._sock, self._shm_pattern())
+
+    def kill(self):
+        """Terminate the worker immediately, abandoning any running call."""
+        if self._proc is not None:
+            _shutdown(self._proc, self._sock, self._shm_pattern())
+
+
+class AsyncRWorker:
+    """
+    R interpreter for a single asyncio task, driven without threads.
+
+    Speaks the same protocol as `RWorker`, but starts Rscript with
+    `asyncio.create_subprocess_exec` and talks to it over asyncio streams,
+    so any number of them can run concurrently on one event loop. Used
+    for one-shot `RBridge.acall` calls; create one with `start()`.
+    """
+
+    def __init__(
+        self,
+        timeout: int = 300,
+        verbose: bool = False,
+        shm_threshold: Optional[int] = None,
+    ):
+        self.timeout = timeout
+        self.verbose = verbose
+        self.shm_threshold = shm_threshold
+        self.shm_dir = shared_memory_dir()
+        self._shm_prefix = f"rtopy-{os.getpid()}-{uuid.uuid4().hex[:8]}-"
+        self.registered = set()
+        self._stderr = collections.deque(maxlen=50)
+        self._proc = None
+        self._reader = None
+        self._writer = None
+        self._drain_task = None
+        self.startup_stats: Dict[str, Any] = {}
+
+    @classmethod
+    async def start(
+        cls,
+        timeout: int = 300,
+        verbose: bool = False,
+        shm_threshold: Optional[int] = None,
+        preload: Sequence[str] = (),
+        setup: Optional[str] = None,
+    ) -> "AsyncRWorker":
+        """Start an R worker; parameters are as for `RWorker`."""
+        worker = cls(timeout, verbose, shm_threshold)
+        started = time.perf_counter()
+        try:
+            await worker._start()
+            worker.startup_stats["startup"] = time.perf_counter() - started
+            if preload or setup:
+                header = {"op": "init", "preload": list(preload)}
+                if setup is not None:
+                    header["setup"] = setup
+                _, payload = await worker.request(header)
+                worker.startup_stats.update(_startup_timings(payload))
+        except BaseException:
+            worker.kill()
+            raise
+        return worker
+
+    async def _start(self):
+        """Spawn Rscript and wait for the driver to connect back."""
+        loop = asyncio.get_running_loop()
+        token = secrets.token_hex(_TOKEN_BYTES).encode("ascii")
+        connected = loop.create_future()
+
+        async def accept(reader, writer):
+            try:
+                received = await asyncio.wait_for(
+                    reader.readexactly(len(token)), _AUTH_TIMEOUT
+                )
+            except (
+                asyncio.IncompleteReadError, asyncio.TimeoutError, OSError
+            ):
+                received = b""
+            if connected.done() or not hmac.compare_digest(received, token):
+                writer.close()
+                return
+            connected.set_result((reader, writer))
+
+        server = await asyncio.start_server(
+            accept, "127.0.0.1", 0, limit=_STREAM_LIMIT
+        )
+        exited = None
+        try:
+            port = server.sockets[0].getsockname()[1]
+            rscript = find_r().rscript
+            try:
+                self._proc = await asyncio.create_subprocess_exec(
+                    rscript,
+                    "--vanilla",
+                    "-e",
+                    _BOOTSTRAP,
+                    stdin=subprocess.PIPE,
+                    stdout=None if self.verbose else subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                )
+            except FileNotFoundError:
+                raise _rscript_missing(rscript)
+            self._drain_task = loop.create_task(
+                _adrain(self._proc.stderr, self._stderr, self.verbose)
+            )
+            driver = _DRIVER.replace("@PORT@", str(port))
+            self._proc.stdin.write(
+                driver.replace("@TOKEN@", token.decode()).encode("utf-8")
+            )
+            await self._proc.stdin.drain()
+            self._proc.stdin.close()
+
+            exited = loop.create_task(self._proc.wait())
+            await asyncio.wait(
+                {connected, exited},
+                timeout=self.timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if connected.done():
+                self._reader, self._writer = connected.result()
+            elif exited.done():
+                # Let the last of stderr arrive before reporting it
+                await asyncio.wait({self._drain_task}, timeout=1)
+                raise RExecutionError(
+                    f"R worker failed to start:\n{self._stderr_tail()}"
+                )
+            else:
+                raise RExecutionError(
+                    f"R worker did not start within {self.timeout}s"
+                )
+        finally:
+            server.close()
+            if exited is not None:
+                exited.cancel()
+            if not connected.done():
+                connected.cancel()
+
+    def _stderr_tail(self) -> str:
+        return "\n".join(self._stderr) or "(no output)"
+
+    @property
+    def alive(self) -> bool:
+        """Whether the R process is still running."""
+        return self._proc is not None and self._proc.returncode is None
+
+    async def request(
+        self, header: Dict, buffers: Sequence = (), timer=None
+    ) -> Tuple[Dict, List[bytearray]]:
+        """
+        Send one request frame and wait for the response frame; see
+        `RWorker.request`.
+        """
+        if not self.alive or self._writer is None:
+            raise RExecutionError(
+                f"R worker is not running:\n{self._stderr_tail()}"
+            )
+        buffers = _share_buffers(
+            buffers, self.shm_threshold, self.shm_dir, self._shm_prefix
+        )
+        shm = None
+        if self.shm_threshold is not None:
+            shm = {
+                "dir": self.shm_dir,
+                "threshold": self.shm_threshold,
+                "prefix": self._shm_prefix,
+            }
+        try:
+            response, payload = await asyncio.wait_for(
+                self._exchange(header, buffers, shm, timer), self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.kill()
+            raise RExecutionError(
+                f"R execution timed out after {self.timeout}s"
+            )
+        except (OSError, asyncio.IncompleteReadError):
+            self.kill()
+            raise RExecutionError(
+                f"R worker exited unexpectedly:\n{self._stderr_tail()}"
+            )
+        finally:
+            _unlink_owned(buffers)
+
+        if response.get("status") == "error":
+            raise RExecutionError(response.get("message", "R error"))
+        return response, payload
+
+    async def _exchange(self, header, buffers, shm, timer):
+        start = timer.now() if timer is not None else None
+        chunks, nbytes = _frame(header, buffers, shm)
+        for chunk in chunks:
+            self._writer.write(chunk)
+        await self._writer.drain()
+        if timer is not None:
+            sent = timer.now()
+            timer.add("send", start, sent - start)
+            timer.bytes_out += nbytes
+
+        (n,) = _HEADER.unpack(await self._reader.readexactly(_HEADER.size))
+        response = json.loads((await self._reader.readexactly(n)).decode())
+        payload = [
+            bytearray(await self._reader.readexactly(int(k)))
+            for k in _as_list(response.get("buffers"))
+        ]
+        received = _HEADER.size + n + _attach_shared(response, payload)
+        if timer is not None:
+            timer.bytes_in += received
+            timing = response.get("timing")
+            timer.add_remote(
+                sent,
+                timer.now() - sent,
+                timing if isinstance(timing, dict) else {},
+                "transfer",
+            )
+        return response, payload
+
+    async def close(self):
+        """Ask the worker to quit, killing it if it does not comply."""
+        if self._proc is None:
+            return
+        if self.alive and self._writer is not None:
+            try:
+                chunks, _ = _frame({"op": "quit"}, (), None)
+                self._writer.write(chunks[0])
+                await asyncio.wait_for(self._proc.wait(), 2)
+            except (OSError, asyncio.TimeoutError):
+                pass
+        self.kill()
+        await self._proc.wait()
+
+    def kill(self):
+        """Terminate the worker immediately, abandoning any running call."""
+        if self._writer is not None:
+            self._writer.close()
+        if self.alive:
+            try:
+                self._proc.kill()
+            except ProcessLookupError:
+                pass
+        _remove_shared(os.path.join(self.shm_dir, self._shm_prefix + "*"))
+
+
+async def _adrain(stream, tail: collections.deque, verbose: bool):
+    """Asyncio counterpart of `_drain`."""
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            # A line longer than the stream limit; it has been dropped
+            continue
+        if not line:
+            return
+        text = line.decode("utf-8", errors="replace").rstrip()
+        tail.append(text)
+        if verbose:
+            print(f"[R messages] {text}")
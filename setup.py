@@ -38,8 +38,10 @@ setup(
        "numpy>=1.19.0", "pandas>=1.1.0", "scikit-learn>=1.0.0", "scipy>=1.0.0"
     ],
     extras_require={
-        "full": ["numpy>=1.19.0", "pandas>=1.1.0"],
+        "full": ["numpy>=1.19.0", "pandas>=1.1.0", "scipy>=1.0.0"],
+        "cli": ["click>=7.0"],
         "dev": [
+            "click>=7.0",
             "pytest>=6.0",
             "pytest-cov>=2.10",
             "black>=21.0",
@@ -48,6 +50,7 @@ setup(
             "numpy>=1.19.0",
         ],
     },
+    entry_points={"console_scripts": ["rtopy=rtopy.__main__:main"]},
     keywords="r python bridge statistics data-science",
     project_urls={
         "Bug Reports": "https://github.com/thierrymoudiki/rtopy/issues",
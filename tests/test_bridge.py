@@ -0,0 +1,700 @@
+#!/usr/bin/env python
+
+"""Tests for `rtopy.bridge` and the R worker."""
+
+
+import asyncio
+import json
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import types
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from rtopy import RBridge, RBridgePool, RExecutionError, RObjectHandle, codec
+from rtopy import discovery
+from rtopy.exceptions import RNotFoundError
+from rtopy.worker import (
+    AsyncRWorker,
+    RWorker,
+    SharedBuffer,
+    _attach_shared,
+    _authenticate,
+    get_profile,
+    register_profile,
+)
+
+HAS_R = shutil.which("Rscript") is not None
+
+
+class TestCodec(unittest.TestCase):
+    """Tests for the binary array transport."""
+
+    def roundtrip(self, arr):
+        buffers = []
+        spec = codec.encode_array(arr, buffers)
+        return spec, codec.decode_array(spec, [bytes(b) for b in buffers])
+
+    def test_matrix_is_column_major(self):
+        arr = np.arange(6.0).reshape(2, 3)
+        spec, out = self.roundtrip(arr)
+        self.assertEqual(spec["dtype"], "f8")
+        self.assertEqual(spec["shape"], [2, 3])
+        np.testing.assert_array_equal(out, arr)
+
+    def test_integer_and_logical(self):
+        spec, out = self.roundtrip(np.array([1, 2, 3]))
+        self.assertEqual(spec["dtype"], "i4")
+        np.testing.assert_array_equal(out, [1, 2, 3])
+        spec, out = self.roundtrip(np.array([True, False]))
+        self.assertEqual((spec["dtype"], out.dtype), ("lgl", np.bool_))
+
+    def test_large_integers_become_double(self):
+        spec, out = self.roundtrip(np.array([2**40, 1]))
+        self.assertEqual(spec["dtype"], "f8")
+        np.testing.assert_array_equal(out, [2**40, 1])
+
+    def test_integer_na(self):
+        buf = np.array([1, codec.R_NA_INTEGER, 3], dtype="<i4").tobytes()
+        spec = {codec.MARKER: "array", "dtype": "i4", "shape": 3, "buffer": 0}
+        out = codec.decode({"x": spec, "n": 2}, [buf])
+        self.assertTrue(np.isnan(out["x"][1]))
+        self.assertEqual(
+            codec.to_builtin(out), {"x": [1.0, None, 3.0], "n": 2}
+        )
+
+    def test_unsupported_dtype(self):
+        self.assertIsNone(codec.encode_array(np.array(["a", "b"]), []))
+
+    def test_frame_keeps_dtypes(self):
+        df = pd.DataFrame(
+            {
+                "x": [1.5, np.nan, 3.0],
+                "i": pd.array([1, None, 3], dtype="Int64"),
+                "g": pd.Categorical(["a", None, "b"]),
+                "s": ["h\u00e9llo", None, "z"],
+                "b": [True, False, True],
+            },
+            index=["r1", "r2", "r3"],
+        )
+        buffers = []
+        spec = codec.encode_frame(df, buffers)
+        out = codec.decode_frame(spec, [bytearray(b) for b in buffers])
+        self.assertEqual(list(out.index), ["r1", "r2", "r3"])
+        self.assertEqual(str(out["i"].dtype), "Int32")
+        self.assertTrue(out["i"].isna().iloc[1])
+        self.assertEqual(list(out["g"].cat.categories), ["a", "b"])
+        self.assertEqual(out["s"].iloc[0], "h\u00e9llo")
+        self.assertTrue(out["s"].isna().iloc[1])
+        self.assertEqual(out["b"].dtype, np.bool_)
+        self.assertEqual(codec.to_builtin(out)["x"], [1.5, None, 3.0])
+
+    def test_frame_without_columns(self):
+        # What R sends for data.frame() and df[, 0]: a spec, no buffers
+        for nrow in (0, 3):
+            spec = {codec.MARKER: "frame", "nrow": nrow, "names": [],
+                    "columns": [], "index": None}
+            out = codec.decode({"df": spec}, [])["df"]
+            self.assertIsInstance(out, pd.DataFrame)
+            self.assertEqual(out.shape, (nrow, 0))
+            rb = RBridge.__new__(RBridge)
+            out = rb._decode_payload([json.dumps(spec).encode("utf-8")])
+            self.assertEqual(out.shape, (nrow, 0))
+
+    def test_sparse_roundtrip(self):
+        mat = sp.random(1000, 200, density=0.01, format="csr", random_state=0)
+        buffers = []
+        spec = codec.encode_sparse(mat, buffers)
+        self.assertEqual((spec["dtype"], spec["shape"]), ("f8", [1000, 200]))
+        # Index, pointer and value buffers only: nothing of rows x cols size
+        self.assertEqual(
+            [len(b) for b in buffers], [4 * mat.nnz, 4 * 201, 8 * mat.nnz]
+        )
+        out = codec.decode({"m": spec}, [bytes(b) for b in buffers])["m"]
+        self.assertEqual(out.format, "csc")
+        self.assertEqual((out != mat).nnz, 0)
+        self.assertEqual(codec.to_builtin(out), mat.toarray().tolist())
+
+    def test_sparse_logical(self):
+        mat = sp.csc_matrix(np.array([[True, False], [False, True]]))
+        buffers = []
+        spec = codec.encode_sparse(mat, buffers)
+        self.assertEqual(spec["dtype"], "lgl")
+        out = codec.decode_sparse(spec, [bytes(b) for b in buffers])
+        self.assertEqual(out.dtype, np.bool_)
+        np.testing.assert_array_equal(out.toarray(), mat.toarray())
+        with self.assertRaises(ValueError):
+            codec.encode_sparse(sp.csc_matrix(np.array([[1j]])), [])
+
+    def test_memmap_is_not_copied(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "x.bin")
+            arr = np.memmap(
+                path, dtype="<f8", mode="w+", shape=(4, 2), order="F"
+            )
+            arr[:] = np.arange(8.0).reshape(4, 2)
+            buffers = []
+            spec = codec.encode_array(arr, buffers)
+            self.assertIsInstance(buffers[0], SharedBuffer)
+            self.assertEqual(buffers[0].nbytes, 64)
+            # Views fall back to in-band buffers
+            codec.encode_array(arr[1:], buffers)
+            self.assertNotIsInstance(buffers[1], SharedBuffer)
+            with open(buffers[0].path, "rb") as f:
+                out = codec.decode_array(spec, [f.read()])
+            np.testing.assert_array_equal(out, arr)
+            del arr
+
+    def test_shared_response(self):
+        # A response as R sends it: the JSON, then an empty slot for the
+        # array R wrote to a shared file
+        values = np.arange(6.0)
+        spec = {codec.MARKER: "array", "dtype": "f8", "shape": [6],
+                "buffer": 0}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "r.bin")
+            values.astype("<f8").tofile(path)
+            header = {"shared": [{"index": 0, "path": path, "size": 48}]}
+            payload = [json.dumps(spec).encode("utf-8"), b""]
+            nbytes = _attach_shared(header, payload)
+            rb = RBridge.__new__(RBridge)
+            out = rb._decode_payload(payload)
+            self.assertEqual(nbytes, len(payload[0]) + 48)
+            np.testing.assert_array_equal(out, values)
+            del out, payload
+
+
+class TestWorkerAuthentication(unittest.TestCase):
+    """Tests for the token R presents when it connects back."""
+
+    def check(self, sent):
+        ours, theirs = socket.socketpair()
+        with ours, theirs:
+            theirs.sendall(sent)
+            theirs.shutdown(socket.SHUT_WR)
+            return _authenticate(ours, b"0123456789abcdef")
+
+    def test_token(self):
+        self.assertTrue(self.check(b"0123456789abcdef"))
+        self.assertFalse(self.check(b"0123456789abcdeX"))
+        # A peer that disconnects early is rejected, not waited on
+        self.assertFalse(self.check(b"0123"))
+
+
+class TestAsyncWorker(unittest.TestCase):
+    """Tests for the frames `AsyncRWorker` exchanges over asyncio streams."""
+
+    def test_request(self):
+        async def exchange():
+            ours, theirs = socket.socketpair()
+            worker = AsyncRWorker()
+            # Stands in for the R process: only its exit status is read
+            worker._proc = types.SimpleNamespace(returncode=None)
+            worker._reader, worker._writer = await asyncio.open_connection(
+                sock=ours
+            )
+            reader, writer = await asyncio.open_connection(sock=theirs)
+
+            async def respond():
+                (n,) = struct.unpack("<I", await reader.readexactly(4))
+                request = json.loads(await reader.readexactly(n))
+                data = await reader.readexactly(request["buffers"][0])
+                header = json.dumps(
+                    {"status": "ok", "buffers": [len(data)], "echo": request}
+                ).encode()
+                writer.write(struct.pack("<I", len(header)) + header + data)
+                await writer.drain()
+
+            responder = asyncio.ensure_future(respond())
+            response, payload = await worker.request(
+                {"op": "call"}, [memoryview(b"\x01\x02\x03")]
+            )
+            await responder
+            writer.close()
+            worker._writer.close()
+            return response, payload
+
+        response, payload = asyncio.run(exchange())
+        self.assertEqual(response["echo"]["op"], "call")
+        self.assertEqual(response["echo"]["shared"], [])
+        self.assertEqual(bytes(payload[0]), b"\x01\x02\x03")
+
+    def test_missing_r(self):
+        path = os.environ.get("PATH", "")
+        os.environ["PATH"] = ""
+        try:
+            # Forget an R found earlier in the run, as the workers spawn
+            # the discovered Rscript rather than looking it up on PATH
+            with self.assertRaises(RNotFoundError):
+                discovery.refresh()
+            with self.assertRaises(RNotFoundError):
+                RWorker()
+            with self.assertRaises(RNotFoundError):
+                asyncio.run(AsyncRWorker.start())
+        finally:
+            os.environ["PATH"] = path
+
+
+class TestSchemaConversion(unittest.TestCase):
+    """Tests for output conversion driven by R type descriptors."""
+
+    def setUp(self):
+        # Conversion needs no R process, so skip the R check in __init__
+        self.rb = RBridge.__new__(RBridge)
+
+    def convert(self, value, schema, return_type="auto"):
+        return self.rb._convert_output(value, return_type, schema)
+
+    def test_scalars(self):
+        schema = {"class": ["numeric"], "typeof": "double", "length": 1}
+        self.assertIsInstance(self.convert(3, schema), float)
+        schema = {"class": ["integer"], "typeof": "integer", "length": 1}
+        out = self.convert(3, schema)
+        self.assertIsInstance(out, int)
+
+    def test_vector_dtype(self):
+        schema = {"class": ["integer"], "typeof": "integer", "length": 3}
+        self.assertEqual(self.convert([1, 2, 3], schema).dtype, np.int32)
+        out = self.convert([1, None, 3], schema)
+        self.assertEqual(out.dtype, np.float64)
+        self.assertTrue(np.isnan(out[1]))
+        schema = {"class": ["numeric"], "typeof": "double", "length": 2}
+        self.assertEqual(self.convert([1, 2], schema).dtype, np.float64)
+
+    def test_binary_vector_dtype(self):
+        # The same integer vector decoded from a binary buffer
+        buf = np.array([1, 2, 3], dtype="<i4").tobytes()
+        spec = {"__rtopy__": "array", "dtype": "i4", "shape": [3], "buffer": 0}
+        decoded = codec.decode(spec, [buf])
+        schema = {"class": ["integer"], "typeof": "integer", "length": 3}
+        self.assertEqual(self.convert(decoded, schema).dtype, np.int32)
+        self.assertEqual(
+            self.convert(decoded, schema).dtype,
+            self.convert([1, 2, 3], schema).dtype,
+        )
+
+    def test_stream_chunk_of_one(self):
+        schema = {"class": ["numeric"], "typeof": "double", "length": 1}
+        out = self.rb._convert_chunk(2.5, "auto", schema)
+        np.testing.assert_array_equal(out, np.array([2.5]))
+        out = self.rb._convert_chunk(2.5, "pandas", schema)
+        self.assertEqual(out.tolist(), [2.5])
+        schema = {"class": ["character"], "typeof": "character", "length": 1}
+        self.assertEqual(self.rb._convert_chunk("a", "auto", schema), ["a"])
+
+    def test_named_list_is_dict(self):
+        schema = {
+            "class": ["list"],
+            "typeof": "list",
+            "length": 2,
+            "names": ["a", "b"],
+        }
+        value = {"a": [1], "b": [2]}
+        self.assertEqual(self.convert(value, schema), value)
+
+    def test_matrix_dimnames(self):
+        schema = {
+            "class": ["matrix", "array"], "typeof": "double", "length": 4,
+            "dim": [2, 2], "dimnames": [["r1", "r2"], ["c1", "c2"]],
+        }
+        out = self.convert([[1, 2], [3, 4]], schema, "pandas")
+        self.assertEqual(list(out.index), ["r1", "r2"])
+        self.assertEqual(list(out.columns), ["c1", "c2"])
+        self.assertEqual(out.loc["r2", "c1"], 3.0)
+
+    def test_frame_factor_columns(self):
+        schema = {
+            "class": ["data.frame"], "typeof": "list", "length": 2,
+            "names": ["g", "n"],
+            "columns": [
+                {"class": ["factor"], "typeof": "integer", "length": 3,
+                 "levels": ["lo", "mid", "hi"]},
+                {"class": ["integer"], "typeof": "integer", "length": 3},
+            ],
+        }
+        out = self.convert({"g": ["hi", "lo", "hi"], "n": [1, 2, 3]}, schema)
+        self.assertIsInstance(out, pd.DataFrame)
+        self.assertEqual(list(out["g"].cat.categories), ["lo", "mid", "hi"])
+        self.assertEqual(out["n"].dtype, np.int32)
+
+    def test_sparse(self):
+        mat = sp.csc_matrix(np.array([[0.0, 1.0], [2.0, 0.0]]))
+        schema = {
+            "class": ["dgCMatrix"], "typeof": "S4", "length": 4, "dim": [2, 2],
+            "dimnames": [["r1", "r2"], None],
+        }
+        self.assertIs(self.convert(mat, schema), mat)
+        np.testing.assert_array_equal(
+            self.convert(mat, schema, "numpy"), mat.toarray()
+        )
+        out = self.convert(mat, schema, "pandas")
+        self.assertEqual(list(out.index), ["r1", "r2"])
+        self.assertEqual(out.sparse.density, 0.5)
+        out = self.convert([[1, 0], [0, 0]], None, "sparse")
+        self.assertEqual((out.format, out.nnz), ("csc", 1))
+
+    def test_classed_vectors_fall_back(self):
+        schema = {"class": ["Date"], "typeof": "double", "length": 2}
+        self.assertEqual(self.convert(["2024-01-01", "2024-01-02"], schema),
+                         ["2024-01-01", "2024-01-02"])
+
+
+class _FakeWorker:
+    """Stands in for an RWorker that is already gone."""
+
+    alive = False
+
+    def __init__(self):
+        self.discarded = []
+
+    def discard(self, object_id):
+        self.discarded.append(object_id)
+
+
+class TestObjectHandles(unittest.TestCase):
+    """Tests for `RObjectHandle` that need no R process."""
+
+    def test_needs_persistent_bridge(self):
+        rb = RBridge.__new__(RBridge)
+        rb.persistent = False
+        with self.assertRaises(ValueError):
+            rb._check_resident("handle")
+        self.assertFalse(rb._check_resident("auto"))
+
+    def test_garbage_collection_releases(self):
+        worker = _FakeWorker()
+        handle = RObjectHandle(worker, "abc", ["lm"], 1024)
+        self.assertFalse(handle.alive)
+        del handle
+        self.assertEqual(worker.discarded, ["abc"])
+
+    def test_released_handle_cannot_be_used(self):
+        worker = _FakeWorker()
+        handle = RObjectHandle(worker, "abc", ["lm"], 1024)
+        handle.release()
+        with self.assertRaises(ValueError):
+            handle._encode()
+        # Explicit release does not queue a second one
+        self.assertEqual(worker.discarded, [])
+
+
+class TestProfiles(unittest.TestCase):
+    """Tests for warm-start profiles."""
+
+    def test_register_profile(self):
+        register_profile("test-ts", preload=["stats"], setup="set.seed(1)")
+        self.assertEqual(
+            get_profile("test-ts"),
+            {"preload": ["stats"], "setup": "set.seed(1)"},
+        )
+        with self.assertRaises(ValueError):
+            get_profile("no-such-profile")
+
+    @unittest.skipUnless(HAS_R, "R is not installed")
+    def test_preload_and_setup(self):
+        register_profile("test-base", preload=["stats"])
+        code = "f <- function() c(scale_by, median(c(1, 5, 9)))"
+        with RBridge(
+            persistent=True, profile="test-base", preload=["utils"],
+            setup="scale_by <- 2",
+        ) as rb:
+            self.assertEqual(rb.call(code, "f", return_type="list"), [2, 5])
+            stats = rb.startup_stats
+            self.assertEqual(list(stats["packages"]), ["stats", "utils"])
+            self.assertGreaterEqual(stats["setup"], 0)
+            self.assertGreater(stats["startup"], 0)
+        self.assertEqual(
+            RBridge(setup="scale_by <- 2").call(code, "f", return_type="list"),
+            [2, 5],
+        )
+
+
+@unittest.skipUnless(HAS_R, "R is not installed")
+class TestPersistentBridge(unittest.TestCase):
+    """Tests for `RBridge(persistent=True)`."""
+
+    def setUp(self):
+        self.rb = RBridge(persistent=True)
+
+    def tearDown(self):
+        self.rb.close()
+
+    def test_reuses_worker(self):
+        code = "add <- function(x, y) x + y"
+        self.assertEqual(self.rb.call(code, "add", x=5, y=3), 8)
+        worker = self.rb._worker
+        self.assertEqual(self.rb.call(code, "add", x=1, y=2), 3)
+        self.assertIs(self.rb._worker, worker)
+
+    def test_code_sent_once(self):
+        code = "add <- function(x, y) x + y"
+        self.assertEqual(self.rb.call(code, "add", x=1, y=2), 3)
+        worker = self.rb._worker
+        self.assertIn(RBridge._code_key(code), worker.registered)
+        self.assertEqual(self.rb.call(code, "add", x=2, y=2), 4)
+        self.assertEqual(len(worker.registered), 1)
+
+    def test_compile(self):
+        with RBridge(persistent=True, compile=True) as rb:
+            code = (
+                "fib <- function(n) if (n < 2) n else fib(n - 1) + fib(n - 2)"
+            )
+            self.assertEqual(rb.call(code, "fib", n=10), 55)
+            self.assertEqual(rb.call(code, "fib", n=11), 89)
+
+    def test_result_cache(self):
+        from rtopy import ResultCache
+
+        with RBridge(persistent=True, cache=ResultCache()) as rb:
+            code = "noisy <- function(x) x + runif(1)"
+            x = np.arange(3.0)
+            first = rb.call(code, "noisy", return_type="list", x=x)
+            again = rb.call(code, "noisy", return_type="list", x=x)
+            self.assertEqual(again, first)
+            self.assertEqual((rb.cache.hits, rb.cache.misses), (1, 1))
+
+    def test_map(self):
+        code = "inv <- function(x) if (x == 0) stop('zero') else 1 / x"
+        kwargs_list = [{"x": x} for x in [1, 2, 0, 4]]
+        results = self.rb.map(code, "inv", kwargs_list, chunk_size=3)
+        self.assertEqual(results[:2] + results[3:], [1, 0.5, 0.25])
+        self.assertIsInstance(results[2], RExecutionError)
+        with self.assertRaises(RExecutionError):
+            self.rb.map(code, "inv", kwargs_list, return_exceptions=False)
+
+    def test_map_arrays(self):
+        code = "total <- function(x) sum(x)"
+        kwargs_list = [{"x": np.arange(float(n))} for n in range(1, 6)]
+        self.assertEqual(
+            RBridge().map(code, "total", kwargs_list, r_workers=2),
+            [0, 1, 3, 6, 10],
+        )
+
+    def test_stream(self):
+        code = (
+            "make <- function(n) "
+            "data.frame(i = seq_len(n), x = seq_len(n) / 2)"
+        )
+        chunks = list(self.rb.stream(code, "make", chunk_rows=4, n=10))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertEqual(df["i"].tolist(), list(range(1, 11)))
+        self.assertEqual(list(chunks[1].index), [0, 1, 2, 3])
+        code = "vals <- function(n) seq_len(n) * 1.5"
+        chunks = list(self.rb.stream(code, "vals", chunk_rows=4, n=5))
+        np.testing.assert_array_equal(chunks[-1], [7.5])
+
+    def test_stream_stopped_early(self):
+        code = "vals <- function(n) seq_len(n) * 1.5"
+        for chunk in self.rb.stream(code, "vals", chunk_rows=3, n=100):
+            np.testing.assert_array_equal(chunk, [1.5, 3.0, 4.5])
+            break
+        self.assertEqual(
+            self.rb.call(code, "vals", return_type="list", n=2), [1.5, 3.0]
+        )
+
+    def test_apply_chunks(self):
+        code = "colsum <- function(df, scale) sum(df$x) * scale"
+        parts = (
+            pd.DataFrame({"x": np.arange(i, i + 3.0)}) for i in range(0, 9, 3)
+        )
+        results = list(
+            self.rb.apply_chunks(code, "colsum", parts, arg="df", scale=2)
+        )
+        self.assertEqual(results, [6, 24, 42])
+
+    def test_reduce_chunks(self):
+        code = """
+        stats <- function(x) c(n = length(x), total = sum(x))
+        combine <- function(acc, value) acc + value
+        """
+        parts = [np.arange(5.0), np.arange(5.0, 10.0)]
+        in_r = self.rb.reduce_chunks(code, "stats", parts, "combine")
+        self.assertEqual(in_r, [10, 45])
+        in_python = self.rb.reduce_chunks(
+            code,
+            "stats",
+            parts,
+            lambda acc, x: [a + b for a, b in zip(acc, x)],
+            return_type="list",
+        )
+        self.assertEqual(in_python, [10, 45])
+        self.assertIsNone(self.rb.reduce_chunks(code, "stats", [], "combine"))
+
+    def test_matches_one_shot(self):
+        code = """summarize <- function(x) {
+            list(mean = mean(x), sd = sd(x), n = length(x))
+        }"""
+        expected = RBridge().call(
+            code, "summarize", return_type="dict", x=[1, 2, 3, 4, 5]
+        )
+        result = self.rb.call(
+            code, "summarize", return_type="dict", x=[1, 2, 3, 4, 5]
+        )
+        self.assertEqual(result, expected)
+
+    def test_binary_arrays(self):
+        code = "tr <- function(X) t(X)"
+        X = np.arange(6.0).reshape(2, 3)
+        result = self.rb.call(code, "tr", return_type="numpy", X=X)
+        np.testing.assert_array_equal(result, X.T)
+        self.assertEqual(
+            self.rb.call(code, "tr", return_type="list", X=X),
+            X.T.tolist(),
+        )
+
+    def test_frame_roundtrip(self):
+        code = "ident <- function(df) df"
+        df = pd.DataFrame(
+            {
+                "x": [1.0, 2.0],
+                "g": pd.Categorical(["a", "b"]),
+                "s": ["u", None],
+            }
+        )
+        out = self.rb.call(code, "ident", return_type="pandas", df=df)
+        self.assertEqual(list(out.columns), ["x", "g", "s"])
+        self.assertEqual(out["g"].dtype.name, "category")
+        self.assertTrue(out["s"].isna().iloc[1])
+
+    def test_sparse_roundtrip(self):
+        code = """scale_cols <- function(X, w) {
+            stopifnot(inherits(X, "dgCMatrix"))
+            X %*% Matrix::Diagonal(x = w)
+        }"""
+        X = sp.random(5000, 300, density=0.001, format="csr", random_state=1)
+        w = np.arange(1.0, 301.0)
+        out = self.rb.call(code, "scale_cols", X=X, w=w)
+        self.assertTrue(sp.issparse(out))
+        np.testing.assert_allclose(out.toarray(), (X @ sp.diags(w)).toarray())
+        pattern = "pat <- function(n) Matrix::sparseMatrix(i = 1:n, j = 1:n)"
+        out = self.rb.call(pattern, "pat", n=3)
+        self.assertEqual((out.dtype, out.nnz), (np.bool_, 3))
+
+    def test_shared_memory_buffers(self):
+        rb = RBridge(persistent=True, shm_threshold=1024)
+        try:
+            code = "double_it <- function(x) x * 2"
+            x = np.arange(10000.0)
+            out = rb.call(code, "double_it", return_type="numpy", x=x)
+            np.testing.assert_array_equal(out, x * 2)
+            worker = rb._worker
+        finally:
+            rb.close()
+        leftover = [
+            p
+            for p in os.listdir(worker.shm_dir)
+            if p.startswith(worker._shm_prefix)
+        ]
+        self.assertEqual(leftover, [])
+
+    def test_resident_object(self):
+        code = """
+        fit <- function(n) {
+            lm(y ~ x, data.frame(x = seq_len(n), y = 2 * seq_len(n)))
+        }
+        slope <- function(model, x) predict(model, data.frame(x = x))
+        """
+        model = self.rb.call(code, "fit", return_type="handle", n=100)
+        self.assertIn("lm", model.r_class)
+        self.assertGreater(model.footprint(), 0)
+        np.testing.assert_allclose(
+            self.rb.call(code, "slope", model=model, x=[1.0, 2.0]), [2.0, 4.0]
+        )
+        self.assertEqual(self.rb.resident_objects()["count"], 1)
+
+        model.release()
+        self.assertEqual(self.rb.resident_objects()["count"], 0)
+        with self.assertRaises(ValueError):
+            self.rb.call(code, "slope", model=model, x=[1.0])
+
+        with self.rb.call(code, "fit", return_type="handle", n=10) as other:
+            object_id = other.id
+        del other
+        self.assertNotIn(
+            object_id, [o["id"] for o in self.rb.resident_objects()["objects"]]
+        )
+
+    def test_handle_from_another_worker(self):
+        code = "make <- function() 1:3\nuse <- function(x) sum(x)"
+        handle = self.rb.call(code, "make", return_type="handle")
+        with RBridge(persistent=True) as other:
+            with self.assertRaises(RExecutionError):
+                other.call(code, "use", x=handle)
+
+    def test_error_keeps_worker(self):
+        from rtopy import RExecutionError
+
+        code = "fail <- function() stop('boom')"
+        with self.assertRaises(RExecutionError):
+            self.rb.call(code, "fail")
+        self.assertEqual(self.rb.call("one <- function() 1", "one"), 1)
+
+
+@unittest.skipUnless(HAS_R, "R is not installed")
+class TestAsyncBridge(unittest.TestCase):
+    """Tests for `RBridge.acall` and `RBridge.agather`."""
+
+    def test_acall(self):
+        rb = RBridge()
+        code = "add <- function(x, y) x + y"
+        result = asyncio.run(rb.acall(code, "add", x=2, y=3))
+        self.assertEqual(result, 5)
+
+    def test_persistent_across_event_loops(self):
+        code = "add <- function(x, y) x + y"
+
+        async def batch():
+            calls = [rb.acall(code, "add", x=i, y=1) for i in range(3)]
+            return await asyncio.gather(*calls)
+
+        with RBridge(persistent=True) as rb:
+            self.assertEqual(asyncio.run(batch()), [1, 2, 3])
+            # A new loop must not trip over a lock bound to the old one
+            self.assertEqual(asyncio.run(batch()), [1, 2, 3])
+
+    def test_one_shot_string_arguments(self):
+        rb = RBridge()
+        text = "it's a \\ \"quoted\" line\n"
+        self.assertEqual(
+            rb.call("ident <- function(s) s", "ident", s=text), text
+        )
+
+    def test_agather_keeps_order(self):
+        rb = RBridge()
+        code = "square <- function(x) x^2"
+        calls = [(code, "square", {"x": x}) for x in range(5)]
+        results = asyncio.run(rb.agather(calls, concurrency=2))
+        self.assertEqual(results, [0, 1, 4, 9, 16])
+
+    def test_timeout(self):
+        from rtopy import RExecutionError
+
+        rb = RBridge(timeout=1)
+        code = "slow <- function() { Sys.sleep(10); 1 }"
+        with self.assertRaises(RExecutionError):
+            asyncio.run(rb.acall(code, "slow"))
+
+
+@unittest.skipUnless(HAS_R, "R is not installed")
+class TestRBridgePool(unittest.TestCase):
+    """Tests for `RBridgePool`."""
+
+    def test_submit_in_order(self):
+        code = "square <- function(x) x^2"
+        with RBridgePool(size=2) as pool:
+            futures = [pool.submit(code, "square", x=x) for x in range(6)]
+            self.assertEqual(
+                [f.result() for f in futures], [0, 1, 4, 9, 16, 25]
+            )
+            self.assertEqual(pool.call(code, "square", x=3), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+"""Tests for `rtopy.cache`."""
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from click.testing import CliRunner
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from rtopy import RBridge, RObjectCache, ResultCache, cli
+from rtopy.cache import stable_hash
+
+HAS_R = shutil.which("Rscript") is not None
+
+
+class TestStableHash(unittest.TestCase):
+    """Tests for `stable_hash`."""
+
+    def test_dict_order_does_not_matter(self):
+        self.assertEqual(
+            stable_hash({"x": [1, 2], "y": "a"}),
+            stable_hash({"y": "a", "x": [1, 2]}),
+        )
+
+    def test_types_are_distinguished(self):
+        self.assertNotEqual(stable_hash(1), stable_hash(1.0))
+        self.assertNotEqual(stable_hash("1"), stable_hash(1))
+        self.assertNotEqual(stable_hash([1, 2]), stable_hash([[1, 2]]))
+
+    def test_arrays_hash_by_content(self):
+        a = np.arange(10.0)
+        self.assertEqual(stable_hash(a), stable_hash(a.copy()))
+        self.assertNotEqual(stable_hash(a), stable_hash(a.astype("i8")))
+        self.assertNotEqual(stable_hash(a), stable_hash(a.reshape(2, 5)))
+        b = a.copy()
+        b[3] = -1
+        self.assertNotEqual(stable_hash(a), stable_hash(b))
+
+    def test_sparse_hash_by_content(self):
+        m = sp.random(50, 20, density=0.1, format="csr", random_state=0)
+        self.assertEqual(stable_hash(m), stable_hash(m.tocsc()))
+        self.assertNotEqual(stable_hash(m), stable_hash(m * 2))
+        self.assertNotEqual(stable_hash(m), stable_hash(m.toarray()))
+
+    def test_frames_hash_by_content(self):
+        df = pd.DataFrame({"x": [1.0, np.nan], "s": ["a", None]})
+        self.assertEqual(stable_hash(df), stable_hash(df.copy()))
+        other = df.copy()
+        other.loc[1, "s"] = "b"
+        self.assertNotEqual(stable_hash(df), stable_hash(other))
+        self.assertNotEqual(stable_hash(df), stable_hash(df.set_index("s")))
+
+    def test_datetimes_hash_by_content(self):
+        df = pd.DataFrame(
+            {"t": pd.date_range("2024-01-01", periods=3), "x": [1.0, 2.0, 3.0]}
+        )
+        self.assertEqual(stable_hash(df), stable_hash(df.copy()))
+        later = df.assign(t=df["t"] + pd.Timedelta("1D"))
+        self.assertNotEqual(stable_hash(df), stable_hash(later))
+        deltas = np.array([1, 2], dtype="m8[s]")
+        self.assertNotEqual(
+            stable_hash(deltas), stable_hash(deltas.view("i8"))
+        )
+        rb = RBridge.__new__(RBridge)
+        rb.cache = ResultCache()
+        self.assertIsNotNone(rb._cache_key("code", "f", "auto", {"df": df}))
+
+    def test_unhashable(self):
+        with self.assertRaises(TypeError):
+            stable_hash(object())
+
+
+class TestResultCache(unittest.TestCase):
+    """Tests for `ResultCache`."""
+
+    def test_hits_and_misses(self):
+        cache = ResultCache()
+        self.assertEqual(cache.get("k"), (False, None))
+        cache.set("k", {"a": [1, 2]})
+        self.assertEqual(cache.get("k"), (True, {"a": [1, 2]}))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_values_are_copies(self):
+        cache = ResultCache()
+        cache.set("k", [1, 2])
+        cache.get("k")[1].append(3)
+        self.assertEqual(cache.get("k")[1], [1, 2])
+
+    def test_memory_eviction(self):
+        cache = ResultCache(max_bytes=2500)
+        for i in range(5):
+            cache.set(str(i), b"x" * 1000)
+        self.assertFalse(cache.get("0")[0])
+        self.assertTrue(cache.get("4")[0])
+        self.assertLessEqual(cache.stats()["memory_bytes"], 2500)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ResultCache(directory=tmp).set("k", np.arange(3))
+            cache = ResultCache(directory=tmp)
+            found, value = cache.get("k")
+            self.assertTrue(found)
+            np.testing.assert_array_equal(value, [0, 1, 2])
+
+            small = ResultCache(
+                max_bytes=0, directory=tmp, max_disk_bytes=3000
+            )
+            small.clear()
+            for i in range(5):
+                small.set(str(i), b"x" * 1000)
+            stats = small.stats()
+            self.assertLessEqual(stats["disk_bytes"], 3000)
+            self.assertEqual(stats["memory_entries"], 0)
+            self.assertTrue(small.get("4")[0])
+            self.assertEqual(
+                [n for n in os.listdir(tmp) if not n.endswith(".pkl")], []
+            )
+
+
+class TestRObjectCache(unittest.TestCase):
+    """Tests for `RObjectCache` and the `rtopy cache` commands."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def fill(self, cache, n, start=0, size=1000):
+        """Stand-ins for RDS files R would have written, oldest first."""
+        keys = []
+        for i in range(start, start + n):
+            key = cache.key("f <- function(i) i", "f", {"i": i})
+            with open(cache.path(key), "wb") as f:
+                f.write(b"x" * size)
+            os.utime(cache.path(key), (time.time() - 100 + i,) * 2)
+            cache.record(key, "f", {"class": ["lm"], "bytes": size})
+            keys.append(key)
+        return keys
+
+    def test_key(self):
+        cache = RObjectCache(self.tmp)
+        key = cache.key("c", "f", {"x": 1})
+        self.assertEqual(key, cache.key("c", "f", {"x": 1}))
+        self.assertNotEqual(key, cache.key("c", "f", {"x": 2}))
+        self.assertIsNone(cache.key("c", "f", {"x": object()}))
+        with self.assertRaises(ValueError):
+            RObjectCache(self.tmp, compress="zip")
+
+    def test_relative_directory(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        try:
+            cache = RObjectCache("models")
+        finally:
+            os.chdir(cwd)
+        # R is handed the paths, so they must not depend on its cwd
+        directory = os.path.join(os.path.realpath(self.tmp), "models")
+        self.assertEqual(os.path.realpath(cache.directory), directory)
+        self.assertTrue(os.path.isabs(cache.path("k")))
+
+    def test_lru_eviction(self):
+        cache = RObjectCache(self.tmp, max_bytes=3500)
+        keys = self.fill(cache, 3)
+        self.assertEqual(cache.lookup(keys[0]), cache.path(keys[0]))
+        self.fill(cache, 2, start=3)
+        remaining = {e["key"] for e in cache.entries()}
+        self.assertLessEqual(cache.stats()["bytes"], 3500)
+        # The entry looked up most recently survives older ones
+        self.assertIn(keys[0], remaining)
+        self.assertNotIn(keys[1], remaining)
+        self.assertEqual(cache.entries()[0]["func"], "f")
+
+    def test_record_without_file(self):
+        cache = RObjectCache(self.tmp)
+        cache.record("missing", "f", {"class": ["lm"], "bytes": 1})
+        self.assertEqual(cache.entries(), [])
+        self.assertIsNone(cache.lookup("missing"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_cli(self):
+        cache = RObjectCache(self.tmp)
+        self.fill(cache, 3)
+        runner = CliRunner()
+        result = runner.invoke(cli.main, ["cache", "list", self.tmp])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("3 object(s)", result.output)
+        self.assertIn("lm", result.output)
+
+        result = runner.invoke(
+            cli.main, ["cache", "prune", self.tmp, "--max-size", "2K"]
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(cache.entries()), 2)
+        result = runner.invoke(cli.main, ["cache", "prune", self.tmp])
+        self.assertNotEqual(result.exit_code, 0)
+
+        result = runner.invoke(cli.main, ["cache", "clear", self.tmp, "--yes"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    @unittest.skipUnless(HAS_R, "R is not installed")
+    def test_bridge_loads_saved_object(self):
+        code = (
+            "fit <- function(n) "
+            "{ Sys.sleep(0.5); lm(y ~ x, data.frame(x = 1:n, y = 1:n)) }"
+        )
+        cache = RObjectCache(self.tmp, compress="xz")
+        with RBridge(persistent=True, object_cache=cache) as rb:
+            first = rb.call(code, "fit", return_type="handle", n=10)
+        self.assertEqual(len(cache.entries()), 1)
+        with RBridge(persistent=True, object_cache=cache) as rb:
+            second = rb.call(code, "fit", return_type="handle", n=10)
+            self.assertTrue(rb.last_call_stats["cached"])
+            self.assertEqual(second.r_class, first.r_class)
+            code = "n <- function(m) length(coef(m))"
+            self.assertEqual(rb.call(code, "n", m=second), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
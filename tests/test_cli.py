@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""Tests for `rtopy.cli`."""
+
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+
+from rtopy import cli
+
+HAS_R = shutil.which("Rscript") is not None
+
+SCRIPT = """score <- function(data, offset = 0) {
+    data.frame(id = data$id, score = data$x * 2 + offset)
+}"""
+
+
+def _done(value=None, error=None):
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
+    return future
+
+
+class TestEntryPoint(unittest.TestCase):
+    """Tests for the `rtopy` console script."""
+
+    def test_without_click(self):
+        # The console script points at rtopy.__main__, not at the click
+        # group, so a missing click gives a hint instead of a traceback
+        code = (
+            "import sys; sys.modules['click'] = None; "
+            "from rtopy.__main__ import main; main()"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True
+        )
+        self.assertEqual(proc.returncode, 1)
+        self.assertIn("pip install rtopy[cli]", proc.stderr)
+
+
+class TestRunHelpers(unittest.TestCase):
+    """Tests for the pieces of `rtopy run` that need no R."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def write_inputs(self, n=3, rows=10):
+        paths = []
+        for i in range(n):
+            path = os.path.join(self.tmp, f"part{i}.csv")
+            frame = pd.DataFrame(
+                {"id": range(rows), "x": np.arange(rows) * (i + 1.0)}
+            )
+            frame.to_csv(path, index=False)
+            paths.append(path)
+        return paths
+
+    def test_expand_inputs(self):
+        paths = self.write_inputs()
+        pattern = os.path.join(self.tmp, "*.csv")
+        self.assertEqual(
+            cli._expand_inputs([paths[1], pattern]),
+            [paths[1], paths[0], paths[2]],
+        )
+        with self.assertRaises(Exception):
+            cli._expand_inputs([os.path.join(self.tmp, "*.parquet")])
+
+    def test_read_chunks(self):
+        path = self.write_inputs(n=1, rows=10)[0]
+        sizes = [len(c) for c in cli._read_chunks(path, 4)]
+        self.assertEqual(sizes, [4, 4, 2])
+        sizes = [len(c) for c in cli._read_chunks(path, None)]
+        self.assertEqual(sizes, [10])
+
+    def test_as_frame(self):
+        self.assertEqual(list(cli._as_frame([1, 2]).columns), ["value"])
+        self.assertEqual(cli._as_frame(np.ones((2, 3))).shape, (2, 3))
+        self.assertEqual(cli._as_frame(3.5).iloc[0, 0], 3.5)
+
+    def test_output_in_order(self):
+        out = cli._Output("in.csv", os.path.join(self.tmp, "out.csv"))
+        later = Future()
+        out.pending.extend([(later, 1), (_done(pd.DataFrame({"v": [2]})), 1)])
+        out.read = True
+        out.flush()
+        # The second chunk waits for the first
+        self.assertEqual((out.chunks, len(out.pending)), (0, 2))
+        later.set_result(pd.DataFrame({"v": [1]}))
+        out.flush()
+        self.assertTrue(out.finished)
+        self.assertEqual(pd.read_csv(out.path)["v"].tolist(), [1, 2])
+
+    def test_failed_output_is_removed(self):
+        out = cli._Output("in.csv", os.path.join(self.tmp, "out.csv"))
+        out.pending.extend(
+            [
+                (_done(pd.DataFrame({"v": [1]})), 1),
+                (_done(error=ValueError("R")), 1),
+            ]
+        )
+        out.flush()
+        self.assertIsInstance(out.error, ValueError)
+        self.assertFalse(os.path.exists(out.path))
+
+    def test_usage_errors(self):
+        runner = CliRunner()
+        script = os.path.join(self.tmp, "score.R")
+        with open(script, "w") as f:
+            f.write(SCRIPT)
+        result = runner.invoke(
+            cli.main, ["run", script, "--func", "score", "-o", self.tmp]
+        )
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("no input files", result.output)
+        result = runner.invoke(
+            cli.main,
+            ["run", script, "-f", "score", "-i", "missing.csv",
+             "-o", self.tmp],
+        )
+        self.assertNotEqual(result.exit_code, 0)
+        result = runner.invoke(
+            cli.main,
+            ["run", script, "-f", "score", "-o", self.tmp, "-w", "0"],
+        )
+        # A usage error from click, not a ValueError from the pool
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("--workers", result.output)
+
+    @unittest.skipUnless(HAS_R, "R is not installed")
+    def test_run(self):
+        paths = self.write_inputs(n=3, rows=1000)
+        script = os.path.join(self.tmp, "score.R")
+        with open(script, "w") as f:
+            f.write(SCRIPT)
+        out_dir = os.path.join(self.tmp, "out")
+        result = CliRunner().invoke(
+            cli.main,
+            ["run", script, "-f", "score", "-o", out_dir, "--workers", "2",
+             "--chunk-size", "300", "-p", "offset=1"] + paths,
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("3/3 file(s), 12 chunk(s), 3,000 rows", result.output)
+        scored = pd.read_csv(os.path.join(out_dir, "part2.csv"))
+        self.assertEqual(scored["id"].tolist(), list(range(1000)))
+        np.testing.assert_allclose(scored["score"], np.arange(1000) * 6.0 + 1)
+
+
+def _record(total, error=None):
+    return {
+        "total": total,
+        "phases": {"encode": 0.001, "r_call": total / 2},
+        "bytes_out": 100,
+        "bytes_in": 300,
+        "error": error,
+    }
+
+
+class TestBench(unittest.TestCase):
+    """Tests for `rtopy bench`."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(cli._percentile(values, 50), 50.5)
+        self.assertAlmostEqual(cli._percentile(values, 99), 99.01)
+        self.assertEqual(cli._percentile([3.0], 95), 3.0)
+
+    def test_summarize(self):
+        records = [_record(t / 1000) for t in range(1, 101)]
+        summary = cli._summarize(records + [_record(9.0, "boom")], 0.5)
+        self.assertEqual((summary["calls"], summary["errors"]), (101, 1))
+        self.assertEqual(summary["calls_per_sec"], 200)
+        self.assertAlmostEqual(summary["latency"]["p50"], 0.0505)
+        self.assertAlmostEqual(summary["phases"]["r_call"], 0.0505 / 2)
+        self.assertAlmostEqual(summary["overhead"], 0.0505 / 2)
+        self.assertEqual(summary["bytes_in"], 300)
+        self.assertNotIn("latency", cli._summarize([_record(1, "boom")], 1))
+
+    def test_options(self):
+        self.assertEqual(cli._parse_workers("1,2, 4"), [1, 2, 4])
+        for bad in ("", "0,1", "two"):
+            with self.assertRaises(Exception):
+                cli._parse_workers(bad)
+        path = os.path.join(self.tmp, "args.json")
+        with open(path, "w") as f:
+            json.dump(
+                [{"x": [1, 2, 3], "label": "a"}, {"x": [4.5], "label": ["b"]}],
+                f,
+            )
+        calls = cli._load_args(path, arrays=True)
+        self.assertIsInstance(calls[0]["x"], np.ndarray)
+        self.assertEqual(calls[1]["label"], ["b"])
+        self.assertEqual(cli._load_args(None, arrays=False), [{}])
+
+    @unittest.skipUnless(HAS_R, "R is not installed")
+    def test_bench(self):
+        script = os.path.join(self.tmp, "f.R")
+        with open(script, "w") as f:
+            f.write("f <- function(x) sum(x)")
+        args = os.path.join(self.tmp, "args.json")
+        with open(args, "w") as f:
+            f.write('{"x": [1, 2, 3]}')
+        out = os.path.join(self.tmp, "bench.json")
+        result = CliRunner().invoke(
+            cli.main,
+            ["bench", script, "-f", "f", "--args", args, "-n", "20",
+             "-w", "1,2", "--cold-runs", "1", "--json", out],
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("r_call ms", result.output)
+        with open(out) as f:
+            runs = json.load(f)["runs"]
+        self.assertEqual([r["workers"] for r in runs], [1, 2])
+        self.assertEqual(runs[0]["calls"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""Tests for `rtopy.discovery`."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rtopy import discovery
+
+HAS_R = shutil.which("Rscript") is not None
+
+OUTPUT = """version=4.3.2
+os=unix
+jsonlite=TRUE
+capability.jpeg=FALSE
+capability.fifo=TRUE
+"""
+
+
+class TestDiscovery(unittest.TestCase):
+    """Tests for R discovery and its on-disk cache."""
+
+    def test_parse(self):
+        r = discovery._parse("/usr/bin/Rscript", OUTPUT)
+        self.assertEqual(
+            (r.version, r.os_type, r.jsonlite), ("4.3.2", "unix", True)
+        )
+        self.assertEqual(r.capabilities, {"jpeg": False, "fifo": True})
+
+    def test_persisted_result_is_keyed(self):
+        r = discovery._parse("/usr/bin/Rscript", OUTPUT)
+        key = {
+            "path": "/usr/bin",
+            "rscript": "/usr/bin/Rscript",
+            "mtime": 1,
+            "size": 2,
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "r.json")
+            discovery._save(path, key, r)
+            self.assertEqual(discovery._load(path, key).to_dict(), r.to_dict())
+            moved = dict(key, path="/opt/R/bin")
+            self.assertIsNone(discovery._load(path, moved))
+            missing = os.path.join(tmp, "missing")
+            self.assertIsNone(discovery._load(missing, key))
+
+    @unittest.skipUnless(HAS_R, "R is not installed")
+    def test_probed_once(self):
+        first = discovery.find_r()
+        self.assertIs(discovery.find_r(), first)
+        self.assertIsNot(discovery.refresh(), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
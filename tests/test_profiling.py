@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""Tests for `rtopy.profiling`."""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rtopy import RBridge, RProfile
+from rtopy.stats import CallStats
+
+HAS_R = shutil.which("Rscript") is not None
+
+CODE = """train <- function(n) {
+    x <- rnorm(n)
+    fit(x)
+}
+fit <- function(x) {
+    sort(x)
+}"""
+
+# Innermost frame first, as Rprof writes them; everything from
+# .rtopy_profile_root outwards belongs to the worker.
+ROOT = '"do.call" ".rtopy_profile_root" ".rtopy_profile" ".rtopy_call"'
+RPROF = "\n".join(
+    [
+        "memory profiling: line profiling: sample.interval=10000",
+        "#File 1: <text>",
+        f':100:0:1000:0:"rnorm" 1#2 "train" {ROOT}',
+        f':200:0:1000:0:"sort" 1#6 "fit" 1#3 "train" {ROOT}',
+        f':150:10:1000:0:"sort" 1#6 "fit" 1#3 "train" {ROOT}',
+        ':150:10:1000:0:"Rprof" ".rtopy_profile" ".rtopy_call"',
+    ]
+)
+
+
+class TestRProfile(unittest.TestCase):
+    """Tests for `RProfile`."""
+
+    def setUp(self):
+        self.prof = RProfile.parse(RPROF, CODE)
+
+    def test_samples(self):
+        self.assertEqual(len(self.prof.samples), 3)
+        self.assertTrue(self.prof.memory)
+        self.assertAlmostEqual(self.prof.total_time, 0.03)
+        self.assertEqual(
+            self.prof.samples[1][0], (("train", 3), ("fit", 6), ("sort", None))
+        )
+
+    def test_functions(self):
+        functions = self.prof.functions()
+        self.assertEqual(list(functions)[0], "sort")
+        self.assertAlmostEqual(functions["sort"]["self_time"], 0.02)
+        self.assertAlmostEqual(functions["train"]["total_time"], 0.03)
+        self.assertEqual(functions["train"]["self_time"], 0.0)
+        # 100 more small vector cells of 8 bytes, then none
+        self.assertEqual(functions["sort"]["self_bytes"], 800)
+
+    def test_lines(self):
+        lines = self.prof.lines()
+        self.assertAlmostEqual(lines[("fit", 6)]["self_time"], 0.02)
+        self.assertEqual(lines[("fit", 6)]["source"], "sort(x)")
+        self.assertEqual(lines[("train", 2)]["source"], "x <- rnorm(n)")
+
+    def test_folded(self):
+        self.assertEqual(
+            self.prof.folded(),
+            "train:2;rnorm 1\ntrain:3;fit:6;sort 2\n",
+        )
+        self.assertEqual(self.prof.folded(lines=False, weight="bytes"),
+                         "train;fit;sort 800\n")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.folded")
+            self.prof.dump_folded(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), self.prof.folded())
+
+    def test_empty(self):
+        self.assertEqual(RProfile.parse("").functions(), {})
+
+
+class TestProfileArguments(unittest.TestCase):
+    """Profiler options must not take argument names from R functions."""
+
+    def test_profile_is_an_r_argument(self):
+        rb = RBridge.__new__(RBridge)
+        rb._stats = CallStats()
+        seen = []
+        rb._timed_call = lambda *args: seen.append(args) or "ok"
+        rb.call("f <- function(profile) profile", "f", profile="fast")
+        _, _, _, kwargs, _, settings = seen[0]
+        self.assertEqual(kwargs, {"profile": "fast"})
+        self.assertIsNone(settings)
+        rb.call("f <- function(n) n", "f", rprof_memory=True, n=1)
+        self.assertTrue(seen[1][5]["memory"])
+
+
+@unittest.skipUnless(HAS_R, "R is not installed")
+class TestProfiledCall(unittest.TestCase):
+    """Tests for `RBridge.call(rprof=True)`."""
+
+    def test_persistent(self):
+        code = """slow <- function(n) {
+            s <- 0
+            for (i in seq_len(n)) s <- s + sqrt(i)
+            s
+        }"""
+        with RBridge(persistent=True) as rb:
+            self.assertGreater(rb.call(code, "slow", n=10), 0)
+            value, prof = rb.call(
+                code, "slow", rprof_memory=True, n=2_000_000
+            )
+            self.assertGreater(value, 0)
+            self.assertIsInstance(prof, RProfile)
+            self.assertIn("slow", prof.functions())
+            self.assertTrue(prof.memory)
+            self.assertTrue(all(name == "slow" for name, _ in prof.lines()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,11 +3,19 @@
 """Tests for `rtopy` package."""
 
 
+import shutil
+import subprocess
+import sys
 import unittest
 from click.testing import CliRunner
 
+import numpy as np
+
 import rtopy as rp 
 from rtopy import cli
+from rtopy.rtopy import _RETURN_TYPES, _plain
+
+HAS_R = shutil.which("Rscript") is not None
 
 
 class TestRtopy(unittest.TestCase):
@@ -98,9 +106,82 @@ class TestRtopy(unittest.TestCase):
     def test_command_line_interface(self):
         """Test the CLI."""
         runner = CliRunner()
-        result = runner.invoke(cli.main)
-        assert result.exit_code == 0
-        assert 'rtopy.cli.main' in result.output
         help_result = runner.invoke(cli.main, ['--help'])
         assert help_result.exit_code == 0
         assert '--help  Show this message and exit.' in help_result.output
+        assert 'cache' in help_result.output
+
+
+class TestCallfuncTransport(unittest.TestCase):
+    """`callfunc` on structured results instead of printed output."""
+
+    def test_conversions(self):
+        value = _plain({"x": np.arange(3.0), "y": np.ones((2, 2)), "z": [5]})
+        self.assertEqual(
+            _RETURN_TYPES["dict"](value),
+            {"x": [0.0, 1.0, 2.0], "y": [[1.0, 1.0], [1.0, 1.0]], "z": 5},
+        )
+        self.assertEqual(
+            _RETURN_TYPES["dict"]([[1, 2], 3]), {"1": [1, 2], "2": 3}
+        )
+        matrix = _plain(np.arange(4).reshape(2, 2))
+        self.assertEqual(_RETURN_TYPES["list"](matrix), [[0, 1], [2, 3]])
+        self.assertEqual(_RETURN_TYPES["int"](_plain(np.array([30.0]))), 30)
+
+    def test_unknown_return_type(self):
+        with self.assertRaises(rp.RTypeError):
+            rp.callfunc(type_return="tuple")
+
+    @unittest.skipUnless(HAS_R, "R is not installed")
+    def test_matches_legacy(self):
+        cases = [
+            ("my_func <- function(n) {{ n / 2 }}", "float"),
+            ("my_func <- function(n) {{ seq_len(n) / 2 }}", "list"),
+            (
+                """my_func <- function(n) {{
+                    X <- matrix(seq_len(n * 2) / 2, n, 2);
+                    list(x = X[, 1], y = X, z = n)
+                }}""",
+                "dict",
+            ),
+        ]
+        for r_code, type_return in cases:
+            self.assertEqual(
+                rp.callfunc(r_code, "my_func", type_return, n=3),
+                rp.callfunc_legacy(r_code, "my_func", type_return, n=3),
+            )
+
+    @unittest.skipUnless(HAS_R, "R is not installed")
+    def test_keeps_every_value(self):
+        # The text parser drops values printed in scientific notation
+        r_code = (
+            "my_func <- function(n) {{ matrix(c(1.5, 2, -2e-10, 3), n, 2) }}"
+        )
+        self.assertEqual(
+            rp.callfunc(r_code, "my_func", "list", n=2),
+            [[1.5, -2e-10], [2, 3]],
+        )
+
+
+class TestImport(unittest.TestCase):
+    """Keep `import rtopy` cheap."""
+
+    # Generous, to stay stable on slow machines; pandas alone costs more.
+    BUDGET = 0.25
+
+    def test_import_is_lazy(self):
+        code = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import rtopy\n"
+            "elapsed = time.perf_counter() - start\n"
+            "print(elapsed, 'numpy' in sys.modules, 'pandas' in sys.modules)\n"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        self.assertEqual(out[1:], ["False", "False"])
+        self.assertLess(float(out[0]), self.BUDGET)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""Tests for `rtopy.stats`."""
+
+
+import shutil
+import unittest
+
+from rtopy import RBridge, ResultCache
+from rtopy.stats import CallStats, CallTimer, Histogram
+
+HAS_R = shutil.which("Rscript") is not None
+
+
+class TestCallTimer(unittest.TestCase):
+    """Tests for `CallTimer`."""
+
+    def test_phases_are_summed(self):
+        timer = CallTimer("call", "f")
+        timer.add("encode", 0.0, 0.5)
+        timer.add("encode", 1.0, 0.25)
+        timer.finish()
+        call = timer.to_dict()
+        self.assertEqual(call["phases"], {"encode": 0.75})
+        self.assertEqual(len(call["spans"]), 2)
+        self.assertIsNone(call["error"])
+
+    def test_remote_phases(self):
+        timer = CallTimer("call", "f")
+        timing = {"r_call": 1.5, "r_parse": 0.25}
+        timer.add_remote(1.0, 2.0, timing, "transfer")
+        spans = [(s["name"], s["start"], s["duration"]) for s in timer.spans]
+        self.assertEqual(
+            spans,
+            [
+                ("r_parse", 1.0, 0.25),
+                ("r_call", 1.25, 1.5),
+                ("transfer", 2.75, 0.25),
+            ],
+        )
+
+    def test_remote_phases_are_clamped(self):
+        # R's clock may disagree slightly with Python's
+        timer = CallTimer("call", "f")
+        timer.add_remote(0.0, 1.0, {"r_call": 1.2}, "transfer")
+        self.assertEqual(
+            timer.to_dict()["phases"], {"r_call": 1.0, "transfer": 0.0}
+        )
+
+    def test_error(self):
+        timer = CallTimer("call", "f")
+        timer.finish(ValueError("bad"))
+        self.assertEqual(timer.to_dict()["error"], "ValueError: bad")
+
+
+class TestCallStats(unittest.TestCase):
+    """Tests for `CallStats` and `Histogram`."""
+
+    def test_histogram(self):
+        hist = Histogram((1.0, 10.0, float("inf")))
+        for value in (0.5, 1.0, 2.0, 50.0):
+            hist.add(value)
+        out = hist.to_dict()
+        self.assertEqual([c for _, c in out["buckets"]], [2, 1, 1])
+        self.assertEqual(
+            (out["count"], out["min"], out["max"]), (4, 0.5, 50.0)
+        )
+
+    def test_record_and_hooks(self):
+        stats = CallStats()
+        seen = []
+        stats.hooks.append(seen.append)
+        stats.hooks.append(lambda call: 1 / 0)
+        timer = CallTimer("call", "f")
+        timer.add("convert", 0.0, 0.1)
+        timer.bytes_out = 100
+        timer.finish()
+        with self.assertWarns(RuntimeWarning):
+            stats.record(timer)
+        self.assertEqual(seen, [stats.last])
+        out = stats.to_dict()
+        self.assertEqual(out["calls"], 1)
+        self.assertEqual(out["phases"]["convert"]["count"], 1)
+        self.assertEqual(out["bytes_out"]["total"], 100)
+        stats.reset()
+        self.assertEqual(stats.to_dict()["calls"], 0)
+
+
+@unittest.skipUnless(HAS_R, "R is not installed")
+class TestBridgeStats(unittest.TestCase):
+    """Tests for `RBridge.last_call_stats` and `RBridge.stats`."""
+
+    def test_persistent_call(self):
+        calls = []
+        with RBridge(persistent=True, cache=ResultCache()) as rb:
+            rb.add_hook(calls.append)
+            code = "f <- function(x) x * 2"
+            rb.call(code, "f", x=[1.0, 2.0, 3.0])
+            phases = rb.last_call_stats["phases"]
+            for name in (
+                "encode", "spawn", "send", "r_parse", "r_call", "decode"
+            ):
+                self.assertIn(name, phases)
+            self.assertGreater(rb.last_call_stats["bytes_in"], 0)
+
+            rb.call(code, "f", x=[1.0, 2.0, 3.0])
+            self.assertTrue(rb.last_call_stats["cached"])
+            rb.call(code, "f", x=[4.0])
+            self.assertNotIn("spawn", rb.last_call_stats["phases"])
+
+            stats = rb.stats()
+            self.assertEqual((stats["calls"], stats["cached"]), (3, 1))
+            self.assertEqual(len(calls), 3)
+
+    def test_one_shot_error(self):
+        rb = RBridge()
+        with self.assertRaises(Exception):
+            rb.call("f <- function() stop('no')", "f")
+        self.assertIn("shutdown", rb.last_call_stats["phases"])
+        self.assertIsNotNone(rb.last_call_stats["error"])
+        self.assertEqual(rb.stats()["errors"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()